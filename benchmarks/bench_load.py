@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Kuormitustesti: N samanaikaista simuloitua sessiota ajaa chat-vuoron putken
+(start_conversation → viestin tallennus → promptin rakennus → OpenAI-kutsu → tallennus)
+paikallista OpenAI-tynkää vasten (benchmarks/openai_stub.py, säädettävä viive ja striimaus).
+
+Jokainen (backend, sessiomäärä) -ajo on oma Python-prosessinsa ja oma tyhjä SQLite-kantansa;
+sessiot ovat säikeitä kuten Streamlitissä. Backendit:
+
+    sqlite   väliaikainen chatlogs.db
+    pg       paikallinen Postgres (--pg-url tai BENCH_PG_URL, esim. docker run -p 5432:5432 postgres)
+
+Raportti: vuoron latenssi p50/p95/p99, TTFT, läpäisy (vuoroa/s), tietokanta-aika
+(vuoron sisällä odotettu + taustakirjoittajan aika) ja sovelluksen oma overhead (vuoro − LLM).
+
+    python benchmarks/bench_load.py --sessions 1 10 50 --turns 5 --backend sqlite pg --json load.json
+    python benchmarks/bench_load.py --sessions 10 --compare load.json     # muutos edelliseen ajoon
+
+--sync-writes ajaa tallennukset vuoron sisällä (WRITE_BEHIND=0), jolloin kannan odotus näkyy latenssissa.
+"""
+
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+QUESTIONS = [
+    "Hei, olen Liisa rekrytoija yrityksestä Acme. Kerro Henryn kokemuksesta.",
+    "Millaisia KPI-mittareita käyttäisit asiakaspalvelun Copilotille?",
+    "Miten hoitaisit AI Act -governancen ja audit trailin?",
+    "Onko Henryllä kokemusta HubSpotista ja Salesforcesta?",
+    "Miten rakentaisit sisäisen RAG-tietohaun ohjeille?",
+    "Kerro lisää fraud- ja AML-riskimalleista.",
+    "Mitä Henry tekisi ensimmäisen 90 päivän aikana?",
+    "Voitko varata ajan kalenteriin?",
+]
+
+
+def pct(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    import numpy as np
+    return round(float(np.percentile(values, q)), 2)
+
+
+def summary(values: List[float]) -> Dict[str, float]:
+    return {"p50": pct(values, 50), "p95": pct(values, 95), "p99": pct(values, 99),
+            "max": round(max(values), 2) if values else 0.0}
+
+
+# ============== Lapsiprosessi: yksi ajo ==============
+def child(cfg: Dict[str, Any]) -> Dict[str, Any]:
+    from henry_agent import db
+    from henry_agent.bootstrap import bootstrap
+    from henry_agent.context import ContextState, ContextWindow
+    from henry_agent.llm import DEFAULT_MODEL, call_chat, get_client, stream_chat
+    from henry_agent.persona import build_system_prompt
+    from henry_agent.retrieval import format_context, retrieval_index
+    from henry_agent.rules import analyze
+
+    boot = bootstrap()
+    if boot["backend"] != cfg["backend"]:
+        return {"error": f"backend {cfg['backend']} ei käytettävissä (bootstrap: {boot['backend']})"}
+    client = get_client()
+    context = ContextWindow.from_settings(model=DEFAULT_MODEL)
+    retrieval_index().refresh()   # indeksi rakennetaan ennen mittausta
+
+    lock = threading.Lock()
+    turns: List[Dict[str, float]] = []
+    errors: List[str] = []
+    start = threading.Barrier(cfg["sessions"])
+
+    def timed_db(samples: List[float], fn, *a: Any) -> Any:
+        t0 = time.perf_counter()
+        try:
+            return fn(*a)
+        finally:
+            samples.append((time.perf_counter() - t0) * 1000)
+
+    def session(sid: int) -> None:
+        rnd = random.Random(sid)
+        state: Dict[str, Any] = {"use_postgres": cfg["backend"] == "pg"}
+        save = db.save_message if cfg["sync_writes"] else db.enqueue_message
+        start.wait()
+        db_ms: List[float] = []
+        conv_id = timed_db(db_ms, db.start_conversation, state, f"bench-{sid}", "bench_load")
+        messages: List[Dict[str, str]] = []
+        ctx_state = ContextState()
+        for turn in range(cfg["turns"]):
+            msg = QUESTIONS[(sid + turn) % len(QUESTIONS)]
+            t0 = time.perf_counter()
+            timings: Dict[str, float] = {}
+            try:
+                messages.append({"role": "user", "content": msg})
+                timed_db(db_ms, save, state, conv_id, "user", msg)
+                signals = analyze(msg)
+                if turn == 0:
+                    prompt = build_system_prompt(signals.audience, retrieval=True)
+                    messages.insert(0, {"role": "system", "content": prompt})
+                    timed_db(db_ms, db.attach_prompt, state, conv_id, prompt)
+                ctx_text = format_context(retrieval_index().search(msg))
+                extra = [{"role": "system", "content": ctx_text}] if ctx_text else []
+                prompt_messages, stats = context.build(messages, ctx_state, extra=extra)
+                t_llm = time.perf_counter()
+                if cfg["stream"]:
+                    reply = "".join(stream_chat(client, prompt_messages, timings))
+                else:
+                    reply = call_chat(client, prompt_messages)
+                    timings["ttft_s"] = timings["total_s"] = time.perf_counter() - t_llm
+                final = (f"_{signals.hook}_\n\n" if signals.hook else "") + reply
+                messages.append({"role": "assistant", "content": final})
+                timed_db(db_ms, save, state, conv_id, "assistant", final)
+                total_ms = (time.perf_counter() - t0) * 1000
+                with lock:
+                    turns.append({
+                        "total_ms": total_ms,
+                        "ttft_ms": (timings.get("ttft_s", 0.0) + (t_llm - t0)) * 1000,
+                        "llm_ms": timings.get("total_s", 0.0) * 1000,
+                        "db_ms": sum(db_ms),
+                        "prompt_tokens": stats["prompt_tokens"],
+                    })
+            except Exception as e:
+                with lock:
+                    errors.append(f"{e.__class__.__name__}: {e}"[:200])
+            db_ms = []
+            if cfg["think_ms"]:
+                time.sleep(cfg["think_ms"] * rnd.uniform(0.5, 1.5) / 1000)
+
+    threads = [threading.Thread(target=session, args=(i,), daemon=True) for i in range(cfg["sessions"])]
+    t_start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - t_start
+    t_flush = time.perf_counter()
+    db.flush_messages(timeout=120)
+    flush_ms = (time.perf_counter() - t_flush) * 1000
+    writer = db.message_logger()
+
+    total = [t["total_ms"] for t in turns]
+    return {
+        "backend": cfg["backend"],
+        "sessions": cfg["sessions"],
+        "turns_per_session": cfg["turns"],
+        "stream": cfg["stream"],
+        "sync_writes": cfg["sync_writes"],
+        "turns_ok": len(turns),
+        "errors": len(errors),
+        "error_samples": sorted(set(errors))[:5],
+        "wall_s": round(wall, 3),
+        "throughput_turns_s": round(len(turns) / wall, 2) if wall else 0.0,
+        "latency_ms": summary(total),
+        "ttft_ms": summary([t["ttft_ms"] for t in turns]),
+        "overhead_ms": summary([t["total_ms"] - t["llm_ms"] for t in turns]),
+        "db": {
+            "in_turn_ms": summary([t["db_ms"] for t in turns]),
+            "in_turn_total_ms": round(sum(t["db_ms"] for t in turns), 1),
+            "final_flush_ms": round(flush_ms, 1),
+            "writer": dict(writer.stats) if writer is not None and not cfg["sync_writes"] else None,
+        },
+        "prompt_tokens_p50": pct([t["prompt_tokens"] for t in turns], 50),
+    }
+
+
+# ============== Pääprosessi ==============
+def git_rev() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, timeout=10).stdout.strip()
+    except Exception:
+        return ""
+
+
+def run_one(backend: str, sessions: int, args: argparse.Namespace, base_url: str, workdir: str) -> Dict[str, Any]:
+    cfg = {"backend": backend, "sessions": sessions, "turns": args.turns, "stream": not args.no_stream,
+           "think_ms": args.think_ms, "sync_writes": args.sync_writes}
+    env = dict(os.environ)
+    env.update({
+        "OPENAI_API_KEY": "sk-bench",
+        "OPENAI_BASE_URL": base_url,
+        "CHATLOG_DB_PATH": os.path.join(workdir, f"chatlogs-{backend}-{sessions}.db"),
+        "DATABASE_URL": args.pg_url if backend == "pg" else "",
+        "PG_SSLMODE": os.environ.get("PG_SSLMODE", "disable"),
+        "ANSWER_CACHE": "0",      # jokainen vuoro menee mallille asti
+        "RETRIEVAL_INDEX_DIR": os.path.join(workdir, "index"),
+        "WRITE_BEHIND": "0" if args.sync_writes else env.get("WRITE_BEHIND", "1"),
+    })
+    proc = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", json.dumps(cfg)],
+                          env=env, capture_output=True, text=True, timeout=args.timeout)
+    try:
+        return json.loads(proc.stdout.strip().splitlines()[-1])
+    except (IndexError, ValueError):
+        return {"backend": backend, "sessions": sessions, "error": (proc.stderr or proc.stdout)[-800:]}
+
+
+def print_row(r: Dict[str, Any]) -> None:
+    if "error" in r:
+        print(f"{r.get('backend', '?'):>6} {r.get('sessions', '?'):>5}  VIRHE: {r['error']}")
+        return
+    lat, db_ = r["latency_ms"], r["db"]
+    print(f"{r['backend']:>6} {r['sessions']:>5}  p50 {lat['p50']:>8.1f}  p95 {lat['p95']:>8.1f}  "
+          f"p99 {lat['p99']:>8.1f} ms  ttft p50 {r['ttft_ms']['p50']:>7.1f}  {r['throughput_turns_s']:>7.2f} vuoroa/s  "
+          f"db vuorossa p95 {db_['in_turn_ms']['p95']:>6.1f} ms  overhead p95 {r['overhead_ms']['p95']:>6.1f} ms  "
+          f"virheitä {r['errors']}")
+
+
+def compare(old_path: str, runs: List[Dict[str, Any]]) -> None:
+    with open(old_path, encoding="utf-8") as f:
+        old = json.load(f)
+    prev = {(r.get("backend"), r.get("sessions")): r for r in old.get("runs", []) if "error" not in r}
+    print(f"\nvertailu: {old_path} (rev {old.get('meta', {}).get('git_rev', '?')})")
+    for r in runs:
+        o = prev.get((r.get("backend"), r.get("sessions")))
+        if o is None or "error" in r:
+            continue
+        cells = []
+        for key in ("p50", "p95", "p99"):
+            a, b = o["latency_ms"][key], r["latency_ms"][key]
+            cells.append(f"{key} {(b - a) / a * 100 if a else 0.0:+.1f} %")
+        a, b = o["throughput_turns_s"], r["throughput_turns_s"]
+        cells.append(f"läpäisy {(b - a) / a * 100 if a else 0.0:+.1f} %")
+        print(f"{r['backend']:>6} {r['sessions']:>5}  " + "  ".join(cells))
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--sessions", type=int, nargs="+", default=[1, 10, 25])
+    ap.add_argument("--turns", type=int, default=4, help="vuoroja per sessio")
+    ap.add_argument("--backend", nargs="+", default=["sqlite"], choices=["sqlite", "pg"])
+    ap.add_argument("--pg-url", default=os.environ.get("BENCH_PG_URL", ""))
+    ap.add_argument("--stub-url", default="", help="valmiiksi käynnissä oleva tynkä; oletuksena käynnistetään oma")
+    ap.add_argument("--ttft-ms", type=float, default=300.0)
+    ap.add_argument("--token-ms", type=float, default=15.0)
+    ap.add_argument("--tokens", type=int, default=80)
+    ap.add_argument("--no-stream", action="store_true", help="call_chat ilman striimausta")
+    ap.add_argument("--think-ms", type=float, default=0.0, help="keskimääräinen tauko vuorojen välillä")
+    ap.add_argument("--sync-writes", action="store_true", help="tallennukset vuoron sisällä (WRITE_BEHIND=0)")
+    ap.add_argument("--timeout", type=float, default=900.0)
+    ap.add_argument("--json", help="tulokset JSON-tiedostoon")
+    ap.add_argument("--compare", help="aiempi --json-tulos, johon verrataan")
+    ap.add_argument("--child", help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.child:
+        print(json.dumps(child(json.loads(args.child)), ensure_ascii=False))
+        return
+
+    base_url = args.stub_url
+    if not base_url:
+        from benchmarks.openai_stub import serve
+        server, _cfg = serve(0, ttft_ms=args.ttft_ms, token_ms=args.token_ms, tokens=args.tokens)
+        base_url = f"http://127.0.0.1:{server.server_port}/v1"
+
+    runs: List[Dict[str, Any]] = []
+    with tempfile.TemporaryDirectory(prefix="henry-load-") as workdir:
+        for backend in args.backend:
+            if backend == "pg" and not args.pg_url:
+                print("pg ohitettu: anna --pg-url tai BENCH_PG_URL")
+                continue
+            for n in args.sessions:
+                r = run_one(backend, n, args, base_url, workdir)
+                runs.append(r)
+                print_row(r)
+
+    result = {
+        "meta": {
+            "git_rev": git_rev(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": sys.version.split()[0],
+            "stub": {"url": base_url, "ttft_ms": args.ttft_ms, "token_ms": args.token_ms, "tokens": args.tokens},
+            "turns_per_session": args.turns,
+            "stream": not args.no_stream,
+            "think_ms": args.think_ms,
+            "sync_writes": args.sync_writes,
+        },
+        "runs": runs,
+    }
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+    if args.compare:
+        compare(args.compare, runs)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Replay-benchmark: lokitetut keskustelut (messages-taulu) ajetaan uudelleen agentin
+ytimen (henry_agent.agent) läpi determinististä OpenAI-tynkää vasten
+(benchmarks/openai_stub.py, viive 0). Näin nähdään, miten persoonan, yleisöpresetin,
+koukkujen tai sääntöjen muutos vaikuttaa promptin kokoon, putken omaan viiveeseen
+ja sääntömoottorin tulokseen oikealla liikenteellä.
+
+Lähde luetaan vain lukien: SQLite (--sqlite, oletus CHATLOG_DB_PATH) tai Postgres
+(--pg-url, oletus DATABASE_URL). Keskustelut jaetaan prosessipoolille; jokainen
+työprosessi kirjoittaa omaan väliaikaiseen SQLite-kantaansa, vastausvälimuisti on pois.
+
+Vuorokohtaisesti: promptin tokenit tiktokenilla (koko konteksti ja system-prompt),
+putken overhead (vuoro − LLM), reitti sekä koukku, intentit ja yleisö.
+
+    python benchmarks/bench_replay.py --limit 500 --workers 4 --json replay.json
+    python benchmarks/bench_replay.py --limit 500 --baseline replay.json --show-diffs 10
+    python benchmarks/bench_replay.py --pg-url "$DATABASE_URL" --since 2026-09-01 --baseline replay.json --fail-on-diff
+
+Tulostiedostoon ei tallenneta viestien tekstiä: vuoro tunnistetaan (keskustelu-id,
+vuoron numero) ja viestin sha1-tiivisteellä, joten vertailu huomaa myös muuttuneen lähteen.
+"""
+
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+DIFF_FIELDS = ("audience", "hook", "intents")
+
+Conversation = Tuple[int, List[str]]     # (lähteen conversation_id, käyttäjäviestit järjestyksessä)
+
+
+def pct(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    import numpy as np
+    return round(float(np.percentile(values, q)), 2)
+
+
+def summary(values: List[float]) -> Dict[str, float]:
+    return {"p50": pct(values, 50), "p95": pct(values, 95), "p99": pct(values, 99),
+            "max": round(max(values), 2) if values else 0.0}
+
+
+def msg_hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:12]
+
+
+# ============== Lähde (vain luku) ==============
+def _group(rows: Sequence[Tuple[int, Optional[str], Optional[bytes]]], min_turns: int) -> List[Conversation]:
+    from henry_agent.prompt_store import unpack
+
+    convs: Dict[int, List[str]] = {}
+    for cid, content, content_z in rows:
+        text = unpack(content, content_z)
+        if text.strip():
+            convs.setdefault(int(cid), []).append(text)
+    return [(cid, msgs) for cid, msgs in convs.items() if len(msgs) >= min_turns]
+
+
+def _pick_sql(p: str, since: Optional[str]) -> Tuple[str, List[Any]]:
+    # Uusimmat keskustelut, joissa on käyttäjäviestejä; viestit id-järjestyksessä
+    where, params = "role = 'user'", []
+    if since:
+        where += f" AND ts >= {p}"
+        params.append(since)
+    sql = (f"SELECT conversation_id, content, content_z FROM messages WHERE {where} AND conversation_id IN "
+           f"(SELECT conversation_id FROM messages WHERE {where} GROUP BY conversation_id "
+           f"ORDER BY conversation_id DESC LIMIT {p}) ORDER BY conversation_id, id")
+    return sql, params * 2
+
+
+def load_sqlite(path: str, limit: int, since: Optional[str], min_turns: int) -> List[Conversation]:
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        sql, params = _pick_sql("?", since)
+        return _group(conn.execute(sql, params + [limit]).fetchall(), min_turns)
+    finally:
+        conn.close()
+
+
+def load_pg(url: str, limit: int, since: Optional[str], min_turns: int) -> List[Conversation]:
+    import psycopg2
+
+    conn = psycopg2.connect(url, sslmode=os.environ.get("PG_SSLMODE", "require"))
+    try:
+        conn.set_session(readonly=True)
+        with conn.cursor() as c:
+            sql, params = _pick_sql("%s", since)
+            c.execute(sql, params + [limit])
+            return _group([(cid, content, bytes(z) if z is not None else None) for cid, content, z in c.fetchall()],
+                          min_turns)
+    finally:
+        conn.close()
+
+
+# ============== Työprosessi ==============
+def _init_worker(env: Dict[str, str]) -> None:
+    # spawn: asetukset luetaan moduulien tuonnissa, joten ympäristö ensin
+    os.environ.update(env)
+    os.environ["CHATLOG_DB_PATH"] = os.path.join(env["REPLAY_WORKDIR"], f"replay-{os.getpid()}.db")
+    from henry_agent.bootstrap import bootstrap
+    from henry_agent.context import count_tokens
+    from henry_agent.llm import get_client
+    from henry_agent.retrieval import retrieval_index
+
+    bootstrap()
+    # Indeksi, tokenisaattori ja OpenAI-SDK ladataan ennen mittausta
+    retrieval_index().refresh()
+    count_tokens("warmup")
+    get_client()
+
+
+def replay(conv: Conversation) -> List[Dict[str, Any]]:
+    from henry_agent import agent
+    from henry_agent.context import count_tokens
+    from henry_agent.llm import DEFAULT_MODEL
+
+    source_id, user_msgs = conv
+    state: Dict[str, Any] = {}
+    token = agent.open_conversation(state, user_agent="bench_replay")
+    agent.greet(state, token)
+    out: List[Dict[str, Any]] = []
+    for i, msg in enumerate(user_msgs, start=1):
+        t0 = time.perf_counter()
+        turn = agent.prepare_turn(state, msg)
+        t_prepare = time.perf_counter()
+        record = agent.finish_turn(state, turn, token)
+        total_ms = (time.perf_counter() - t0) * 1000
+        llm_ms = turn.timings.get("total_s", 0.0) * 1000
+        system = state["messages"][0]["content"] if state["messages"][0]["role"] == "system" else ""
+        out.append({
+            "conversation_id": source_id,
+            "turn": i,
+            "msg": msg_hash(msg),
+            "audience": state["audience"],
+            "hook": turn.signals.hook,
+            "intents": sorted(turn.signals.intents),
+            "connect": turn.connect,
+            "route": record["route"],
+            "prompt_tokens": record["prompt_tokens"],
+            "system_tokens": count_tokens(system, DEFAULT_MODEL),
+            "prepare_ms": round((t_prepare - t0) * 1000, 3),
+            "overhead_ms": round(total_ms - llm_ms, 3),
+            "total_ms": round(total_ms, 3),
+            "errors": [text for level, text in turn.notices if level == "error"],
+        })
+    return out
+
+
+def tokenizer_name() -> str:
+    from henry_agent.context import _encoding
+    from henry_agent.llm import DEFAULT_MODEL
+
+    enc = _encoding(DEFAULT_MODEL)
+    return f"tiktoken/{enc.name}" if enc is not None else "arvio (~4 merkkiä/token, tiktoken puuttuu)"
+
+
+# ============== Raportti ja vertailu ==============
+def aggregate(turns: List[Dict[str, Any]], wall_s: float) -> Dict[str, Any]:
+    tokens = [t["prompt_tokens"] for t in turns]
+    return {
+        "conversations": len({t["conversation_id"] for t in turns}),
+        "turns": len(turns),
+        "wall_s": round(wall_s, 3),
+        "throughput_turns_s": round(len(turns) / wall_s, 2) if wall_s else 0.0,
+        "prompt_tokens": {**summary(tokens), "mean": round(sum(tokens) / len(tokens), 1) if tokens else 0.0,
+                          "sum": sum(tokens)},
+        "system_tokens": summary([t["system_tokens"] for t in turns]),
+        "prepare_ms": summary([t["prepare_ms"] for t in turns]),
+        "overhead_ms": summary([t["overhead_ms"] for t in turns]),
+        "audience": dict(Counter(t["audience"] for t in turns).most_common()),
+        "routes": dict(Counter(t["route"] for t in turns).most_common()),
+        "intents": dict(Counter(i for t in turns for i in t["intents"]).most_common()),
+        "hooks": sum(1 for t in turns if t["hook"]),
+        "errors": sum(1 for t in turns if t["errors"]),
+    }
+
+
+def print_summary(s: Dict[str, Any]) -> None:
+    pt, ov = s["prompt_tokens"], s["overhead_ms"]
+    print(f"{s['conversations']} keskustelua, {s['turns']} vuoroa, {s['wall_s']} s ({s['throughput_turns_s']} vuoroa/s)")
+    print(f"prompt-tokenit p50 {pt['p50']:.0f}  p95 {pt['p95']:.0f}  ka {pt['mean']}  yht. {pt['sum']}  "
+          f"· system p50 {s['system_tokens']['p50']:.0f}")
+    print(f"overhead p50 {ov['p50']:.2f}  p95 {ov['p95']:.2f}  p99 {ov['p99']:.2f} ms  "
+          f"· valmistelu p95 {s['prepare_ms']['p95']:.2f} ms")
+    print(f"yleisö {s['audience']}  reitit {s['routes']}  intentit {s['intents']}  koukkuja {s['hooks']}  "
+          f"virheitä {s['errors']}")
+
+
+def _delta(a: float, b: float) -> str:
+    return f"{(b - a) / a * 100:+.1f} %" if a else "–"
+
+
+def compare(old_path: str, turns: List[Dict[str, Any]], s: Dict[str, Any], show: int) -> int:
+    """Tulostaa erot tallennettuun perustasoon; palauttaa muuttuneiden vuorojen määrän."""
+    with open(old_path, encoding="utf-8") as f:
+        old = json.load(f)
+    prev = {(t["conversation_id"], t["turn"]): t for t in old.get("turns", [])}
+    changed: Counter = Counter()
+    samples: List[str] = []
+    missing = source_changed = n_changed = 0
+    token_deltas: List[int] = []
+    for t in turns:
+        o = prev.get((t["conversation_id"], t["turn"]))
+        if o is None:
+            missing += 1
+            continue
+        if o.get("msg") != t["msg"]:
+            source_changed += 1
+            continue
+        token_deltas.append(t["prompt_tokens"] - o["prompt_tokens"])
+        fields = [k for k in DIFF_FIELDS if o.get(k) != t[k]]
+        if not fields:
+            continue
+        n_changed += 1
+        changed.update(fields)
+        if len(samples) < show:
+            samples.append(f"  keskustelu {t['conversation_id']} vuoro {t['turn']}: "
+                           + "; ".join(f"{k} {o.get(k)!r} → {t[k]!r}" for k in fields))
+
+    os_, pt = old.get("summary", {}), s["prompt_tokens"]
+    print(f"\nvertailu: {old_path} (rev {old.get('meta', {}).get('git_rev', '?')})")
+    if os_:
+        print(f"prompt-tokenit p50 {_delta(os_['prompt_tokens']['p50'], pt['p50'])}  "
+              f"yht. {_delta(os_['prompt_tokens']['sum'], pt['sum'])}  "
+              f"· system p50 {_delta(os_['system_tokens']['p50'], s['system_tokens']['p50'])}  "
+              f"· overhead p50 {_delta(os_['overhead_ms']['p50'], s['overhead_ms']['p50'])}  "
+              f"p95 {_delta(os_['overhead_ms']['p95'], s['overhead_ms']['p95'])}")
+    if token_deltas:
+        grew = sum(1 for d in token_deltas if d > 0)
+        shrank = sum(1 for d in token_deltas if d < 0)
+        print(f"vuorokohtaiset tokenit: {grew} kasvoi, {shrank} pieneni, muutos ka {sum(token_deltas) / len(token_deltas):+.1f}")
+    print(f"muuttuneita vuoroja {n_changed} / {len(token_deltas)}  "
+          + "  ".join(f"{k} {changed[k]}" for k in DIFF_FIELDS)
+          + (f"  · perustasossa ei {missing}" if missing else "")
+          + (f"  · lähdeviesti muuttunut {source_changed}" if source_changed else ""))
+    for line in samples:
+        print(line)
+    return n_changed
+
+
+# ============== Pääprosessi ==============
+def git_rev() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, timeout=10).stdout.strip()
+    except Exception:
+        return ""
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--sqlite", default=os.environ.get("CHATLOG_DB_PATH", "/mount/data/chatlogs.db"))
+    ap.add_argument("--pg-url", default=os.environ.get("DATABASE_URL", ""), help="lue Postgresista (tyhjä → SQLite)")
+    ap.add_argument("--limit", type=int, default=200, help="uusimmat N keskustelua")
+    ap.add_argument("--since", help="vain tämän jälkeen kirjoitetut viestit (ISO-päivä)")
+    ap.add_argument("--min-turns", type=int, default=1)
+    ap.add_argument("--max-turns", type=int, default=0, help="vuoroja per keskustelu enintään (0 = kaikki)")
+    ap.add_argument("--workers", type=int, default=max(1, min(8, (os.cpu_count() or 2) - 1)))
+    ap.add_argument("--tokens", type=int, default=40, help="tynkävastauksen pituus tokeneina")
+    ap.add_argument("--no-retrieval", action="store_true", help="RETRIEVAL=0 (ei knowledge/-hakua)")
+    ap.add_argument("--json", help="tulokset JSON-tiedostoon (kelpaa myöhemmin --baseline-tiedostoksi)")
+    ap.add_argument("--baseline", help="aiempi --json-tulos, johon verrataan")
+    ap.add_argument("--show-diffs", type=int, default=5, help="näytettäviä esimerkkieroja")
+    ap.add_argument("--fail-on-diff", action="store_true", help="paluukoodi 1, jos koukku/intentit/yleisö muuttui")
+    args = ap.parse_args()
+
+    t_load = time.perf_counter()
+    if args.pg_url:
+        convs = load_pg(args.pg_url, args.limit, args.since, args.min_turns)
+    else:
+        convs = load_sqlite(args.sqlite, args.limit, args.since, args.min_turns)
+    if args.max_turns:
+        convs = [(cid, msgs[:args.max_turns]) for cid, msgs in convs]
+    print(f"lähde: {args.pg_url and 'postgres' or args.sqlite} · {len(convs)} keskustelua, "
+          f"{sum(len(m) for _, m in convs)} käyttäjäviestiä ({time.perf_counter() - t_load:.2f} s)")
+    if not convs:
+        return
+
+    tokenizer = tokenizer_name()
+    if not tokenizer.startswith("tiktoken"):
+        print(f"varoitus: tokenit arvioidaan ({tokenizer}); aseta TIKTOKEN_CACHE_DIR tai salli enkoodauksen lataus")
+
+    from benchmarks.openai_stub import serve
+    server, _cfg = serve(0, ttft_ms=0.0, token_ms=0.0, tokens=args.tokens)
+
+    turns: List[Dict[str, Any]] = []
+    with tempfile.TemporaryDirectory(prefix="henry-replay-") as workdir:
+        env = {
+            "REPLAY_WORKDIR": workdir,
+            "OPENAI_API_KEY": "sk-replay",
+            "OPENAI_BASE_URL": f"http://127.0.0.1:{server.server_port}/v1",
+            "DATABASE_URL": "",
+            "ANSWER_CACHE": "0",            # jokainen vuoro rakentaa kontekstin ja menee tyngälle
+            "SESSION_STORE": "memory",
+            "MAINTENANCE_INTERVAL_S": "0",
+            "METRICS_PORT": "0",
+            "METRICS_FILE": "",
+            "RETRIEVAL_INDEX_DIR": os.environ.get("RETRIEVAL_INDEX_DIR", os.path.join(workdir, "index")),
+        }
+        if args.no_retrieval:
+            env["RETRIEVAL"] = "0"
+        # spawn: puhdas tulkki, johon ympäristö asetetaan ennen henry_agentin tuontia
+        ctx = multiprocessing.get_context("spawn")
+        t0 = time.perf_counter()
+        with ProcessPoolExecutor(args.workers, mp_context=ctx, initializer=_init_worker, initargs=(env,)) as pool:
+            for result in pool.map(replay, convs, chunksize=max(1, len(convs) // (args.workers * 8))):
+                turns.extend(result)
+        wall = time.perf_counter() - t0
+    server.shutdown()
+
+    s = aggregate(turns, wall)
+    print_summary(s)
+    result = {
+        "meta": {
+            "git_rev": git_rev(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": sys.version.split()[0],
+            "tokenizer": tokenizer,
+            "source": "postgres" if args.pg_url else "sqlite",
+            "limit": args.limit,
+            "since": args.since,
+            "workers": args.workers,
+            "retrieval": not args.no_retrieval,
+        },
+        "summary": s,
+        "turns": turns,
+    }
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=1, ensure_ascii=False)
+    if args.baseline:
+        n_changed = compare(args.baseline, turns, s, args.show_diffs)
+        if args.fail_on_diff and n_changed:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
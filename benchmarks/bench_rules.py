@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Mikrobenchmark: henry_agent.rules.RuleEngine vs. vanhat any(k in t ...) -silmukat.
+
+1) Yhteensopivuus: vanhat classify_profile / detect_intents / build_cv_hook /
+   wants_connect (kopioitu alle sellaisenaan) ja sääntömoottori ajetaan samalle
+   korpukselle (käsin kirjoitetut + satunnaiset avainsanayhdistelmät); erot listataan.
+2) Nopeus: synteettiset sääntötaulukot (oletuksena 100, 1 000 ja 10 000 avainsanaa)
+   → µs/viesti molemmilla tavoilla.
+
+    python benchmarks/bench_rules.py --sizes 100 1000 10000 --messages 500 --json rules.json
+"""
+
+import argparse
+import json
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from henry_agent import rules  # noqa: E402
+
+
+# ============== Vanha toteutus (vertailupohja) ==============
+def legacy_classify_profile(text: str) -> str:
+    t = text.lower()
+    if any(w in t for w in ["rekry", "rekrytoija", "recruiter", "hiring"]):
+        return "rekrytoija"
+    if any(w in t for w in ["lead", "vetäjä", "esihenkilö", "manager", "tiiminvetäjä", "team lead"]):
+        return "tiiminvetäjä"
+    if any(w in t for w in ["data engineer", "analyyt", "analyst", "ml", "mlops", "pipeline"]):
+        return "data engineer / analyst"
+    if any(w in t for w in ["toimittaja", "media", "lehti", "press"]):
+        return "media"
+    if any(w in t for w in ["kollega", "työkaveri", "internal", "sisäinen"]):
+        return "kollega"
+    return "muu"
+
+
+def legacy_detect_intents(text) -> set:
+    t = str(text).lower()
+    intents = set()
+    if any(w in t for w in ["kpi", "mittari", "sla", "ttfr", "tavoite", "tavoitteet"]):
+        intents.add("kpi")
+    if any(w in t for w in ["governance", "ai act", "risk", "selitettävyys", "audit", "valvonta"]):
+        intents.add("gov")
+    return intents
+
+
+LEGACY_CV_HOOKS = {tuple(r.keywords): [r.text] for r in rules.RULES if r.kind == "hook"}
+
+
+def legacy_build_cv_hook(user_query) -> str:
+    q = str(user_query).lower()
+    picked = []
+    for keys, lines in LEGACY_CV_HOOKS.items():
+        if any(k in q for k in keys):
+            picked.extend(lines[:1])
+    return " ".join(picked[:2]).strip()
+
+
+LEGACY_CONNECT = [k for r in rules.RULES if r.kind == "connect" for k in r.keywords]
+
+
+def legacy_wants_connect(text) -> bool:
+    if not isinstance(text, str) or not text:
+        return False
+    t = text.lower()
+    return any(k in t for k in LEGACY_CONNECT)
+
+
+SAMPLES = [
+    "Hei, olen Liisa rekrytoija yrityksestä Acme",
+    "I'm a hiring manager at Gofore, tell me about KPI targets",
+    "Team lead here. How would you do AI Act governance and audit?",
+    "Olen data engineer, miten rakentaisit ML pipelinen?",
+    "Toimittaja Helsingin Sanomista, saanko haastattelun?",
+    "Kollega sisäiseltä puolelta: RAG-dokumentaatio ja tietohaku?",
+    "Riskimalli rahanpesun torjuntaan (AML) ja fraud score",
+    "Copilot asiakaspalveluun, SLA ja TTFR",
+    "International event / messu demo",
+    "Voitko laittaa sähköpostia tai varaa aika kalenteriin",
+    "Please reach out via e-mail to schedule a meeting",
+    "Mitä teet vapaa-ajalla?",
+    "HubSpot vai Salesforce CRM?",
+    "",
+]
+
+
+def corpus(n: int, seed: int = 7):
+    rnd = random.Random(seed)
+    words = [k if isinstance(k, str) else k[0] for r in rules.RULES for k in r.keywords]
+    filler = ["hei", "kiitos", "miten", "the", "and", "projekti", "asiakas", "malli", "x", "ö"]
+    out = list(SAMPLES)
+    for _ in range(n):
+        parts = rnd.sample(words, rnd.randint(0, 4)) + rnd.sample(filler, rnd.randint(1, 6))
+        rnd.shuffle(parts)
+        # Osa sanoista liimataan yhteen → testaa alimerkkijono- ja päällekkäisyystapaukset
+        out.append("".join(p + rnd.choice([" ", " ", ""]) for p in parts).upper() if rnd.random() < 0.1
+                   else "".join(p + rnd.choice([" ", " ", ""]) for p in parts))
+    return out
+
+
+def check_compat(messages):
+    diffs = []
+    for m in messages:
+        got = rules.analyze(m)
+        want = (legacy_classify_profile(m), legacy_detect_intents(m), legacy_build_cv_hook(m), legacy_wants_connect(m))
+        have = (got.audience, set(got.intents), got.hook, rules.wants_connect(m))
+        if want != have:
+            diffs.append({"message": m, "legacy": repr(want), "engine": repr(have)})
+    return diffs
+
+
+# ============== Suuret sääntötaulukot ==============
+def synthetic_rules(n_keywords: int, per_rule: int = 20, seed: int = 1):
+    rnd = random.Random(seed)
+    alphabet = string.ascii_lowercase + "åäö"
+    kinds = ("audience", "intent", "hook", "connect")
+    out = []
+    for i in range(0, n_keywords, per_rule):
+        kws = tuple("".join(rnd.choice(alphabet) for _ in range(rnd.randint(4, 12))) for _ in range(per_rule))
+        kind = kinds[(i // per_rule) % len(kinds)]
+        out.append(rules.Rule(kind, f"{kind}{i}", kws, priority=rnd.randint(0, 9), text=f"hook {i}"))
+    return out
+
+
+def synthetic_messages(rule_table, n: int, seed: int = 2):
+    rnd = random.Random(seed)
+    words = [k for r in rule_table for k in r.keywords]
+    base = "kerro lisää kokemuksestasi ja siitä miten rakentaisit tämän meidän tiimille".split()
+    return [" ".join(rnd.sample(base, 8) + rnd.sample(words, rnd.randint(0, 3))) for _ in range(n)]
+
+
+def legacy_scan(rule_table, text: str):
+    # Vanha tapa: oma any()-silmukka per sääntö
+    t = text.lower()
+    return [r.label for r in rule_table if any(k in t for k in r.keywords)]
+
+
+def timeit(fn, messages, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for m in messages:
+            fn(m)
+        best = min(best, time.perf_counter() - t0)
+    return best / len(messages) * 1e6
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000])
+    ap.add_argument("--messages", type=int, default=500)
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--json", help="tulokset JSON-tiedostoon")
+    args = ap.parse_args()
+
+    diffs = check_compat(corpus(2000))
+    print(f"yhteensopivuus: {len(diffs)} eroa vanhaan toteutukseen")
+    for d in diffs[:10]:
+        print("  ", d)
+
+    msgs = corpus(args.messages)
+    legacy_all = lambda m: (legacy_classify_profile(m), legacy_detect_intents(m),  # noqa: E731
+                            legacy_build_cv_hook(m), legacy_wants_connect(m))
+    results = {
+        "compat_diffs": len(diffs),
+        "default_rules": {
+            "legacy_us": round(timeit(legacy_all, msgs, args.repeat), 2),
+            "engine_us": round(timeit(rules.analyze, msgs, args.repeat), 2),
+        },
+        "synthetic": [],
+    }
+    print(f"oletussäännöt: vanha {results['default_rules']['legacy_us']} µs/viesti, "
+          f"moottori {results['default_rules']['engine_us']} µs/viesti")
+
+    for size in args.sizes:
+        table = synthetic_rules(size)
+        t0 = time.perf_counter()
+        eng = rules.RuleEngine(table)
+        compile_ms = (time.perf_counter() - t0) * 1000
+        smsgs = synthetic_messages(table, args.messages)
+        row = {
+            "keywords": size,
+            "compile_ms": round(compile_ms, 1),
+            "legacy_us": round(timeit(lambda m: legacy_scan(table, m), smsgs, args.repeat), 2),
+            "engine_us": round(timeit(eng.match, smsgs, args.repeat), 2),
+        }
+        results["synthetic"].append(row)
+        print(f"{size:>6} avainsanaa: käännös {row['compile_ms']} ms · vanha {row['legacy_us']} µs/viesti · "
+              f"moottori {row['engine_us']} µs/viesti")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Käynnistys- ja rerun-benchmark Agentti-Henrylle.
+
+Jokainen kylmäkäynnistys ajetaan omassa Python-prosessissa (Streamlitin
+AppTest, ei selainta): mitataan ensimmäinen skriptiajo, tyhjät rerunit ja
+yksi chat-vuoro, sekä tarkistetaan, ettei pandas/openai latautunut turhaan.
+
+    python benchmarks/bench_startup.py --cold 5 --reruns 20 --json startup.json
+
+Ilman OPENAI_API_KEYtä chat-vuoro käyttää staattista varavastausta, joten
+luvut mittaavat sovelluksen omaa overheadia, eivät API:a.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+APP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "pop_ai_agent.py")
+
+
+def child(reruns: int) -> None:
+    t0 = time.perf_counter()
+    from streamlit.testing.v1 import AppTest
+    t_import = time.perf_counter()
+
+    at = AppTest.from_file(APP, default_timeout=120)
+    at.run()
+    t_first = time.perf_counter()
+    lazy = {"pandas_loaded": "pandas" in sys.modules, "openai_loaded": "openai" in sys.modules}
+
+    rerun_ms = []
+    for _ in range(reruns):
+        t = time.perf_counter()
+        at.run()
+        rerun_ms.append((time.perf_counter() - t) * 1000)
+
+    t = time.perf_counter()
+    at.chat_input[0].set_value("Hei, olen rekrytoija. Kerro Henryn HubSpot-kokemuksesta").run()
+    turn_ms = (time.perf_counter() - t) * 1000
+
+    print(json.dumps({
+        "import_ms": (t_import - t0) * 1000,
+        "first_run_ms": (t_first - t_import) * 1000,
+        "rerun_ms": rerun_ms,
+        "turn_ms": turn_ms,
+        "errors": len(at.exception),
+        **lazy,
+    }))
+
+
+def _pct(xs, q):
+    xs = sorted(xs)
+    return xs[min(len(xs) - 1, int(round(q / 100 * (len(xs) - 1))))]
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--cold", type=int, default=3, help="kylmäkäynnistysten määrä (omat prosessit)")
+    ap.add_argument("--reruns", type=int, default=20, help="rerunien määrä per prosessi")
+    ap.add_argument("--json", help="kirjoita tulokset tähän tiedostoon")
+    ap.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.child:
+        child(args.reruns)
+        return
+
+    runs = []
+    with tempfile.TemporaryDirectory() as tmp:
+        os.makedirs(os.path.join(tmp, ".streamlit"), exist_ok=True)
+        with open(os.path.join(tmp, ".streamlit", "secrets.toml"), "w") as f:
+            f.write("# bench\n")
+        env = dict(os.environ, CHATLOG_DB_PATH=os.path.join(tmp, "bench.db"), PYTHONWARNINGS="ignore")
+        env.pop("DATABASE_URL", None)
+        for i in range(args.cold):
+            t = time.perf_counter()
+            out = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--child", "--reruns", str(args.reruns)],
+                cwd=tmp, env=env, capture_output=True, text=True, check=True,
+            )
+            res = json.loads(out.stdout.strip().splitlines()[-1])
+            res["process_ms"] = (time.perf_counter() - t) * 1000
+            runs.append(res)
+
+    reruns = [x for r in runs for x in r["rerun_ms"]]
+    summary = {
+        "cold_runs": args.cold,
+        "first_run_ms_median": statistics.median(r["first_run_ms"] for r in runs),
+        "process_ms_median": statistics.median(r["process_ms"] for r in runs),
+        "rerun_ms_p50": _pct(reruns, 50),
+        "rerun_ms_p95": _pct(reruns, 95),
+        "turn_ms_median": statistics.median(r["turn_ms"] for r in runs),
+        "pandas_loaded_on_start": any(r["pandas_loaded"] for r in runs),
+        "openai_loaded_on_start": any(r["openai_loaded"] for r in runs),
+        "errors": sum(r["errors"] for r in runs),
+    }
+    for k, v in summary.items():
+        print(f"{k:26s} {v:.1f}" if isinstance(v, float) else f"{k:26s} {v}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"summary": summary, "runs": runs}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
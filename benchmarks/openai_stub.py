@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Paikallinen OpenAI-tynkäpalvelin benchmarkeille (ei API-avainta, ei verkkoa).
+
+Tukee: POST /v1/chat/completions (stream ja ei-stream, stream_options.include_usage),
+POST /v1/embeddings ja GET /v1/models. Viive on säädettävä:
+
+    ttft_ms    viive ennen ensimmäistä tokenia (ei-streamissa koko vastauksen alussa)
+    token_ms   viive tokenien välillä
+    tokens     vastauksen pituus tokeneina
+    error_rate osuus pyynnöistä, joihin vastataan 429:llä
+    slow_rate  osuus pyynnöistä, joiden ttft on slow_factor-kertainen (häntälatenssi)
+
+    python benchmarks/openai_stub.py --port 8765 --ttft-ms 300 --token-ms 15 --tokens 120
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=sk-stub streamlit run pop_ai_agent.py
+
+Moduulina: serve(port, **viiveet) käynnistää palvelimen taustasäikeeseen.
+"""
+
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict
+
+WORDS = ("Henry ", "on ", "rakentanut ", "HubSpot-", "integraatioita ", "ja ", "AI-", "pilotteja ",
+         "asiakaspalveluun; ", "mittarit ", "ja ", "governance ", "ensin. ")
+
+
+class StubConfig:
+    def __init__(self, ttft_ms: float = 200.0, token_ms: float = 10.0, tokens: int = 60, error_rate: float = 0.0,
+                 cached_tokens: int = 0, slow_rate: float = 0.0, slow_factor: float = 10.0):
+        self.ttft_ms = ttft_ms
+        self.token_ms = token_ms
+        self.tokens = tokens
+        self.error_rate = error_rate
+        self.cached_tokens = cached_tokens
+        self.slow_rate = slow_rate
+        self.slow_factor = slow_factor
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def count(self) -> int:
+        with self._lock:
+            self.requests += 1
+            return self.requests
+
+
+def _prompt_tokens(body: Dict[str, Any]) -> int:
+    # Karkea arvio (~4 merkkiä / token), riittää usage-kenttään
+    return sum(len(str(m.get("content", ""))) for m in body.get("messages", [])) // 4 + 3
+
+
+def make_handler(cfg: StubConfig):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args: Any) -> None:
+            pass
+
+        def _json(self, status: int, payload: Dict[str, Any]) -> None:
+            data = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self) -> None:
+            self._json(200, {"object": "list", "data": [{"id": "gpt-4o-mini", "object": "model"}]})
+
+        def do_POST(self) -> None:
+            n = int(self.headers.get("Content-Length", 0) or 0)
+            body = json.loads(self.rfile.read(n) or b"{}")
+            cfg.count()
+            if cfg.error_rate and random.random() < cfg.error_rate:
+                self._json(429, {"error": {"message": "stub rate limit", "type": "rate_limit_error"}})
+                return
+            if self.path.endswith("/embeddings"):
+                inp = body.get("input", [])
+                inp = [inp] if isinstance(inp, str) else inp
+                self._json(200, {
+                    "object": "list", "model": body.get("model", "stub"),
+                    "data": [{"object": "embedding", "index": i, "embedding": [float(len(t) % 7), 1.0, 0.5]}
+                             for i, t in enumerate(inp)],
+                    "usage": {"prompt_tokens": len(inp), "total_tokens": len(inp)},
+                })
+                return
+            self._chat(body)
+
+        def _chat(self, body: Dict[str, Any]) -> None:
+            model = body.get("model", "gpt-4o-mini")
+            words = [WORDS[i % len(WORDS)] for i in range(max(1, cfg.tokens))]
+            prompt = _prompt_tokens(body)
+            usage = {
+                "prompt_tokens": prompt, "completion_tokens": len(words), "total_tokens": prompt + len(words),
+                "prompt_tokens_details": {"cached_tokens": min(cfg.cached_tokens, prompt)},
+            }
+            slow = cfg.slow_rate and random.random() < cfg.slow_rate
+            time.sleep(cfg.ttft_ms * (cfg.slow_factor if slow else 1.0) / 1000)
+            if not body.get("stream"):
+                time.sleep(cfg.token_ms * (len(words) - 1) / 1000)
+                self._json(200, {
+                    "id": "chatcmpl-stub", "object": "chat.completion", "created": int(time.time()), "model": model,
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(words)},
+                                 "finish_reason": "stop"}],
+                    "usage": usage,
+                })
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+
+            def send(payload: str) -> None:
+                data = f"data: {payload}\n\n".encode()
+                self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                self.wfile.flush()
+
+            for i, w in enumerate(words):
+                if i:
+                    time.sleep(cfg.token_ms / 1000)
+                send(json.dumps({"id": "chatcmpl-stub", "object": "chat.completion.chunk", "created": 0,
+                                 "model": model,
+                                 "choices": [{"index": 0, "delta": {"content": w}, "finish_reason": None}]}))
+            if (body.get("stream_options") or {}).get("include_usage"):
+                send(json.dumps({"id": "chatcmpl-stub", "object": "chat.completion.chunk", "created": 0,
+                                 "model": model, "choices": [], "usage": usage}))
+            send("[DONE]")
+            self.wfile.write(b"0\r\n\r\n")
+
+    return Handler
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request: Any, client_address: Any) -> None:
+        # Asiakas sulki keep-alive-yhteyden (esim. benchmark-prosessi päättyi) → ei jäljitystä
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+def serve(port: int = 0, host: str = "127.0.0.1", **kw: Any):
+    """Käynnistää tynkäpalvelimen taustasäikeeseen. Palauttaa (server, config); portti: server.server_port."""
+    cfg = StubConfig(**kw)
+    server = _Server((host, port), make_handler(cfg))
+    threading.Thread(target=server.serve_forever, name="openai-stub", daemon=True).start()
+    return server, cfg
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--ttft-ms", type=float, default=200.0)
+    ap.add_argument("--token-ms", type=float, default=10.0)
+    ap.add_argument("--tokens", type=int, default=60)
+    ap.add_argument("--error-rate", type=float, default=0.0)
+    ap.add_argument("--cached-tokens", type=int, default=0)
+    ap.add_argument("--slow-rate", type=float, default=0.0)
+    ap.add_argument("--slow-factor", type=float, default=10.0)
+    args = ap.parse_args()
+    server, _cfg = serve(args.port, args.host, ttft_ms=args.ttft_ms, token_ms=args.token_ms, tokens=args.tokens,
+                         error_rate=args.error_rate, cached_tokens=args.cached_tokens, slow_rate=args.slow_rate,
+                         slow_factor=args.slow_factor)
+    print(f"OpenAI-tynkä: http://{args.host}:{server.server_port}/v1")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,7 @@
+"""
+Agentti-Henryn apumoduulit (Streamlit-riippumattomat osat).
+
+Pääsovellus on edelleen pop_ai_agent.py; tänne kootaan osat, joita
+voidaan käyttää ja mitata myös ilman Streamlitin ajoa. Keskusteluvuoron
+ydin on agent-moduulissa, ja server tarjoaa saman ytimen HTTP/JSON-rajapintana.
+"""
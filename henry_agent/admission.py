@@ -0,0 +1,332 @@
+"""
+OpenAI-kutsujen pääsynhallinta prosessin kaikille sessioille yhteisesti.
+
+- rinnakkaisuusraja (OPENAI_MAX_CONCURRENT) FIFO-jonolla; jonossa odotetaan
+  enintään OPENAI_QUEUE_BUDGET_S, sitten AdmissionRejected → sovellus siirtyy heti
+  varavastaukseen eikä jää roikkumaan
+- token bucket pyynnöille ja tokeneille (OPENAI_RPM / OPENAI_TPM, tilin tason mukaan;
+  0 = ei rajaa), odotus lasketaan samaan jonobudjettiin
+- 429/5xx/yhteysvirheille eksponentiaalinen backoff täydellä jitterillä
+  (OPENAI_MAX_RETRIES, Retry-After-otsaketta kunnioitetaan; insufficient_quota ei uusiudu)
+- identtiset samanaikaiset pyynnöt yhdistetään: yksi kutsu, vastaus (tai striimin
+  palat) jaetaan kaikille odottajille
+
+Striimi ajetaan omassa pumppusäikeessään, joten yhden kuluttajan katkaisu (Streamlitin
+rerun) ei katkaise muita; kun viimeinenkin kuluttaja lähtee, striimi suljetaan.
+"""
+
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Tuple
+
+from . import metrics
+from .settings import bool_setting, float_setting, int_setting
+
+
+class AdmissionRejected(RuntimeError):
+    """Pyyntö ei päässyt läpi jonobudjetin aikana."""
+
+
+# ============== Token bucket ==============
+class TokenBucket:
+    def __init__(self, per_minute: float, burst_s: float = 10.0):
+        self.rate = per_minute / 60.0
+        # Purske rajattu muutamaan sekuntiin: minuuttiraja ei saa kulua heti alussa
+        self.capacity = max(1.0, self.rate * burst_s)
+        self.tokens = self.capacity
+        self.t = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, n: float) -> float:
+        """Varaa n yksikköä; palauttaa odotusajan (s). Saldo voi mennä miinukselle → jono järjestyksessä."""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.t) * self.rate)
+            self.t = now
+            self.tokens -= n
+            return max(0.0, -self.tokens / self.rate)
+
+    def refund(self, n: float) -> None:
+        if self.rate > 0:
+            with self._lock:
+                self.tokens = min(self.capacity, self.tokens + n)
+
+
+# ============== Uudelleenyritykset ==============
+def retry_delay(e: BaseException, attempt: int, base_s: float, cap_s: float) -> Optional[float]:
+    """Odotus ennen uutta yritystä, tai None jos virhe ei ole ohimenevä."""
+    status = getattr(e, "status_code", None)
+    if getattr(e, "code", None) == "insufficient_quota":
+        return None
+    transient = e.__class__.__name__ in ("APIConnectionError", "APITimeoutError")
+    if not transient and not (status == 429 or (isinstance(status, int) and status >= 500)):
+        return None
+    headers = getattr(getattr(e, "response", None), "headers", None) or {}
+    try:
+        after = float(headers.get("retry-after", ""))
+        return min(cap_s, after)
+    except (TypeError, ValueError):
+        pass
+    # Full jitter: satunnainen 0..min(cap, base·2^n) hajauttaa samaan aikaan hylätyt sessiot
+    return random.uniform(0, min(cap_s, base_s * 2 ** attempt))
+
+
+# ============== Yhdistetyt pyynnöt ==============
+class _Flight:
+    __slots__ = ("items", "done", "error", "cond", "subscribers")
+
+    def __init__(self) -> None:
+        self.items: List[Any] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.cond = threading.Condition()
+        self.subscribers = 1
+
+    def put(self, item: Any) -> None:
+        with self.cond:
+            self.items.append(item)
+            self.cond.notify_all()
+
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        with self.cond:
+            self.done, self.error = True, error
+            self.cond.notify_all()
+
+    def leave(self) -> int:
+        with self.cond:
+            self.subscribers -= 1
+            return self.subscribers
+
+    def iterate(self) -> Iterator[Any]:
+        i = 0
+        try:
+            while True:
+                with self.cond:
+                    while i >= len(self.items) and not self.done:
+                        self.cond.wait()
+                    if i < len(self.items):
+                        item = self.items[i]
+                    elif self.error is not None:
+                        raise self.error
+                    else:
+                        return
+                i += 1
+                yield item
+        finally:
+            self.leave()
+
+
+class Subscription:
+    """Striimin kuluttaja; coalesced=True kun vastaus tulee toisen session kutsusta."""
+
+    def __init__(self, flight: _Flight, coalesced: bool):
+        self.coalesced = coalesced
+        self._it = flight.iterate()
+
+    def __iter__(self) -> Iterator[Any]:
+        return self._it
+
+    def close(self) -> None:
+        self._it.close()
+
+
+# ============== Pääsynhallinta ==============
+class Admission:
+    def __init__(self, max_concurrent: int = 8, queue_budget_s: float = 10.0, rpm: float = 0.0, tpm: float = 0.0,
+                 max_retries: int = 3, backoff_base_s: float = 0.5, backoff_cap_s: float = 8.0,
+                 coalesce: bool = True):
+        self.max_concurrent = max_concurrent
+        self.queue_budget_s = queue_budget_s
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.max_retries = max_retries
+        self.backoff_base_s = backoff_base_s
+        self.backoff_cap_s = backoff_cap_s
+        self.coalesce = coalesce
+        self._cond = threading.Condition()
+        self._queue: Deque[object] = deque()
+        self._active = 0
+        self._flights: Dict[str, _Flight] = {}
+        self._flights_lock = threading.Lock()
+        self._waits: Deque[float] = deque(maxlen=1000)
+        self.counts = {"admitted": 0, "rejected": 0, "coalesced": 0, "retries": 0}
+
+    @classmethod
+    def from_settings(cls) -> "Admission":
+        return cls(
+            max_concurrent=int_setting("OPENAI_MAX_CONCURRENT", 8),
+            queue_budget_s=float_setting("OPENAI_QUEUE_BUDGET_S", 10.0),
+            rpm=float_setting("OPENAI_RPM", 500.0),
+            tpm=float_setting("OPENAI_TPM", 200000.0),
+            max_retries=int_setting("OPENAI_MAX_RETRIES", 3),
+            backoff_base_s=float_setting("OPENAI_BACKOFF_BASE_S", 0.5),
+            backoff_cap_s=float_setting("OPENAI_BACKOFF_CAP_S", 8.0),
+            coalesce=bool_setting("OPENAI_COALESCE", True),
+        )
+
+    def _reject(self, reason: str) -> AdmissionRejected:
+        with self._cond:
+            self.counts["rejected"] += 1
+        metrics.inc("henry_llm_admission_total", result="rejected", reason=reason)
+        return AdmissionRejected(f"OpenAI-jono: {reason} (budjetti {self.queue_budget_s:g} s)")
+
+    @contextmanager
+    def slot(self, tokens: int) -> Iterator[float]:
+        """Rinnakkaisuuspaikka + rate limit; antaa jonotusajan sekunteina."""
+        t0 = time.monotonic()
+        deadline = t0 + self.queue_budget_s
+        ticket = object()
+        with self._cond:
+            self._queue.append(ticket)
+            # FIFO: vuoro vasta kun jonon kärjessä ja paikka vapaana
+            while self._queue[0] is not ticket or (self.max_concurrent > 0 and self._active >= self.max_concurrent):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._queue.remove(ticket)
+                    self._cond.notify_all()
+                    break
+                self._cond.wait(remaining)
+            else:
+                self._queue.popleft()
+                self._active += 1
+                self._cond.notify_all()
+                ticket = None
+        if ticket is not None:
+            raise self._reject("queue")
+        try:
+            wait = max(self.requests.reserve(1), self.tokens.reserve(tokens))
+            if wait > deadline - time.monotonic():
+                self.requests.refund(1)
+                self.tokens.refund(tokens)
+                raise self._reject("rate")
+            if wait:
+                time.sleep(wait)
+            waited = time.monotonic() - t0
+            with self._cond:
+                self.counts["admitted"] += 1
+                self._waits.append(waited)
+            metrics.inc("henry_llm_admission_total", result="admitted")
+            metrics.observe("llm_queue_wait", waited)
+            yield waited
+        finally:
+            with self._cond:
+                self._active -= 1
+                self._cond.notify_all()
+
+    def with_retries(self, fn: Callable[[], Any]) -> Any:
+        attempt = 0
+        while True:
+            try:
+                return fn()
+            except Exception as e:
+                delay = retry_delay(e, attempt, self.backoff_base_s, self.backoff_cap_s) \
+                    if attempt < self.max_retries else None
+                if delay is None:
+                    raise
+                attempt += 1
+                with self._cond:
+                    self.counts["retries"] += 1
+                metrics.inc("henry_llm_retries_total", status=getattr(e, "status_code", None) or e.__class__.__name__)
+                time.sleep(delay)
+
+    def _join(self, key: Optional[str]) -> Tuple[_Flight, bool]:
+        if not (self.coalesce and key):
+            return _Flight(), True
+        with self._flights_lock:
+            f = self._flights.get(key)
+            if f is not None:
+                with f.cond:
+                    # Striimi, jonka kaikki kuluttajat ovat jo lähteneet, suljetaan → ei liityttävissä
+                    if not f.done and f.subscribers > 0:
+                        f.subscribers += 1
+                        with self._cond:
+                            self.counts["coalesced"] += 1
+                        metrics.inc("henry_llm_admission_total", result="coalesced")
+                        return f, False
+            f = self._flights[key] = _Flight()
+            return f, True
+
+    def _forget(self, key: Optional[str], flight: _Flight) -> None:
+        if key:
+            with self._flights_lock:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+
+    def call(self, key: Optional[str], tokens: int, fn: Callable[[], Any]) -> Any:
+        """Synkroninen kutsu; identtinen samanaikainen kutsu odottaa saman vastauksen."""
+        flight, leader = self._join(key)
+        if not leader:
+            it = flight.iterate()
+            try:
+                return next(it)
+            finally:
+                it.close()
+        try:
+            with self.slot(tokens):
+                result = self.with_retries(fn)
+            flight.put(result)
+            flight.finish()
+            return result
+        except BaseException as e:
+            flight.finish(e if isinstance(e, Exception) else RuntimeError("keskeytetty"))
+            raise
+        finally:
+            flight.leave()
+            self._forget(key, flight)
+
+    def stream(self, key: Optional[str], tokens: int, open_fn: Callable[[], Any]) -> Subscription:
+        """Striimaava kutsu; palat kulkevat pumppusäikeen kautta kaikille kuluttajille."""
+        flight, leader = self._join(key)
+        if leader:
+            threading.Thread(target=self._pump, args=(key, flight, tokens, open_fn),
+                             name="openai-stream", daemon=True).start()
+        return Subscription(flight, coalesced=not leader)
+
+    def _pump(self, key: Optional[str], flight: _Flight, tokens: int, open_fn: Callable[[], Any]) -> None:
+        error: Optional[BaseException] = None
+        try:
+            with self.slot(tokens):
+                stream = self.with_retries(open_fn)
+                try:
+                    for chunk in stream:
+                        flight.put(chunk)
+                        if flight.subscribers <= 0:
+                            break   # kaikki kuluttajat lähtivät → ei generoida turhaan
+                finally:
+                    close = getattr(stream, "close", None)
+                    if close is not None:
+                        close()
+        except Exception as e:
+            error = e
+        finally:
+            self._forget(key, flight)
+            flight.finish(error)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            waits = sorted(self._waits)
+            out: Dict[str, Any] = dict(self.counts, in_flight=self._active, queue_depth=len(self._queue))
+        out["wait_p50_ms"] = round(waits[len(waits) // 2] * 1000, 1) if waits else 0.0
+        out["wait_p95_ms"] = round(waits[min(len(waits) - 1, int(len(waits) * 0.95))] * 1000, 1) if waits else 0.0
+        out["wait_max_ms"] = round(waits[-1] * 1000, 1) if waits else 0.0
+        return out
+
+
+_ADMISSION: Optional[Admission] = None
+_ADMISSION_LOCK = threading.Lock()
+
+
+def admission() -> Admission:
+    global _ADMISSION
+    if _ADMISSION is None:
+        with _ADMISSION_LOCK:
+            if _ADMISSION is None:
+                _ADMISSION = Admission.from_settings()
+                metrics.gauge("henry_llm_queue_depth", lambda: _ADMISSION.stats()["queue_depth"])
+                metrics.gauge("henry_llm_in_flight", lambda: _ADMISSION.stats()["in_flight"])
+    return _ADMISSION
@@ -0,0 +1,346 @@
+"""
+Keskusteluvuoron ydin ilman Streamlitiä. Sama logiikka palvelee Streamlit-sivua
+(pop_ai_agent.py, pelkkä piirtäjä) ja HTTP/JSON-rajapintaa (henry_agent.server).
+
+Tila on mapping (Streamlitissä st.session_state, palvelimessa dict), jonka avaimet
+ovat session_store.SESSION_KEYS; pysyvyys db:n ja session_storen kautta.
+
+    state = {}
+    token = open_conversation(state, token)       # jatka tokenin keskustelua tai aloita uusi
+    greet(state, token)
+    turn = prepare_turn(state, "Hei, olen Liisa rekrytoija…")
+    for delta in stream_reply(turn):              # CV-koukku turn.prefix näytetään ennen deltoja
+        ...
+    finish_turn(state, turn, token)
+
+Vuoro ei koskaan kaada kutsujaa OpenAI-virheeseen: varavastaus ja huomautus
+(turn.notices: (taso, teksti)) palautetaan, ja kutsuja päättää, miten ne näytetään.
+"""
+
+import re
+import secrets
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, MutableMapping, Optional, Tuple
+
+from . import db, job_ad, metrics, router, session_store
+from .admission import AdmissionRejected
+from .answer_cache import answer_cache, is_cacheable, profile_key
+from .context import ContextState, ContextWindow
+from .llm import DEFAULT_MODEL, get_client
+from .persona import PREFIX_VERSION, PROMPT_VERSION, build_system_prompt
+from .retrieval import format_context, retrieval_index
+from .router import Route
+from .rules import Match, analyze
+from .settings import bool_setting, int_setting
+
+GREETING = "Hei! Olen **Agentti-Henry** – Henryn puolesta vastaava agentti. Kuka olet ja miten voin auttaa? 😊"
+
+# Kontekstin token-budjetti (CONTEXT_TOKEN_BUDGET / _KEEP_MESSAGES / _SUMMARY_TOKENS)
+CONTEXT = ContextWindow.from_settings(model=DEFAULT_MODEL)
+# knowledge/-lisämateriaali haetaan vuorokohtaisesti (RETRIEVAL=0 → ei hakua; profiili on promptissa aina)
+RETRIEVAL = bool_setting("RETRIEVAL", True)
+HISTORY_PAGE = max(2, int_setting("HISTORY_PAGE_SIZE", 40))
+CONNECT_AFTER_TURNS = 3
+
+
+# ============== Personointi: heuristiikat ==============
+# Yleisö/intentit/koukut/CTA-signaali: henry_agent.rules (käännetty sääntötaulukko)
+def extract_name_company(text: str) -> Tuple[str, str]:
+    name = ""
+    m = re.search(r"\bolen\s+([A-ZÅÄÖ][a-zåäö]+(?:\s+[A-ZÅÄÖ][a-zåäö]+)?)", text)
+    if m:
+        name = m.group(1).strip()
+    company = ""
+    m2 = re.search(r"\b(yrityksestä|firmasta|talosta|yhtiöstä|company|from)\s+([A-Z0-9][\w&\-\s]{1,40})", text, re.I)
+    if m2:
+        company = m2.group(2).strip()
+    return name, company
+
+
+# ============== Pikatekstit ==============
+def bullets_ai_opportunities() -> str:
+    return "\n".join([
+        "1) Asiakaspalvelu Copilot: summaus, vastaus-ehdotukset, CRM-kirjaus.",
+        "2) Fraud score (rules+ML): signaalifuusio, SHAP-seuranta.",
+        "3) AML alert triage: priorisointi + tutkintamuistion runko.",
+        "4) Ennustava luotonanto: PD/LGD + selitettävyys-paneeli.",
+        "5) Tietopyyntöjen automaatio: ohjattu haku, audit-logi.",
+        "6) Sisäinen RAG-haku: ohjeet, prosessit, mallidokit.",
+    ])
+
+
+def bullets_ai_governance() -> str:
+    return "\n".join([
+        "• Data governance: omistajuus, laatu, säilytys, DPIA tarpeen mukaan.",
+        "• Mallien elinkaari: versiointi, hyväksyntä, monitorointi (drift/bias).",
+        "• Selitettävyys: SHAP/LIME tai policy, milloin vaaditaan.",
+        "• EU AI Act: luokitus, kontrollit, rekisteröinti tarvittaessa.",
+        "• Riskienhallinta: human-in-the-loop, fallback, vaikutusarvio.",
+        "• Tietoturva & pääsynhallinta: salaisuudet, auditointi.",
+    ])
+
+
+def fallback_reply(reason: str) -> str:
+    return f"{reason} Tässä suuntaviivat:\n\n{bullets_ai_opportunities()}\n\n{bullets_ai_governance()}"
+
+
+# ============== Keskustelun avaus ja historia ==============
+def init_state(state: MutableMapping[str, Any]) -> None:
+    defaults = {
+        "messages": [], "profile_text": None, "audience": None, "audience_name": "", "audience_company": "",
+        "system_built": False, "greeted": False, "turn_timings": [], "older_messages": [],
+        "has_older": False, "oldest_id": None, "job_ad": None,
+    }
+    for k, v in defaults.items():
+        if k not in state:
+            state[k] = list(v) if isinstance(v, list) else v
+    if "context_state" not in state:
+        state["context_state"] = ContextState()
+    if "user_id" not in state:
+        state["user_id"] = f"user-{secrets.token_hex(4)}"
+
+
+def resume_conversation(state: MutableMapping[str, Any], token: str) -> bool:
+    """Rakentaa tilan viestitaulusta: system-prompt + uusin sivu viestejä, personointi ensimmäisestä viestistä."""
+    conv_id = db.resolve_resume_token(state, token)
+    if conv_id is None:
+        return False
+    page = db.fetch_message_page(state, conv_id, limit=HISTORY_PAGE)
+    prompt = db.fetch_prompt(state, conv_id)
+    state["conversation_id"] = conv_id
+    state["messages"] = ([{"role": "system", "content": prompt}] if prompt else []) + [
+        {"role": m["role"], "content": m["content"]} for m in page
+    ]
+    state["oldest_id"] = page[0]["id"] if page else None
+    state["has_older"] = len(page) == HISTORY_PAGE
+    state["user_turns"] = db.count_user_messages(state, conv_id)
+    state["greeted"] = True
+    if prompt:
+        # Personointi johdetaan uudelleen ensimmäisestä käyttäjäviestistä, kuten alun perin
+        first = db.first_user_message(state, conv_id)
+        state["profile_text"] = first
+        state["audience"] = analyze(first).audience
+        state["audience_name"], state["audience_company"] = extract_name_company(first)
+        state["system_built"] = True
+    return True
+
+
+def load_conversation(state: MutableMapping[str, Any], token: str) -> bool:
+    """Tokenin keskustelu stateen: ensin jaettu sessiotila, sitten rekonstruktio viestitaulusta."""
+    init_state(state)
+    if token and session_store.load(state, token):
+        if "user_turns" not in state:
+            # Ennen laskuria tallennettu tila: vuorot lasketaan viestitaulusta
+            state["user_turns"] = db.count_user_messages(state, state["conversation_id"])
+        return True
+    return bool(token) and resume_conversation(state, token)
+
+
+def open_conversation(state: MutableMapping[str, Any], token: str = "", user_agent: str = "") -> str:
+    """Jatkaa tokenin keskustelua tai aloittaa uuden; palauttaa voimassa olevan tokenin."""
+    if load_conversation(state, token):
+        return token
+    token = secrets.token_urlsafe(12)
+    state["conversation_id"] = db.start_conversation(state, state["user_id"], user_agent=user_agent, resume_token=token)
+    state["user_turns"] = 0
+    return token
+
+
+def greet(state: MutableMapping[str, Any], token: str) -> Optional[str]:
+    # Ensitervehdys vain kerran
+    if state["greeted"] or state["messages"]:
+        return None
+    state["messages"].append({"role": "assistant", "content": GREETING})
+    db.enqueue_message(state, state["conversation_id"], "assistant", GREETING)
+    state["greeted"] = True
+    session_store.save(state, token)
+    return GREETING
+
+
+def load_older(state: MutableMapping[str, Any]) -> List[Dict[str, str]]:
+    """Seuraava vanhempi sivu kannasta (keyset); lisätään older_messages-listan alkuun.
+
+    oldest_id=None (sessiotila tallentaa vain viimeiset viestit): ensimmäinen sivu luetaan
+    viestitaulun lopusta ohittaen jo näkyvät viestit."""
+    if not state["has_older"]:
+        return []
+    shown = 0
+    if state["oldest_id"] is None:
+        shown = len(state["older_messages"]) + sum(1 for m in state["messages"] if m["role"] != "system")
+    page = db.fetch_message_page(state, state["conversation_id"], before_id=state["oldest_id"],
+                                 limit=HISTORY_PAGE + shown)
+    page = page[:max(0, len(page) - shown)]
+    older = [{"role": m["role"], "content": m["content"]} for m in page]
+    state["older_messages"] = older + state["older_messages"]
+    state["oldest_id"] = page[0]["id"] if page else state["oldest_id"]
+    state["has_older"] = len(page) == HISTORY_PAGE
+    return older
+
+
+# ============== Työpaikkailmoitus ==============
+def attach_job_ad(state: MutableMapping[str, Any], token: str, ad: Optional[Dict[str, Any]]) -> Optional[str]:
+    """Liittää parsitun ilmoituksen (job_ad.status()["ad"]) keskusteluun; None irrottaa. Palauttaa tiivistelmän."""
+    state["job_ad"] = None if ad is None else {
+        "sha": ad["sha"], "name": ad["name"], "pages": ad["pages"], "summary": job_ad.summarize(ad),
+    }
+    session_store.save(state, token)
+    return state["job_ad"] and state["job_ad"]["summary"]
+
+
+# ============== Vuoro ==============
+@dataclass
+class Turn:
+    user_msg: str
+    signals: Match
+    route: Route
+    audience: Optional[str]
+    prefix: str                               # CV-koukku muotoiltuna, näytetään ennen vastausta
+    prompt_version: str
+    started: float
+    cacheable: bool = False
+    profile: str = ""                         # nimen/yrityksen hash vastausvälimuistin osioon
+    cached: Optional[str] = None
+    prompt_messages: List[Dict[str, str]] = field(default_factory=list)
+    ctx_stats: Dict[str, int] = field(default_factory=dict)
+    timings: Dict[str, float] = field(default_factory=dict)
+    notices: List[Tuple[str, str]] = field(default_factory=list)   # (info|warning|error, teksti)
+    reply: str = ""                           # prefix + vastaus (keskeytyneestä streamista se mitä ehti tulla)
+    streamed: bool = False
+    connect: bool = False
+
+    @property
+    def visuals(self) -> List[str]:
+        return [name for intent, name in (("kpi", "kpi_table"), ("gov", "governance")) if intent in self.signals.intents]
+
+
+def prepare_turn(state: MutableMapping[str, Any], user_msg: str) -> Turn:
+    """Käyttäjän viesti talteen, personointi ensimmäisestä viestistä, reitti, taustahaku, ilmoitus, välimuisti ja konteksti."""
+    started = time.perf_counter()
+    state["messages"].append({"role": "user", "content": user_msg})
+    db.enqueue_message(state, state["conversation_id"], "user", user_msg)
+    # Koko keskustelun vuorot (messages on jatkamisen jälkeen vain uusin sivu)
+    state["user_turns"] = state.get("user_turns", 0) + 1
+
+    # Säännöt ajetaan kerran: yleisö, intentit, CV-koukut ja yhteydenottosignaali
+    with metrics.span("rules"):
+        signals = analyze(user_msg)
+
+    # Eka viesti → rakenna system-prompt personoinnilla
+    if not state["system_built"]:
+        state["profile_text"] = user_msg
+        name, company = extract_name_company(user_msg)
+        state["audience"], state["audience_name"], state["audience_company"] = signals.audience, name, company
+        system_prompt = build_system_prompt(signals.audience, name, company, retrieval=RETRIEVAL)
+        state["messages"].insert(0, {"role": "system", "content": system_prompt})
+        # Prompt tallennetaan kerran sisältöhashilla; keskustelu viittaa siihen prompt_id:llä
+        db.attach_prompt(state, state["conversation_id"], system_prompt)
+        state["system_built"] = True
+
+    hook = signals.hook
+    turn = Turn(
+        user_msg=user_msg, signals=signals, audience=state["audience"],
+        # Mallitaso viestin piirteistä (pituus, intentit, yleisö); sama kysymys → sama taso
+        route=router.choose(user_msg, signals, state["audience"]),
+        prefix=f"_{hook}_\n\n" if hook else "", prompt_version=PROMPT_VERSION, started=started,
+    )
+
+    # Relevantit taustapalat tähän kysymykseen; indeksin versio mukaan välimuistiavaimeen
+    extra: List[Dict[str, str]] = []
+    if RETRIEVAL:
+        try:
+            with metrics.span("retrieval"):
+                index = retrieval_index()
+                ctx_text = format_context(index.search(user_msg, k=int_setting("RETRIEVAL_TOP_K", 4)))
+            if ctx_text:
+                extra = [{"role": "system", "content": ctx_text}]
+            turn.prompt_version = f"{PROMPT_VERSION}:{index.version}"
+        except Exception as e:
+            turn.notices.append(("info", f"Taustahaku ei käytettävissä ({e.__class__.__name__})."))
+    # Ladatun ilmoituksen vertailutiivistelmä (ei ilmoituksen tekstiä); eri ilmoitus → eri välimuistiavain
+    ad = state.get("job_ad")
+    if ad:
+        extra.append({"role": "system", "content": ad["summary"]})
+        turn.prompt_version += f":ad-{ad['sha'][:12]}"
+
+    # Toistuvat, itsenäiset kysymykset vastausvälimuistista (ei OpenAI-kutsua)
+    cache = answer_cache()
+    turn.cacheable = cache is not None and is_cacheable(user_msg)
+    turn.profile = profile_key(state["audience_name"], state["audience_company"])
+    t_lookup = time.perf_counter()
+    with metrics.span("answer_cache"):
+        turn.cached = cache.get(turn.audience, turn.prompt_version, user_msg, turn.profile) if turn.cacheable else None
+    if turn.cached is not None:
+        elapsed = time.perf_counter() - t_lookup
+        turn.timings = {"ttft_s": elapsed, "total_s": elapsed, "cache_hit": 1.0}
+        turn.ctx_stats = {"prompt_tokens": 0, "budget_tokens": CONTEXT.budget_tokens}
+    else:
+        # Mallille lähtee budjetoitu konteksti: system + tiivistelmä vanhoista + tuoreet viestit
+        with metrics.span("context_build"):
+            turn.prompt_messages, turn.ctx_stats = CONTEXT.build(state["messages"], state["context_state"], extra=extra)
+    return turn
+
+
+def stream_reply(turn: Turn) -> Iterator[str]:
+    """Vastauksen deltat (ilman prefixiä); virheessä varavastaus ja huomautus. Lopuksi turn.reply asetettu."""
+    parts: List[str] = []
+    turn.streamed = True
+    try:
+        client = get_client()
+        if turn.cached is not None:
+            parts.append(turn.cached)
+            yield turn.cached
+        elif client:
+            try:
+                for delta in router.stream(client, turn.prompt_messages, turn.route, turn.timings):
+                    parts.append(delta)
+                    yield delta
+                if turn.cacheable:
+                    answer_cache().put(turn.audience, turn.prompt_version, turn.user_msg, "".join(parts), turn.profile)
+            except AdmissionRejected:
+                turn.notices.append(("warning", "Ruuhkaa OpenAI-yhteydessä juuri nyt – vastaan suuntaviivoilla."))
+                if not parts:
+                    parts.append(fallback_reply("Kiitos! Jono on hetken täynnä."))
+                    yield parts[0]
+            except Exception as e:
+                turn.notices.append(("error", f"OpenAI-virhe: {e.__class__.__name__}"))
+                if not parts:
+                    parts.append(fallback_reply("Kiitos! Backend ei vastaa juuri nyt."))
+                    yield parts[0]
+        else:
+            parts.append(fallback_reply("API-avain puuttuu."))
+            yield parts[0]
+    finally:
+        turn.reply = turn.prefix + "".join(parts)
+
+
+def finish_turn(state: MutableMapping[str, Any], turn: Turn, token: str) -> Dict[str, Any]:
+    """Talleta juuri näytetty vastaus, vuoron mittaukset ja tila; palauttaa vuorokohtaisen kirjauksen."""
+    if not turn.streamed:
+        for _ in stream_reply(turn):
+            pass
+    state["messages"].append({"role": "assistant", "content": turn.reply})
+    db.enqueue_message(state, state["conversation_id"], "assistant", turn.reply)
+    metrics.observe("turn", time.perf_counter() - turn.started)
+
+    # Vuorokohtainen kirjaus: promptin tokenit sekä time-to-first-token ja koko generoinnin kesto
+    timings = turn.timings
+    user_turns = state["user_turns"]
+    record = {
+        "turn": user_turns,
+        "prompt_tokens": turn.ctx_stats["prompt_tokens"],
+        "cache_hit": bool(timings.get("cache_hit")),
+        "ttft_s": round(timings.get("ttft_s", timings.get("total_s", 0.0)), 3),
+        "total_s": round(timings.get("total_s", 0.0), 3),
+        "tokens_in": int(timings.get("tokens_in", 0)),
+        "tokens_cached": int(timings.get("tokens_cached", 0)),
+        "prefix_version": PREFIX_VERSION,
+        "route": "cache" if timings.get("cache_hit") else turn.route.name,
+        "cost_usd": round(timings.get("cost_usd", 0.0), 6),
+    }
+    state["turn_timings"].append(record)
+    # Yhteys-CTA: vain pyydettäessä tai jos keskustelua on ollut jo hetki
+    turn.connect = bool(turn.signals.connect or user_turns >= CONNECT_AFTER_TURNS)
+    # Vuoron jälkeinen tila jaettuun varastoon: mikä tahansa replika voi jatkaa tästä
+    session_store.save(state, token)
+    return record
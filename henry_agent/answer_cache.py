@@ -0,0 +1,256 @@
+"""
+Vastausvälimuisti toistuville kysymyksille.
+
+Avain = (yleisö sääntömoottorista, profiili, promptin versio, normalisoitu kysymys).
+Profiili = nimen ja yrityksen hash (profile_key): ne ovat system-promptissa, joten
+henkilöity vastaus ei saa osua toiselle kävijälle. Nimettömät jakavat yhteisen osion.
+Kaksi kerrosta:
+  1) tarkka: normalisoidun tekstin hash → vastaus (dict-haku)
+  2) semanttinen (valinnainen, oletuksena pois: ANSWER_CACHE_SEMANTIC=1): NumPy-matriisi
+     kysymysten upotuksista, osuma kun kosinisamankaltaisuus ≥ kynnys samassa osiossa
+     JA avaintokenit (erisnimet, luvut, lyhenteet) ovat samat. HashingEmbedder ei erota
+     "HubSpot"/"Salesforce" tai "senior"/"junior" -kysymyksiä (kosini ~0.9), joten kynnys
+     on korkea (0.95) ja kerros tavoittaa käytännössä vain taivutus- ja välimerkkierot.
+
+LRU- ja TTL-häätö, pysyvyys olemassa olevaan tietokantaan (answer_cache-taulu,
+kirjoitukset taustalla) sekä osuma/huti-laskurit. Osuma ei koske OpenAI-asiakkaaseen:
+upotukset lasketaan paikallisella HashingEmbedderillä.
+"""
+
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, FrozenSet, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .embeddings import HashingEmbedder, normalize_text
+from .settings import bool_setting, float_setting, int_setting
+
+# Jatkokysymykset riippuvat aiemmasta keskustelusta → niitä ei välimuistiteta
+FOLLOWUP_PREFIXES = (
+    "entä", "entäs", "miksi", "mitä tarkoitat", "tuo", "tuosta", "se", "sen", "siitä", "jatka", "kerro lisää",
+    "and", "what about", "why", "that", "it", "continue", "tell me more",
+)
+MIN_WORDS = 3
+
+# Avaintokenit: luvut, isolla alkavat sanat (ei virkkeen ensimmäinen) ja lyhenteet
+_NUMBER = re.compile(r"\d+")
+_WORD = re.compile(r"[^\W\d_][\w-]*")
+_SENTENCE_START = re.compile(r"(?:^|[.!?]\s+)([^\W\d_][\w-]*)")
+
+
+@dataclass
+class _Entry:
+    key: str
+    partition: str
+    question: str
+    answer: str
+    created_at: float
+
+
+def profile_key(name: str = "", company: str = "") -> str:
+    if not (name or company):
+        return ""
+    return hashlib.sha1(f"{name}|{company}".encode("utf-8")).hexdigest()[:12]
+
+
+def key_tokens(question: str) -> FrozenSet[str]:
+    """Sanat, joiden on oltava samat semanttisessa osumassa (erisnimet, luvut, lyhenteet)."""
+    starts = {m.start(1) for m in _SENTENCE_START.finditer(question or "")}
+    words = {m.group(0).lower() for m in _WORD.finditer(question or "")
+             if (m.group(0)[0].isupper() and m.start() not in starts) or (len(m.group(0)) > 1 and m.group(0).isupper())}
+    return frozenset(words | set(_NUMBER.findall(question or "")))
+
+
+def is_cacheable(question: str) -> bool:
+    norm = normalize_text(question)
+    if len(norm.split()) < MIN_WORDS:
+        return False
+    return not any(norm == p or norm.startswith(p + " ") for p in FOLLOWUP_PREFIXES)
+
+
+class AnswerCache:
+    def __init__(
+        self,
+        max_entries: int = 500,
+        ttl_s: float = 7 * 24 * 3600,
+        semantic: bool = False,
+        sim_threshold: float = 0.95,
+        embedder: Any = None,
+        persist: Optional[Callable[[Tuple[Any, ...]], Any]] = None,
+    ):
+        self.max_entries = max(1, max_entries)
+        self.ttl_s = ttl_s
+        self.semantic = semantic
+        self.sim_threshold = sim_threshold
+        self.embedder = embedder or (HashingEmbedder() if semantic else None)
+        self.persist = persist
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        # Semanttinen kerros: rivi per entry, osiot kokonaislukukoodeina maskausta varten
+        dim = self.embedder.dim if self.embedder is not None else 1
+        self._vecs = np.zeros((self.max_entries, dim), dtype=np.float32)
+        self._parts = np.full(self.max_entries, -1, dtype=np.int32)
+        self._row_keys: List[str] = []
+        self._row_tokens: List[FrozenSet[str]] = []
+        self._key_row: Dict[str, int] = {}
+        self._part_codes: Dict[str, int] = {}
+        self.stats: Dict[str, int] = {
+            "hits_exact": 0, "hits_semantic": 0, "misses": 0, "stores": 0, "evictions": 0, "expired": 0,
+        }
+
+    # ---------- avaimet ----------
+    @staticmethod
+    def partition(audience: str, version: str, profile: str = "") -> str:
+        return f"{audience or 'muu'}|{profile}|{version}" if profile else f"{audience or 'muu'}|{version}"
+
+    @staticmethod
+    def make_key(partition: str, question: str) -> str:
+        return hashlib.sha1(f"{partition}|{normalize_text(question)}".encode("utf-8")).hexdigest()
+
+    def _code(self, partition: str) -> int:
+        code = self._part_codes.get(partition)
+        if code is None:
+            code = self._part_codes[partition] = len(self._part_codes)
+        return code
+
+    # ---------- sisäiset (lukko pidossa) ----------
+    def _drop(self, key: str) -> None:
+        self._entries.pop(key, None)
+        row = self._key_row.pop(key, None)
+        if row is None:
+            return
+        last = len(self._row_keys) - 1
+        if row != last:
+            moved = self._row_keys[last]
+            self._vecs[row] = self._vecs[last]
+            self._parts[row] = self._parts[last]
+            self._row_keys[row] = moved
+            self._row_tokens[row] = self._row_tokens[last]
+            self._key_row[moved] = row
+        self._row_keys.pop()
+        self._row_tokens.pop()
+        self._parts[last] = -1
+
+    def _insert(self, entry: _Entry, vec: Optional[np.ndarray]) -> None:
+        if entry.key in self._entries:
+            self._drop(entry.key)
+        while len(self._entries) >= self.max_entries:
+            old_key = next(iter(self._entries))   # LRU: vanhin käyttö ensin
+            self._drop(old_key)
+            self.stats["evictions"] += 1
+            if self.persist:
+                self.persist(("del", old_key))
+        self._entries[entry.key] = entry
+        if vec is not None:
+            row = len(self._row_keys)
+            self._vecs[row] = vec
+            self._parts[row] = self._code(entry.partition)
+            self._row_keys.append(entry.key)
+            self._row_tokens.append(key_tokens(entry.question))
+            self._key_row[entry.key] = row
+
+    def _fresh(self, entry: _Entry, now: float) -> bool:
+        if self.ttl_s > 0 and now - entry.created_at > self.ttl_s:
+            self._drop(entry.key)
+            self.stats["expired"] += 1
+            if self.persist:
+                self.persist(("del", entry.key))
+            return False
+        return True
+
+    # ---------- julkinen rajapinta ----------
+    def get(self, audience: str, version: str, question: str, profile: str = "") -> Optional[str]:
+        part = self.partition(audience, version, profile)
+        key = self.make_key(part, question)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._fresh(entry, now):
+                self._entries.move_to_end(key)
+                self.stats["hits_exact"] += 1
+                return entry.answer
+            code = self._part_codes.get(part)
+            if self.semantic and code is not None and self._row_keys:
+                n = len(self._row_keys)
+                q = self.embedder.embed([question])[0]
+                sims = self._vecs[:n] @ q
+                sims[self._parts[:n] != code] = -1.0
+                tokens = key_tokens(question)
+                candidates = np.flatnonzero(sims >= self.sim_threshold)
+                for row in candidates[np.argsort(-sims[candidates])]:
+                    if self._row_tokens[row] != tokens:
+                        continue   # eri erisnimi/luku → eri kysymys, vaikka upotus on lähellä
+                    hit = self._entries.get(self._row_keys[row])
+                    if hit is not None and self._fresh(hit, now):
+                        self._entries.move_to_end(hit.key)
+                        self.stats["hits_semantic"] += 1
+                        return hit.answer
+                    break
+            self.stats["misses"] += 1
+        return None
+
+    def put(self, audience: str, version: str, question: str, answer: str, profile: str = "") -> None:
+        if not answer or not is_cacheable(question):
+            return
+        part = self.partition(audience, version, profile)
+        entry = _Entry(self.make_key(part, question), part, question, answer, time.time())
+        vec = self.embedder.embed([question])[0] if self.semantic else None
+        with self._lock:
+            self._insert(entry, vec)
+            self.stats["stores"] += 1
+        if self.persist:
+            self.persist(("put", entry.key, entry.partition, entry.question, entry.answer, entry.created_at))
+
+    def load(self, rows: Iterable[Sequence[Any]]) -> int:
+        # rivit: (key, partition, question, answer, created_at), vanhin ensin
+        rows = list(rows)
+        now = time.time()
+        rows = [r for r in rows if self.ttl_s <= 0 or now - float(r[4]) <= self.ttl_s][-self.max_entries:]
+        vecs = self.embedder.embed([r[2] for r in rows]) if (self.semantic and rows) else None
+        with self._lock:
+            for i, r in enumerate(rows):
+                self._insert(_Entry(r[0], r[1], r[2], r[3], float(r[4])), vecs[i] if vecs is not None else None)
+        return len(rows)
+
+    def snapshot(self) -> Dict[str, Any]:
+        lookups = self.stats["hits_exact"] + self.stats["hits_semantic"] + self.stats["misses"]
+        hits = self.stats["hits_exact"] + self.stats["hits_semantic"]
+        return {**self.stats, "size": len(self._entries), "hit_rate": round(hits / lookups, 3) if lookups else 0.0}
+
+
+# ============== Prosessin yhteinen välimuisti ==============
+_CACHE: Optional[AnswerCache] = None
+_CACHE_LOCK = threading.Lock()
+
+
+def answer_cache() -> Optional[AnswerCache]:
+    """ANSWER_CACHE=0 poistaa käytöstä; muuten luodaan kerran ja lämmitetään kannasta."""
+    global _CACHE
+    if _CACHE is not None or not bool_setting("ANSWER_CACHE", True):
+        return _CACHE
+    with _CACHE_LOCK:
+        if _CACHE is None:
+            from . import db
+            from .writebehind import WriteBehindLogger
+
+            # Välimuistin kirjoitukset ovat best effort → "drop"-politiikka, ei koskaan blokkaa vuoroa
+            writer = WriteBehindLogger(db.write_answer_cache_batch, batch_size=20, flush_interval_s=1.0,
+                                       max_queue=500, policy="drop")
+            cache = AnswerCache(
+                max_entries=int_setting("ANSWER_CACHE_MAX_ENTRIES", 500),
+                ttl_s=float_setting("ANSWER_CACHE_TTL_S", 7 * 24 * 3600),
+                semantic=bool_setting("ANSWER_CACHE_SEMANTIC", False),
+                sim_threshold=float_setting("ANSWER_CACHE_SIM_THRESHOLD", 0.95),
+                persist=writer.submit,
+            )
+            try:
+                cache.load(db.load_answer_cache(cache.max_entries))
+            except Exception:
+                pass
+            _CACHE = cache
+    return _CACHE
@@ -0,0 +1,44 @@
+"""
+Kerran per prosessi ajettava käynnistys.
+
+Skeeman alustus ja backendin koetus (PG-poolin luonti) tehdään ensimmäisellä
+ajolla; myöhemmät rerunit saavat valmiin tuloksen ilman tietokantakutsuja.
+Tokenisaattori ja OpenAI-yhteyspooli lämmitetään taustasäikeissä ja metriikoiden julkaisu
+(METRICS_PORT / METRICS_FILE), ylläpitosäie (MAINTENANCE_INTERVAL_S), hakuindeksin
+taustaindeksointi (SEARCH_INDEX), taustamateriaalin indeksin päivitys (RETRIEVAL_REFRESH_S)
+ja PG-tilassa spoolin takaisinkirjoittaja käynnistetään.
+"""
+
+import threading
+import time
+from typing import Any, Dict
+
+from . import db, llm, metrics, retention, retrieval, search
+from .context import count_tokens
+
+_BOOT: Dict[str, Any] = {}
+_BOOT_LOCK = threading.Lock()
+
+
+def bootstrap() -> Dict[str, Any]:
+    if _BOOT:
+        return _BOOT
+    with _BOOT_LOCK:
+        if not _BOOT:
+            t0 = time.perf_counter()
+            state: Dict[str, Any] = {}
+            db.init_db(state)
+            db.start_backfill()
+            metrics.start_exporters()
+            retention.start_scheduler()
+            search.start_indexer()
+            retrieval.start_refresher()
+            # tiktoken-enkoodauksen lataus taustalla, ettei ensimmäinen vuoro maksa siitä
+            threading.Thread(target=count_tokens, args=("warmup",), name="tiktoken-warmup", daemon=True).start()
+            # OpenAI-asiakas ja ensimmäinen TLS-yhteys poolissa ennen ensimmäistä vuoroa
+            llm.warm()
+            _BOOT.update({
+                "backend": "pg" if state.get("use_postgres") else "sqlite",
+                "boot_ms": round((time.perf_counter() - t0) * 1000, 2),
+            })
+    return _BOOT
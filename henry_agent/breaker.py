@@ -0,0 +1,138 @@
+"""
+Prosessinlaajuinen katkaisin (circuit breaker) ulkoiselle palvelulle.
+
+    closed     kutsut menevät läpi; failure_threshold peräkkäistä katkosvirhettä → open
+    open       kutsut hylätään heti (CircuitOpen), kukaan ei odota yhteyden aikakatkaisua
+    half_open  koetin (probe) on käynnissä omassa säikeessään; onnistui → closed,
+               epäonnistui → open ja seuraava koetus tuplasti pidemmän tauon jälkeen
+
+Koetusta ei tehdä kutsujan säikeessä: allow() käynnistää sen taustalle, kun tauko
+on kulunut, ja palauttaa silti False. Näin UI ei koskaan jää odottamaan kuollutta
+palvelua. Taustasäie (ks. spool.Backfiller) kutsuu allow()-metodia säännöllisesti,
+joten toipuminen huomataan, vaikka liikennettä ei olisi.
+"""
+
+import logging
+import random
+import threading
+import time
+from typing import Callable, Dict, List
+
+from . import metrics
+
+log = logging.getLogger(__name__)
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+STATES = (CLOSED, OPEN, HALF_OPEN)
+
+
+class CircuitOpen(RuntimeError):
+    pass
+
+
+def _describe(e: BaseException) -> str:
+    text = str(e).strip()
+    return text.splitlines()[0][:200] if text else type(e).__name__
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        name: str,
+        probe: Callable[[], None],
+        failure_threshold: int = 2,
+        reset_after_s: float = 5.0,
+        max_reset_s: float = 60.0,
+    ):
+        self.name = name
+        self.probe = probe
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_after_s = reset_after_s
+        self.max_reset_s = max(reset_after_s, max_reset_s)
+        self.state = CLOSED
+        self.last_error = ""
+        self._failures = 0
+        self._backoff_s = reset_after_s
+        self._retry_at = 0.0
+        self._lock = threading.Lock()
+        self._listeners: List[Callable[[], None]] = []
+        self.stats: Dict[str, int] = {"opened": 0, "probes": 0, "rejected": 0}
+
+    def on_close(self, fn: Callable[[], None]) -> None:
+        """fn kutsutaan (koetinsäikeessä), kun palvelu on taas käytettävissä."""
+        self._listeners.append(fn)
+
+    @property
+    def closed(self) -> bool:
+        return self.state == CLOSED
+
+    def allow(self) -> bool:
+        if self.state == CLOSED:
+            return True
+        with self._lock:
+            if self.state == OPEN and time.monotonic() >= self._retry_at:
+                self._set(HALF_OPEN)
+                threading.Thread(target=self._probe, name=f"{self.name}-probe", daemon=True).start()
+            self.stats["rejected"] += 1
+        return False
+
+    def check(self) -> None:
+        if not self.allow():
+            raise CircuitOpen(f"{self.name}: katkaisin {self.state} ({self.last_error})")
+
+    def success(self) -> None:
+        if self._failures or self.state != CLOSED:
+            with self._lock:
+                self._failures = 0
+                self._backoff_s = self.reset_after_s
+                self._set(CLOSED)
+
+    def failure(self, e: BaseException) -> None:
+        with self._lock:
+            self.last_error = _describe(e)
+            self._failures += 1
+            if self.state == CLOSED and self._failures >= self.failure_threshold:
+                self._open()
+
+    def trip(self, e: BaseException) -> None:
+        """Heti auki (esim. yhteyttä ei saatu lainkaan muodostettua)."""
+        with self._lock:
+            self.last_error = _describe(e)
+            if self.state == CLOSED:
+                self._open()
+
+    def retry_in(self) -> float:
+        return max(0.0, self._retry_at - time.monotonic()) if self.state == OPEN else 0.0
+
+    # ---------- sisäiset (lukko pidossa) ----------
+    def _set(self, state: str) -> None:
+        if state != self.state:
+            log.warning("%s-katkaisin: %s → %s", self.name, self.state, state)
+            metrics.inc("henry_breaker_transitions_total", breaker=self.name, to=state)
+            self.state = state
+
+    def _open(self) -> None:
+        self.stats["opened"] += 1
+        # Jitter hajauttaa replikoiden koetukset, ettei toipuva kanta saa kaikkia kerralla
+        self._retry_at = time.monotonic() + self._backoff_s * random.uniform(0.8, 1.2)
+        self._set(OPEN)
+
+    def _probe(self) -> None:
+        self.stats["probes"] += 1
+        try:
+            self.probe()
+        except Exception as e:
+            with self._lock:
+                self.last_error = _describe(e)
+                self._backoff_s = min(self.max_reset_s, self._backoff_s * 2)
+                self._open()
+            return
+        with self._lock:
+            self._failures = 0
+            self._backoff_s = self.reset_after_s
+            self._set(CLOSED)
+        for fn in self._listeners:
+            try:
+                fn()
+            except Exception as e:
+                log.warning("%s-katkaisimen kuuntelija epäonnistui: %s", self.name, e)
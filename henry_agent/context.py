@@ -0,0 +1,162 @@
+"""
+Token-budjetoitu kontekstiikkuna.
+
+Jokaisella vuorolla mallille lähetetään system-prompt, liukuva tiivistelmä
+vanhoista vuoroista ja tuoreimmat viestit. Kun budjetti ylittyy, vanhimmat
+viestit taitetaan tiivistelmään, joten promptin koko pysyy rajattuna
+keskustelun pituudesta riippumatta.
+
+Tokenit lasketaan tiktokenilla; jos enkoodausta ei saada ladattua
+(esim. offline), käytetään karkeaa arviota (~4 merkkiä / token).
+"""
+
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .settings import int_setting
+
+# OpenAI:n chat-formaatin kiinteät kustannukset (cookbookin mukaiset arviot)
+TOKENS_PER_MESSAGE = 3
+TOKENS_REPLY_PRIMING = 3
+
+SUMMARY_HEADER = "TIIVISTELMÄ AIEMMASTA KESKUSTELUSTA (vanhimmat vuorot tiivistetty):\n"
+
+_ROLE_LABELS = {"user": "Käyttäjä", "assistant": "Agentti"}
+
+
+@lru_cache(maxsize=8)
+def _encoding(model: str):
+    try:
+        import tiktoken
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("o200k_base")
+    except Exception:
+        return None
+
+
+@lru_cache(maxsize=4096)
+def count_tokens(text: str, model: str = "gpt-4o-mini") -> int:
+    enc = _encoding(model)
+    if enc is None:
+        return max(1, len(text) // 4) if text else 0
+    return len(enc.encode(text, disallowed_special=()))
+
+
+@dataclass
+class ContextState:
+    """Sessiokohtainen tila: tiivistelmä ja montako historian viestiä on taitettu siihen."""
+    summary: str = ""
+    folded: int = 0
+
+
+def extractive_fold(summary: str, folded: List[Dict[str, str]], max_chars: int = 220) -> str:
+    # Oletustiivistäjä: ei LLM-kutsua, vain jokaisen viestin alku yhdelle riville.
+    lines = [summary] if summary else []
+    for m in folded:
+        text = re.sub(r"\s+", " ", str(m.get("content", ""))).strip()
+        if len(text) > max_chars:
+            text = text[:max_chars].rsplit(" ", 1)[0] + " …"
+        lines.append(f"- {_ROLE_LABELS.get(m.get('role', ''), m.get('role', ''))}: {text}")
+    return "\n".join(lines)
+
+
+class ContextWindow:
+    """
+    Rakentaa mallille lähetettävän viestilistan token-budjetin sisään.
+
+    summarizer(vanha_tiivistelmä, taitettavat_viestit) -> uusi tiivistelmä;
+    oletuksena extractive_fold (nopea, ei lisäkutsuja).
+    """
+
+    def __init__(
+        self,
+        budget_tokens: int = 6000,
+        keep_messages: int = 4,
+        summary_tokens: int = 600,
+        model: str = "gpt-4o-mini",
+        summarizer: Optional[Callable[[str, List[Dict[str, str]]], str]] = None,
+    ):
+        self.budget_tokens = budget_tokens
+        self.keep_messages = max(1, keep_messages)
+        self.summary_tokens = summary_tokens
+        self.model = model
+        self.summarizer = summarizer or extractive_fold
+
+    @classmethod
+    def from_settings(cls, model: str = "gpt-4o-mini", **kw: Any) -> "ContextWindow":
+        return cls(
+            budget_tokens=int_setting("CONTEXT_TOKEN_BUDGET", 6000),
+            keep_messages=int_setting("CONTEXT_KEEP_MESSAGES", 4),
+            summary_tokens=int_setting("CONTEXT_SUMMARY_TOKENS", 600),
+            model=model,
+            **kw,
+        )
+
+    def count(self, text: str) -> int:
+        return count_tokens(text or "", self.model)
+
+    def count_messages(self, messages: List[Dict[str, str]]) -> int:
+        return TOKENS_REPLY_PRIMING + sum(
+            TOKENS_PER_MESSAGE + self.count(m.get("content", "")) for m in messages
+        )
+
+    def _trim_summary(self, summary: str, limit: int) -> str:
+        # Liukuva tiivistelmä: pudotetaan vanhimpia rivejä kunnes mahtuu rajaan.
+        lines = summary.split("\n")
+        while len(lines) > 1 and self.count("\n".join(lines)) > limit:
+            lines.pop(0)
+        return "\n".join(lines)
+
+    def _assemble(self, system: List[Dict[str, str]], summary: str, recent: List[Dict[str, str]],
+                  extra: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        # Järjestys pitää etuosan vakaana (OpenAI:n prompt-välimuisti): system → tiivistelmä →
+        # historia; vuorokohtaiset extra-viestit vasta viimeisen käyttäjäviestin eteen.
+        out = list(system)
+        if summary:
+            out.append({"role": "system", "content": SUMMARY_HEADER + summary})
+        if extra and recent and recent[-1].get("role") == "user":
+            out.extend(recent[:-1])
+            out.extend(extra)
+            out.append(recent[-1])
+        else:
+            out.extend(recent)
+            out.extend(extra)
+        return out
+
+    def build(self, messages: List[Dict[str, str]], state: ContextState,
+              extra: Optional[List[Dict[str, str]]] = None) -> Tuple[List[Dict[str, str]], Dict[str, int]]:
+        # extra: vuorokohtaiset system-viestit (esim. haetut taustatiedot), mukana budjetissa
+        system = [m for m in messages if m.get("role") == "system"]
+        extra = list(extra or [])
+        history = [m for m in messages if m.get("role") != "system"]
+        state.folded = min(state.folded, len(history))
+
+        recent = history[state.folded:]
+        prompt = self._assemble(system, state.summary, recent, extra)
+        while self.count_messages(prompt) > self.budget_tokens and len(recent) > self.keep_messages:
+            # Taitetaan vanhin viesti (tai käyttäjä+vastaus-pari kerralla, jos mahdollista)
+            n = 2 if len(recent) - 2 >= self.keep_messages else 1
+            state.summary = self._trim_summary(self.summarizer(state.summary, recent[:n]), self.summary_tokens)
+            state.folded += n
+            recent = history[state.folded:]
+            prompt = self._assemble(system, state.summary, recent, extra)
+
+        # Viimeinen keino: kutistetaan tiivistelmää, jos tuoreet viestit eivät muuten mahdu
+        if self.count_messages(prompt) > self.budget_tokens and state.summary:
+            room = self.budget_tokens - self.count_messages(self._assemble(system, "", recent, extra)) - TOKENS_PER_MESSAGE
+            state.summary = self._trim_summary(state.summary, max(0, room)) if room > 0 else ""
+            prompt = self._assemble(system, state.summary, recent, extra)
+
+        prompt_tokens = self.count_messages(prompt)
+        stats = {
+            "prompt_tokens": prompt_tokens,
+            "budget_tokens": self.budget_tokens,
+            "within_budget": int(prompt_tokens <= self.budget_tokens),
+            "folded_messages": state.folded,
+            "summary_tokens": self.count(state.summary) if state.summary else 0,
+        }
+        return prompt, stats
@@ -0,0 +1,735 @@
+"""
+Chat-loki: Supabase Postgres (prosessin yhteinen pooli) jos DATABASE_URL on
+asetettu, muutoin SQLite (/mount/data/chatlogs.db).
+
+Postgres-katkokset: prosessin yhteinen katkaisin (PG_BREAKER) hylkää kutsut heti,
+kun kanta ei vastaa, ja koettaa toipumista taustalla. Katkoksen aikana kirjoitukset
+menevät paikalliseen spooliin (henry_agent.spool) ja viedään Postgresiin
+idempotentisti, kun katkaisin sulkeutuu; lukuihin vastataan spoolin paikallisesta
+näkymästä. UI ei siis odota kuollutta kantaa, eikä loki jakaudu pysyvästi kahteen kantaan.
+
+Funktiot eivät riipu Streamlitistä: state-mapping (Streamlitissä st.session_state,
+muualla dict) saa tiedoksi "use_postgres"-lipun, ja varoitukset ohjataan
+set_warning_handler()-koukulla.
+"""
+
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterator, List, MutableMapping, Optional, Sequence, Tuple
+from urllib.parse import urlparse
+
+from . import metrics, prompt_store
+from .breaker import CircuitBreaker, CircuitOpen
+from .pg_pool import PgPool, PoolTimeout
+from .settings import bool_setting, float_setting, int_setting, setting
+from .spool import Backfiller, Spool, SpoolRow
+from .sqlite_backend import SqliteBackend
+from .writebehind import WriteBehindLogger
+
+log = logging.getLogger(__name__)
+
+# Kirjoituskelpoinen polku myös Streamlit Cloudissa
+if os.path.exists("/mount/data"):
+    DB_DIR = "/mount/data"
+else:
+    DB_DIR = os.getcwd()
+os.makedirs(DB_DIR, exist_ok=True)
+DB_PATH = setting("CHATLOG_DB_PATH", "") or os.path.join(DB_DIR, "chatlogs.db")
+
+
+# ============== DB URL siistijä (Supabase PG → else SQLite) ==============
+def _clean_db_url(u: str) -> str:
+    if not u:
+        return ""
+    u = u.strip().strip('"').strip("'")
+    # placeholderiksi jäänyt demo-domain -> pakota SQLiteen
+    if "db.xxxxx.supabase.co" in u:
+        return ""
+    return u
+
+DATABASE_URL = _clean_db_url(setting("DATABASE_URL", "") or "")
+
+def _safe_dbu(mask_target: str) -> str:
+    try:
+        u = urlparse(mask_target)
+        host = u.hostname or "?"
+        port = u.port or "?"
+        return f"{host}:{port}"
+    except Exception:
+        return "?"
+
+
+# ============== Varoitukset (UI voi ohjata esim. st.warningiin) ==============
+_warn: Callable[[str], Any] = log.warning
+
+def set_warning_handler(fn: Callable[[str], Any]) -> None:
+    global _warn
+    _warn = fn
+
+def _pg_failed(state: MutableMapping[str, Any], op: str, e: Exception) -> None:
+    # Ei pysyvää sessiolippua: katkaisin päättää, milloin PG:tä yritetään taas.
+    # Siirtymät spooliin/paikalliseen näkymään lasketaan operaatioittain.
+    state["use_postgres"] = False
+    metrics.inc("henry_db_fallbacks_total", op=op)
+    if not isinstance(e, CircuitOpen):
+        _warn(f"PG-{op} epäonnistui ({e}); käytetään paikallista spoolia.")
+
+
+# ============== Yhteydet ==============
+_POOL: Optional[PgPool] = None
+_POOL_LOCK = threading.Lock()
+
+def _pg_configured() -> bool:
+    return bool(DATABASE_URL and (DATABASE_URL.startswith("postgres://") or DATABASE_URL.startswith("postgresql://")))
+
+def _is_outage(e: BaseException) -> bool:
+    # Yhteys-/saatavuusvirhe (katkaisin laskee nämä); SQL- ja datavirheet eivät ole katkoksia
+    if isinstance(e, (CircuitOpen, PoolTimeout)):
+        return True
+    try:
+        import psycopg2
+    except ImportError:
+        return False
+    return isinstance(e, (psycopg2.OperationalError, psycopg2.InterfaceError))
+
+def get_pool() -> Optional[PgPool]:
+    # Yksi pooli per prosessi; luonti toimii samalla backendin koettimena. Epäonnistunut
+    # luonti avaa katkaisimen, ja uusi yritys tehdään koetinsäikeessä (_probe_pg).
+    global _POOL
+    if _POOL is not None or not _pg_configured() or not PG_BREAKER.closed:
+        return _POOL
+    # Toinen säie luo poolia parhaillaan → ei jäädä odottamaan sen yhteydenottoa
+    if not _POOL_LOCK.acquire(blocking=False):
+        return None
+    try:
+        if _POOL is None:
+            with metrics.span("db_pool_probe"):
+                _POOL = PgPool.from_settings(DATABASE_URL)
+    except Exception as e:
+        PG_BREAKER.trip(e)
+        log.warning("PG-pooli ei käynnistynyt (%s): %s", _safe_dbu(DATABASE_URL), e)
+    finally:
+        _POOL_LOCK.release()
+    return _POOL
+
+def _probe_pg() -> None:
+    # Half-open-koetus: uusi pooli (katkoksen yli jääneet yhteydet ovat todennäköisesti rikki) + SELECT 1
+    global _POOL
+    with metrics.span("db_pool_probe"):
+        pool = PgPool.from_settings(DATABASE_URL)
+        try:
+            with pool.connection() as conn:
+                with conn.cursor() as c:
+                    c.execute("SELECT 1")
+        except Exception:
+            pool.close()
+            raise
+    with _POOL_LOCK:
+        old, _POOL = _POOL, pool
+    if old is not None:
+        old.close()
+
+PG_BREAKER = CircuitBreaker(
+    "pg", _probe_pg,
+    failure_threshold=int_setting("PG_BREAKER_FAILURES", 2),
+    reset_after_s=float_setting("PG_BREAKER_RESET_S", 5.0),
+    max_reset_s=float_setting("PG_BREAKER_MAX_RESET_S", 60.0),
+)
+
+@contextmanager
+def _pg_conn() -> Iterator[Any]:
+    # Katkaisin auki → CircuitOpen heti; katkosvirheet kirjataan katkaisimelle
+    PG_BREAKER.check()
+    pool = get_pool()
+    if pool is None:
+        raise CircuitOpen("Postgres ei ole käytettävissä")
+    try:
+        with pool.connection() as conn:
+            yield conn
+    except Exception as e:
+        if _is_outage(e):
+            PG_BREAKER.failure(e)
+        raise
+    PG_BREAKER.success()
+
+SQLITE = SqliteBackend(DB_PATH, busy_timeout_ms=int_setting("SQLITE_BUSY_TIMEOUT_MS", 5000))
+SPOOL = Spool(SQLITE, max_attempts=int_setting("SPOOL_MAX_ATTEMPTS", 5))
+
+def _sqlite_conn():
+    # Säiekohtainen, uudelleenkäytetty yhteys (autocommit; kirjoitukset _sqlite_write()-transaktiossa).
+    # Migraatio varmistetaan myös tässä: PG-sessio voi pudota SQLiteen kesken kaiken.
+    SQLITE.migrate()
+    return SQLITE.connection()
+
+def _sqlite_write():
+    SQLITE.migrate()
+    return SQLITE.write()
+
+def _use_postgres(state: MutableMapping[str, Any]) -> bool:
+    # Prosessin katkaisin päättää joka kutsulla; statessa oleva lippu on vain tiedoksi
+    use = _pg_configured() and PG_BREAKER.closed
+    state["use_postgres"] = use
+    return use
+
+def _pg_target(state: MutableMapping[str, Any], conversation_id: int) -> Optional[int]:
+    """PG-id suoralle kirjoitukselle; None → kirjoitus spoolin perään (katkos tai jonoa jäljellä)."""
+    if not _use_postgres(state) or SPOOL.has_pending():
+        return None
+    return SPOOL.resolve(conversation_id)
+
+def _pg_id(conversation_id: int) -> Optional[int]:
+    # Luvuille: väliaikainen id → viety PG-id (None, jos vielä spoolissa); SQLite-tilassa sellaisenaan
+    return SPOOL.resolve(conversation_id) if _pg_configured() else conversation_id
+
+
+# ============== Skeema & kirjoitukset ==============
+_PG_SCHEMA_READY = False
+
+def _init_pg() -> None:
+    global _PG_SCHEMA_READY
+    with _pg_conn() as conn:
+        with conn.cursor() as c:
+            c.execute("""
+            CREATE TABLE IF NOT EXISTS conversations (
+                id SERIAL PRIMARY KEY,
+                user_id TEXT,
+                started_at TIMESTAMP,
+                ended_at TIMESTAMP,
+                consent BOOLEAN DEFAULT TRUE,
+                user_agent TEXT
+            );""")
+            c.execute("""
+            CREATE TABLE IF NOT EXISTS messages (
+                id SERIAL PRIMARY KEY,
+                conversation_id INTEGER REFERENCES conversations(id),
+                role TEXT,
+                content TEXT,
+                ts TIMESTAMP
+            );""")
+            c.execute("CREATE INDEX IF NOT EXISTS idx_messages_conv_id ON messages (conversation_id, id);")
+            # Sisältöosoitteinen prompt-varasto + pakatut rungot
+            c.execute("""
+            CREATE TABLE IF NOT EXISTS prompts (
+                id TEXT PRIMARY KEY,
+                content TEXT,
+                content_z BYTEA,
+                created_at TIMESTAMP DEFAULT NOW()
+            );""")
+            c.execute("ALTER TABLE conversations ADD COLUMN IF NOT EXISTS prompt_id TEXT REFERENCES prompts(id);")
+            c.execute("ALTER TABLE messages ADD COLUMN IF NOT EXISTS content_z BYTEA;")
+            c.execute("""
+            CREATE TABLE IF NOT EXISTS answer_cache (
+                key TEXT PRIMARY KEY,
+                partition TEXT,
+                question TEXT,
+                answer TEXT,
+                created_at DOUBLE PRECISION
+            );""")
+            c.execute("CREATE INDEX IF NOT EXISTS idx_answer_cache_created ON answer_cache (created_at);")
+            c.execute("ALTER TABLE conversations ADD COLUMN IF NOT EXISTS resume_token TEXT;")
+            c.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_conversations_resume_token ON conversations (resume_token);")
+            c.execute("""
+            CREATE TABLE IF NOT EXISTS session_state (
+                sid TEXT PRIMARY KEY,
+                version INTEGER NOT NULL,
+                data BYTEA,
+                updated_at TIMESTAMP
+            );""")
+            # Spoolin idempotenssiavaimet: takaisinkirjoituksen uusinta ei tuota kaksoiskappaleita
+            c.execute("ALTER TABLE conversations ADD COLUMN IF NOT EXISTS spool_key TEXT;")
+            c.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_conversations_spool_key ON conversations (spool_key) WHERE spool_key IS NOT NULL;")
+            c.execute("ALTER TABLE messages ADD COLUMN IF NOT EXISTS spool_key TEXT;")
+            # Osioidussa taulussa uniikin indeksin on sisällettävä osioavain (ts)
+            c.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_messages_spool_key ON messages (spool_key, ts) WHERE spool_key IS NOT NULL;")
+    _PG_SCHEMA_READY = True
+
+def init_db(state: MutableMapping[str, Any]):
+    if _use_postgres(state):
+        try:
+            _init_pg()
+            return
+        except Exception as e:
+            _pg_failed(state, "init", e)
+    # SQLite: skeema + migraatiot (mm. (conversation_id, id) -indeksi) kerran per prosessi.
+    # PG-tilassa SQLite on spoolin kanta.
+    SQLITE.migrate()
+
+@metrics.timed("db_start_conversation")
+def start_conversation(state: MutableMapping[str, Any], user_id: str, user_agent: str,
+                       resume_token: Optional[str] = None) -> int:
+    now = datetime.utcnow().isoformat()
+    if _use_postgres(state) and not SPOOL.has_pending():
+        try:
+            with _pg_conn() as conn:
+                with conn.cursor() as c:
+                    c.execute(
+                        "INSERT INTO conversations (user_id, started_at, consent, user_agent, resume_token) VALUES (%s, NOW(), %s, %s, %s) RETURNING id",
+                        (user_id, True, user_agent[:200] if user_agent else None, resume_token)
+                    )
+                    conv_id = c.fetchone()[0]
+            return int(conv_id)
+        except Exception as e:
+            _pg_failed(state, "insert", e)
+    if _pg_configured():
+        # Väliaikainen (negatiivinen) id; takaisinkirjoitus kytkee sen PG-id:hen
+        conv_id = SPOOL.append_conversation(user_id, user_agent[:200] if user_agent else None, resume_token, now)
+        _backfill_wake()
+        return conv_id
+    with _sqlite_write() as conn:
+        c = conn.execute(
+            "INSERT INTO conversations (user_id, started_at, consent, user_agent, resume_token) VALUES (?, ?, ?, ?, ?)",
+            (user_id, now, 1, user_agent[:200] if user_agent else None, resume_token)
+        )
+        conv_id = c.lastrowid
+    return int(conv_id)
+
+@metrics.timed("db_save_message")
+def save_message(state: MutableMapping[str, Any], conversation_id: int, role: str, content: str):
+    now = datetime.utcnow().isoformat()
+    text, text_z = prompt_store.pack(content)
+    cid = _pg_target(state, conversation_id)
+    if cid is not None:
+        try:
+            with _pg_conn() as conn:
+                with conn.cursor() as c:
+                    c.execute(
+                        "INSERT INTO messages (conversation_id, role, content, content_z, ts) VALUES (%s, %s, %s, %s, NOW())",
+                        (cid, role, text, text_z)
+                    )
+            return
+        except Exception as e:
+            _pg_failed(state, "msg", e)
+    if _pg_configured():
+        SPOOL.append_messages([(conversation_id, role, text, text_z, now)])
+        _backfill_wake()
+        return
+    with _sqlite_write() as conn:
+        conn.execute(
+            "INSERT INTO messages (conversation_id, role, content, content_z, ts) VALUES (?, ?, ?, ?, ?)",
+            (conversation_id, role, text, text_z, now)
+        )
+
+# ============== Prompt-varasto: sama system-prompt tallentuu kerran ==============
+@metrics.timed("db_attach_prompt")
+def attach_prompt(state: MutableMapping[str, Any], conversation_id: int, prompt: str) -> str:
+    pid = prompt_store.prompt_hash(prompt)
+    text, text_z = prompt_store.pack(prompt)
+    cid = _pg_target(state, conversation_id)
+    if cid is not None:
+        try:
+            with _pg_conn() as conn:
+                with conn.cursor() as c:
+                    if not prompt_store.is_known("pg", pid):
+                        c.execute(
+                            "INSERT INTO prompts (id, content, content_z) VALUES (%s, %s, %s) ON CONFLICT (id) DO NOTHING",
+                            (pid, text, text_z)
+                        )
+                    c.execute("UPDATE conversations SET prompt_id = %s WHERE id = %s", (pid, cid))
+            prompt_store.mark_known("pg", pid)
+            return pid
+        except Exception as e:
+            _pg_failed(state, "prompt", e)
+    if _pg_configured():
+        SPOOL.append_prompt(conversation_id, pid, text, text_z, datetime.utcnow().isoformat())
+        _backfill_wake()
+        return pid
+    with _sqlite_write() as conn:
+        if not prompt_store.is_known("sqlite", pid):
+            conn.execute(
+                "INSERT OR IGNORE INTO prompts (id, content, content_z, created_at) VALUES (?, ?, ?, ?)",
+                (pid, text, text_z, datetime.utcnow().isoformat())
+            )
+        conn.execute("UPDATE conversations SET prompt_id = ? WHERE id = ?", (pid, conversation_id))
+    prompt_store.mark_known("sqlite", pid)
+    return pid
+
+# ============== Write-behind: viestit taustasäikeen kautta erissä ==============
+_LOGGER: Optional[WriteBehindLogger] = None
+_LOGGER_LOCK = threading.Lock()
+
+def _insert_messages_pg(rows: Sequence[Tuple[Any, ...]]):
+    from psycopg2.extras import execute_values
+    with _pg_conn() as conn:
+        with conn.cursor() as c:
+            # execute_values = yksi INSERT koko erälle (psycopg2:n executemany tekisi rivi kerrallaan)
+            execute_values(
+                c,
+                "INSERT INTO messages (conversation_id, role, content, content_z, ts) VALUES %s",
+                [(cid, role, *prompt_store.pack(content), ts) for cid, role, content, ts in rows],
+            )
+
+def _insert_messages_sqlite(rows: Sequence[Tuple[Any, ...]]):
+    with _sqlite_write() as conn:
+        conn.executemany(
+            "INSERT INTO messages (conversation_id, role, content, content_z, ts) VALUES (?, ?, ?, ?, ?)",
+            [(cid, role, *prompt_store.pack(content), ts.isoformat()) for cid, role, content, ts in rows],
+        )
+
+def _write_messages_pg(rows: Sequence[Tuple[Any, ...]]):
+    # Suoraan PG:hen, kun katkaisin on kiinni eikä spoolissa ole jonoa; muuten (ja virheessä) spoolin perään
+    if PG_BREAKER.closed and not SPOOL.has_pending():
+        targets = [SPOOL.resolve(r[0]) for r in rows]
+        if None not in targets:
+            try:
+                _insert_messages_pg([(cid, *r[1:]) for cid, r in zip(targets, rows)])
+                return
+            except Exception as e:
+                metrics.inc("henry_db_fallbacks_total", op="batch")
+                log.warning("PG-erä epäonnistui (%s); viestit spooliin.", e)
+    SPOOL.append_messages([(cid, role, *prompt_store.pack(content), ts.isoformat()) for cid, role, content, ts in rows])
+    _backfill_wake()
+
+@metrics.timed("db_write_batch")
+def write_message_batch(rows: Sequence[Tuple[Any, ...]]):
+    # rivit: (backend, conversation_id, role, content, ts); peräkkäiset saman backendin rivit yhtenä eränä
+    i = 0
+    while i < len(rows):
+        backend = rows[i][0]
+        j = i
+        while j < len(rows) and rows[j][0] == backend:
+            j += 1
+        chunk = [r[1:] for r in rows[i:j]]
+        if backend == "pg":
+            _write_messages_pg(chunk)
+        else:
+            _insert_messages_sqlite(chunk)
+        i = j
+
+def message_logger() -> Optional[WriteBehindLogger]:
+    # Prosessin yhteinen kirjoittaja; WRITE_BEHIND=0 palauttaa synkronisen tallennuksen.
+    global _LOGGER
+    if _LOGGER is None and bool_setting("WRITE_BEHIND", True):
+        with _LOGGER_LOCK:
+            if _LOGGER is None:
+                _LOGGER = WriteBehindLogger(
+                    write_message_batch,
+                    batch_size=int_setting("WRITE_BEHIND_BATCH", 50),
+                    flush_interval_s=float_setting("WRITE_BEHIND_INTERVAL_S", 0.25),
+                    max_queue=int_setting("WRITE_BEHIND_QUEUE", 2000),
+                    policy=setting("WRITE_BEHIND_POLICY", "block") or "block",
+                    block_timeout_s=float_setting("WRITE_BEHIND_BLOCK_S", 2.0),
+                )
+                metrics.gauge("henry_writebehind_queue_depth", _LOGGER.depth)
+                metrics.gauge("henry_writebehind_dropped", lambda: _LOGGER.stats["dropped"])
+    return _LOGGER
+
+def enqueue_message(state: MutableMapping[str, Any], conversation_id: int, role: str, content: str):
+    # Ei odota tietokantaa: taustasäie kirjoittaa PG:hen tai katkoksen aikana spooliin.
+    logger = message_logger()
+    if logger is None:
+        save_message(state, conversation_id, role, content)
+        return
+    backend = "pg" if _pg_configured() else "sqlite"
+    logger.submit((backend, conversation_id, role, content, datetime.utcnow()))
+
+def flush_messages(timeout: float = 5.0) -> bool:
+    return _LOGGER.flush(timeout) if _LOGGER is not None else True
+
+# ============== Spoolin takaisinkirjoitus Postgresiin ==============
+_BACKFILL: Optional[Backfiller] = None
+_BACKFILL_LOCK = threading.Lock()
+
+def _backfill_pg(rows: Sequence[SpoolRow]) -> Dict[int, int]:
+    """Yksi spoolierä yhdessä PG-transaktiossa; palauttaa {väliaikainen id: PG-id}."""
+    from psycopg2.extras import execute_values
+    if not _PG_SCHEMA_READY:
+        _init_pg()
+    mapping: Dict[int, int] = {}
+    messages: List[Tuple[Any, ...]] = []
+    with _pg_conn() as conn:
+        with conn.cursor() as c:
+            for r in rows:
+                if r.kind == "conversation":
+                    # spool_key/resume_token uniikit → uusinta palauttaa jo viedyn rivin id:n
+                    c.execute(
+                        "INSERT INTO conversations (user_id, started_at, consent, user_agent, resume_token, spool_key) "
+                        "VALUES (%s, %s, TRUE, %s, %s, %s) ON CONFLICT DO NOTHING RETURNING id",
+                        (r.user_id, r.ts, r.user_agent, r.resume_token, r.spool_key),
+                    )
+                    row = c.fetchone()
+                    if row is None:
+                        c.execute("SELECT id FROM conversations WHERE spool_key = %s OR resume_token = %s LIMIT 1",
+                                  (r.spool_key, r.resume_token))
+                        row = c.fetchone()
+                    mapping[r.conversation_id] = int(row[0])
+                    continue
+                cid = mapping.get(r.conversation_id) or SPOOL.resolve(r.conversation_id)
+                if cid is None:
+                    raise LookupError(f"keskustelua {r.conversation_id} ei ole viety Postgresiin")
+                if r.kind == "message":
+                    messages.append((cid, r.role, r.content, r.content_z, r.ts, r.spool_key))
+                elif r.kind == "prompt":
+                    c.execute("INSERT INTO prompts (id, content, content_z) VALUES (%s, %s, %s) ON CONFLICT (id) DO NOTHING",
+                              (r.prompt_id, r.content, r.content_z))
+                    c.execute("UPDATE conversations SET prompt_id = %s WHERE id = %s", (r.prompt_id, cid))
+            if messages:
+                # Yksi INSERT koko erälle spoolin järjestyksessä → id:t kasvavat kuten alun perin
+                execute_values(
+                    c,
+                    "INSERT INTO messages (conversation_id, role, content, content_z, ts, spool_key) VALUES %s "
+                    "ON CONFLICT DO NOTHING",
+                    messages,
+                )
+    for r in rows:
+        if r.kind == "prompt":
+            prompt_store.mark_known("pg", r.prompt_id)
+    return mapping
+
+def backfiller() -> Backfiller:
+    global _BACKFILL
+    if _BACKFILL is None:
+        with _BACKFILL_LOCK:
+            if _BACKFILL is None:
+                _BACKFILL = Backfiller(
+                    SPOOL, PG_BREAKER, _backfill_pg, _is_outage,
+                    batch_size=int_setting("SPOOL_BACKFILL_BATCH", 200),
+                    interval_s=float_setting("SPOOL_BACKFILL_INTERVAL_S", 5.0),
+                )
+                PG_BREAKER.on_close(_BACKFILL.wake)
+                metrics.gauge("henry_spool_depth", SPOOL.depth)
+                metrics.gauge("henry_pg_breaker_open", lambda: 0.0 if PG_BREAKER.closed else 1.0)
+    return _BACKFILL
+
+def _backfill_wake() -> None:
+    backfiller().wake()
+
+def start_backfill() -> bool:
+    """Käynnistää takaisinkirjoittajan (PG-tilassa); edellisen ajon spooli viedään heti."""
+    if not _pg_configured():
+        return False
+    if SPOOL.has_pending():
+        _backfill_wake()
+    else:
+        backfiller().start()
+    return True
+
+def status() -> Dict[str, Any]:
+    """Katkaisimen ja spoolin tila (admin-paneeli)."""
+    if not _pg_configured():
+        return {"backend": "sqlite"}
+    return {
+        "backend": "pg", "breaker": PG_BREAKER.state, "last_error": PG_BREAKER.last_error,
+        "retry_in_s": round(PG_BREAKER.retry_in(), 1), "spool": SPOOL.depth(), "spool_dead": SPOOL.dead(),
+        "backfilled": backfiller().stats["written"],
+    }
+
+@metrics.timed("db_fetch_messages")
+def fetch_messages(state: MutableMapping[str, Any], conversation_id: int) -> List[Dict[str, Any]]:
+    # System-prompt palautetaan ensimmäisenä rivinä prompts-taulusta (ts = keskustelun alku)
+    flush_messages()  # read-your-writes: jonossa olevat viestit ensin kantaan
+    if _pg_configured():
+        rows: List[Tuple[Any, ...]] = []
+        cid = _pg_id(conversation_id)
+        if cid is not None and _use_postgres(state):
+            try:
+                with _pg_conn() as conn:
+                    with conn.cursor() as c:
+                        c.execute("""
+                        SELECT 'system', p.content, p.content_z, cv.started_at FROM conversations cv
+                        JOIN prompts p ON p.id = cv.prompt_id
+                        WHERE cv.id = %s
+                        """, (cid,))
+                        rows = c.fetchall()
+                        c.execute("""
+                        SELECT role, content, content_z, ts FROM messages
+                        WHERE conversation_id = %s
+                        ORDER BY id ASC
+                        """, (cid,))
+                        rows += c.fetchall()
+            except Exception as e:
+                _pg_failed(state, "fetch", e)
+                rows = []
+        # Spoolissa odottava osa (katkoksen aikana kirjoitetut) perään
+        if not rows or rows[0][0] != "system":
+            prompt = SPOOL.prompt(conversation_id)
+            rows = ([("system", *prompt)] if prompt else []) + rows
+        rows += [r[1:] for r in reversed(SPOOL.messages(conversation_id))]
+        return [{"role": r[0], "content": prompt_store.unpack(r[1], r[2]), "ts": _ts(r[3])} for r in rows]
+    conn = _sqlite_conn()
+    rows = conn.execute("""
+    SELECT 'system', p.content, p.content_z, cv.started_at FROM conversations cv
+    JOIN prompts p ON p.id = cv.prompt_id
+    WHERE cv.id = ?
+    """, (conversation_id,)).fetchall()
+    rows += conn.execute("""
+    SELECT role, content, content_z, ts FROM messages
+    WHERE conversation_id = ?
+    ORDER BY id ASC
+    """, (conversation_id,)).fetchall()
+    return [{"role": r[0], "content": prompt_store.unpack(r[1], r[2]), "ts": r[3]} for r in rows]
+
+def _ts(value: Any) -> str:
+    return value.isoformat() if hasattr(value, "isoformat") else (value or "")
+
+# ============== Jatkettavat keskustelut: token + keyset-sivutus ==============
+def _read(state: MutableMapping[str, Any], op: str, sql: str, params: Tuple[Any, ...]) -> List[Tuple[Any, ...]]:
+    # sql käyttää {p}-paikkamerkkiä: %s PG:lle, ? SQLitelle. PG-tilassa katkos → [] heti;
+    # kutsuja täydentää spoolin paikallisesta näkymästä.
+    if not _pg_configured():
+        return _sqlite_conn().execute(sql.format(p="?"), params).fetchall()
+    if _use_postgres(state):
+        try:
+            with _pg_conn() as conn:
+                with conn.cursor() as c:
+                    c.execute(sql.format(p="%s"), params)
+                    return c.fetchall()
+        except Exception as e:
+            _pg_failed(state, op, e)
+    return []
+
+def _read_conversation(state: MutableMapping[str, Any], op: str, sql: str, conversation_id: int,
+                       params: Tuple[Any, ...], local: Callable[[], List[Tuple[Any, ...]]]) -> List[Tuple[Any, ...]]:
+    # Väliaikainen id käännetään PG-id:ksi; tyhjä tai katkennut PG-luku → spoolin rivit
+    cid = _pg_id(conversation_id)
+    rows = _read(state, op, sql, (cid, *params)) if cid is not None else []
+    if not rows and _pg_configured():
+        rows = local()
+    return rows
+
+def resolve_resume_token(state: MutableMapping[str, Any], token: str) -> Optional[int]:
+    if not token:
+        return None
+    rows = _read(state, "resume", "SELECT id FROM conversations WHERE resume_token = {p}", (token,))
+    if rows:
+        return int(rows[0][0])
+    # Katkoksen aikana aloitettu, vielä viemätön keskustelu → väliaikainen id
+    return SPOOL.find_resume(token) if _pg_configured() else None
+
+def fetch_prompt(state: MutableMapping[str, Any], conversation_id: int) -> str:
+    def local() -> List[Tuple[Any, ...]]:
+        row = SPOOL.prompt(conversation_id)
+        return [row[:2]] if row else []
+    rows = _read_conversation(state, "fetch", """
+    SELECT p.content, p.content_z FROM conversations cv JOIN prompts p ON p.id = cv.prompt_id
+    WHERE cv.id = {p}
+    """, conversation_id, (), local)
+    return prompt_store.unpack(rows[0][0], rows[0][1]) if rows else ""
+
+def first_user_message(state: MutableMapping[str, Any], conversation_id: int) -> str:
+    flush_messages()
+    rows = _read_conversation(state, "fetch", """
+    SELECT content, content_z FROM messages
+    WHERE conversation_id = {p} AND role = 'user' ORDER BY id ASC LIMIT 1
+    """, conversation_id, (), lambda: [r[2:4] for r in reversed(SPOOL.messages(conversation_id)) if r[1] == "user"][:1])
+    return prompt_store.unpack(rows[0][0], rows[0][1]) if rows else ""
+
+def count_user_messages(state: MutableMapping[str, Any], conversation_id: int) -> int:
+    flush_messages()
+    rows = _read_conversation(state, "fetch", """
+    SELECT COUNT(*) FROM messages WHERE conversation_id = {p} AND role = 'user'
+    """, conversation_id, (), lambda: [(sum(1 for r in SPOOL.messages(conversation_id) if r[1] == "user"),)])
+    return int(rows[0][0]) if rows else 0
+
+@metrics.timed("db_fetch_page")
+def fetch_message_page(state: MutableMapping[str, Any], conversation_id: int, before_id: Optional[int] = None,
+                       limit: int = 20) -> List[Dict[str, Any]]:
+    """Uusimmat `limit` viestiä ennen id:tä before_id, aikajärjestyksessä (keyset, ei OFFSETia)."""
+    flush_messages()
+    # Spoolin näkymässä id:t ovat spoolin omia; sivutus toimii sen sisällä
+    rows = _read_conversation(state, "fetch", """
+    SELECT id, role, content, content_z, ts FROM messages
+    WHERE conversation_id = {p} AND id < {p}
+    ORDER BY id DESC LIMIT {p}
+    """, conversation_id, (before_id if before_id is not None else 2 ** 62, limit),
+        lambda: SPOOL.messages(conversation_id, before_id, limit))
+    return [
+        {"id": int(r[0]), "role": r[1], "content": prompt_store.unpack(r[2], r[3]), "ts": _ts(r[4])}
+        for r in reversed(rows)
+    ]
+
+# ============== Vastausvälimuisti: pysyvyys ==============
+def _shared_backend() -> str:
+    # Prosessin (ja replikoiden) yhteinen data → konfiguraation mukaan; katkoksessa PG-kutsut
+    # epäonnistuvat heti (CircuitOpen), eikä data jakaudu kahteen kantaan
+    return "pg" if _pg_configured() else "sqlite"
+
+def load_answer_cache(limit: int) -> List[Tuple[Any, ...]]:
+    sql = "SELECT key, partition, question, answer, created_at FROM answer_cache ORDER BY created_at DESC LIMIT {}"
+    if _shared_backend() == "pg":
+        try:
+            with _pg_conn() as conn:
+                with conn.cursor() as c:
+                    c.execute(sql.format("%s"), (limit,))
+                    return list(reversed(c.fetchall()))
+        except Exception as e:
+            log.warning("vastausvälimuistin lataus PG:stä epäonnistui: %s", e)
+            return []
+    return list(reversed(_sqlite_conn().execute(sql.format("?"), (limit,)).fetchall()))
+
+def write_answer_cache_batch(ops: Sequence[Tuple[Any, ...]]):
+    # ops: ("put", key, partition, question, answer, created_at) | ("del", key)
+    puts = [op[1:] for op in ops if op[0] == "put"]
+    dels = [(op[1],) for op in ops if op[0] == "del"]
+    if _shared_backend() == "pg":
+        with _pg_conn() as conn:
+            with conn.cursor() as c:
+                if dels:
+                    c.executemany("DELETE FROM answer_cache WHERE key = %s", dels)
+                if puts:
+                    c.executemany(
+                        "INSERT INTO answer_cache (key, partition, question, answer, created_at) VALUES (%s, %s, %s, %s, %s) "
+                        "ON CONFLICT (key) DO UPDATE SET answer = EXCLUDED.answer, created_at = EXCLUDED.created_at",
+                        puts,
+                    )
+        return
+    with _sqlite_write() as conn:
+        if dels:
+            conn.executemany("DELETE FROM answer_cache WHERE key = ?", dels)
+        if puts:
+            conn.executemany(
+                "INSERT OR REPLACE INTO answer_cache (key, partition, question, answer, created_at) VALUES (?, ?, ?, ?, ?)",
+                puts,
+            )
+
+# ============== Jaettu sessiotila ==============
+def _shared_read(sql: str, params: Tuple[Any, ...]) -> List[Tuple[Any, ...]]:
+    if _shared_backend() == "pg":
+        with _pg_conn() as conn:
+            with conn.cursor() as c:
+                c.execute(sql.format(p="%s"), params)
+                return c.fetchall()
+    return _sqlite_conn().execute(sql.format(p="?"), params).fetchall()
+
+def load_session_state(sid: str) -> Optional[Tuple[int, bytes]]:
+    rows = _shared_read("SELECT version, data FROM session_state WHERE sid = {p}", (sid,))
+    return (int(rows[0][0]), bytes(rows[0][1])) if rows else None
+
+def session_state_version(sid: str) -> Optional[int]:
+    rows = _shared_read("SELECT version FROM session_state WHERE sid = {p}", (sid,))
+    return int(rows[0][0]) if rows else None
+
+def save_session_state(sid: str, data: bytes, expected: Optional[int]) -> Optional[int]:
+    """Versiotarkistettu tallennus; palauttaa uuden version tai None ristiriidassa (mitään ei kirjoitettu).
+
+    expected=None → rivi luodaan vain, jos sitä ei vielä ole. Myös odotetun version rivi
+    luodaan uudelleen, jos se on ehditty poistaa (retention)."""
+    cas = "UPDATE session_state SET version = version + 1, data = {p}, updated_at = {p} WHERE sid = {p} AND version = {p} RETURNING version"
+    insert = ("INSERT INTO session_state (sid, version, data, updated_at) VALUES ({p}, 1, {p}, {p}) "
+              "ON CONFLICT (sid) DO NOTHING RETURNING version")
+    now = datetime.utcnow()
+    if _shared_backend() == "pg":
+        import psycopg2
+        with _pg_conn() as conn:
+            with conn.cursor() as c:
+                row = None
+                if expected is not None:
+                    c.execute(cas.format(p="%s"), (psycopg2.Binary(data), now, sid, expected))
+                    row = c.fetchone()
+                if row is None:
+                    c.execute(insert.format(p="%s"), (sid, psycopg2.Binary(data), now))
+                    row = c.fetchone()
+                return int(row[0]) if row else None
+    with _sqlite_write() as conn:
+        row = None
+        if expected is not None:
+            row = conn.execute(cas.format(p="?"), (data, now.isoformat(), sid, expected)).fetchone()
+        if row is None:
+            row = conn.execute(insert.format(p="?"), (sid, data, now.isoformat())).fetchone()
+        return int(row[0]) if row else None
+
+def load_prompt(pid: str) -> Optional[str]:
+    rows = _shared_read("SELECT content, content_z FROM prompts WHERE id = {p}", (pid,))
+    return prompt_store.unpack(rows[0][0], rows[0][1]) if rows else None
@@ -0,0 +1,88 @@
+"""
+Tekstien upotukset (embeddings) NumPy-vektoreiksi.
+
+HashingEmbedder on paikallinen ja deterministinen: sanat + sanojen
+merkkitrigrammit hajautetaan kiinteään ulottuvuuteen (feature hashing).
+Trigrammit tekevät taivutusmuodoista lähekkäisiä ("Goforesta" ~ "Gofore"),
+eikä API-kutsuja tarvita. OpenAIEmbedder on valinnainen vaihtoehto.
+Vektorit ovat L2-normalisoituja, joten kosinisamankaltaisuus = pistetulo.
+"""
+
+import re
+import unicodedata
+import zlib
+from typing import List, Sequence
+
+import numpy as np
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+
+def normalize_text(text: str) -> str:
+    t = unicodedata.normalize("NFKC", text or "").lower()
+    return " ".join(_WORD.findall(t))
+
+
+class HashingEmbedder:
+    def __init__(self, dim: int = 512, ngram: int = 3):
+        self.dim = dim
+        self.ngram = ngram
+        self.name = f"hashing:{dim}:{ngram}"
+
+    def _features(self, text: str) -> List[str]:
+        words = normalize_text(text).split()
+        feats = [f"w:{w}" for w in words]
+        n = self.ngram
+        for w in words:
+            padded = f"<{w}>"
+            feats.extend(f"g:{padded[i:i + n]}" for i in range(max(1, len(padded) - n + 1)))
+        return feats
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            feats = self._features(text)
+            if not feats:
+                continue
+            h = np.fromiter((zlib.crc32(f.encode("utf-8")) for f in feats), dtype=np.uint32, count=len(feats))
+            idx = (h % self.dim).astype(np.int64)
+            sign = np.where(h & 0x80000000, -1.0, 1.0).astype(np.float32)
+            np.add.at(out[row], idx, sign)
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        np.divide(out, norms, out=out, where=norms > 0)
+        return out
+
+
+class OpenAIEmbedder:
+    """OpenAI-upotukset (parempi semantiikka, mutta jokainen haku on API-kutsu)."""
+
+    def __init__(self, model: str = "text-embedding-3-small", dim: int = 1536):
+        self.model = model
+        self.dim = dim
+        self.name = f"openai:{model}"
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        from .admission import admission
+        from .llm import get_client
+
+        client = get_client()
+        if client is None:
+            raise RuntimeError("OPENAI_API_KEY puuttuu, OpenAI-upotuksia ei voi laskea")
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for start in range(0, len(texts), 256):
+            batch = list(texts[start:start + 256])
+            # Upotuksilla on omat rajansa → vain backoff, ei chat-kutsujen jonoa
+            resp = admission().with_retries(lambda: client.embeddings.create(model=self.model, input=batch))
+            for d in resp.data:
+                v = np.asarray(d.embedding, dtype=np.float32)[: self.dim]
+                out[start + d.index, : len(v)] = v
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        np.divide(out, norms, out=out, where=norms > 0)
+        return out
+
+
+def make_embedder(kind: str = "hashing"):
+    if kind.startswith("openai"):
+        model = kind.split(":", 1)[1] if ":" in kind else "text-embedding-3-small"
+        return OpenAIEmbedder(model)
+    return HashingEmbedder()
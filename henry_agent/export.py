@@ -0,0 +1,212 @@
+"""
+Inkrementaalinen vienti analytiikkaan: conversations- ja messages-taulut
+Parquet-tiedostoiksi päivämäärän mukaan osioituna.
+
+    python -m henry_agent.export --out exports/
+    python -m henry_agent.export --out exports/ --tables messages --batch 10000 --full
+
+Rivit luetaan kiinteän kokoisina erinä: Postgresista nimetyllä (palvelinpuolen)
+kursorilla, SQLitesta id-keyset-paloina. Jokainen erä kirjoitetaan heti:
+
+    <out>/<taulu>/date=YYYY-MM-DD/part-<ensimmäinen id>-<viimeinen id>.parquet
+
+Vesiraja (suurin viety id per taulu) tallennetaan <out>/_watermark.json -tiedostoon
+jokaisen erän jälkeen, joten uusi ajo vie vain uudet rivit ja keskeytynyt ajo jatkaa.
+Muistissa on kerrallaan yksi erä taulun koosta riippumatta. --full vie kaiken
+uudelleen (käytä tyhjään hakemistoon).
+
+Postgresissa write-behind-erät ja spoolin takaisinkirjoitus committaavat id-järjestyksestä
+poiketen: vesirajan alle jäävät puuttuvat id:t (aukot) kirjataan vesirajatiedostoon ja
+tarkistetaan seuraavilla ajoilla, kunnes rivit tulevat näkyviin tai aukko on vanhempi
+kuin EXPORT_GAP_TTL_S (peruttu transaktio). SQLitessa kirjoitukset ovat sarjallisia.
+
+Keskustelut viedään kerran, id:n mukaan: myöhemmät ended_at- tai consent-muutokset eivät
+päivity vietyyn dataan. Tuoreet arvot saa --full-viennillä tyhjään hakemistoon.
+
+Parquetin kirjoitus vaatii pandasin lisäksi pyarrow'n (requirements.txt).
+"""
+
+import argparse
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from . import db, prompt_store
+from .settings import float_setting
+
+log = logging.getLogger(__name__)
+
+# taulu → (sarakkeet, päivämääräsarake); resume_token jätetään pois (se on pääsyavain)
+TABLES: Dict[str, Tuple[Tuple[str, ...], str]] = {
+    "conversations": (("id", "user_id", "started_at", "ended_at", "consent", "user_agent", "prompt_id"), "started_at"),
+    "messages": (("id", "conversation_id", "role", "content", "content_z", "ts"), "ts"),
+}
+WATERMARK_FILE = "_watermark.json"
+GAPS_KEY = "_gaps"          # {taulu: [[ensimmäinen id, viimeinen id, havaittu (epoch)], ...]}
+MAX_GAPS = 1000
+
+
+# ============== Vesiraja ==============
+def load_watermark(out_dir: str) -> Dict[str, Any]:
+    try:
+        with open(os.path.join(out_dir, WATERMARK_FILE), encoding="utf-8") as f:
+            raw = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    marks: Dict[str, Any] = {k: int(v) for k, v in raw.items() if k != GAPS_KEY}
+    marks[GAPS_KEY] = {t: [list(g) for g in gaps] for t, gaps in (raw.get(GAPS_KEY) or {}).items()}
+    return marks
+
+
+def save_watermark(out_dir: str, marks: Dict[str, Any]) -> None:
+    path = os.path.join(out_dir, WATERMARK_FILE)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(marks, f, indent=2, sort_keys=True)
+    os.replace(tmp, path)
+
+
+# ============== Erälukijat ==============
+def _pg_batches(table: str, columns: Sequence[str], after_id: int, batch: int,
+                upto_id: Optional[int] = None) -> Iterator[List[Tuple[Any, ...]]]:
+    pool = db.get_pool()
+    if pool is None:
+        raise RuntimeError("Postgres ei ole käytettävissä (DATABASE_URL)")
+    with pool.connection() as conn:
+        # Nimetty kursori = palvelinpuolen kursori: rivit tulevat itersize-erissä, ei koko tulosjoukkona
+        with conn.cursor(name=f"henry_export_{table}") as c:
+            c.itersize = batch
+            c.execute(f"SELECT {', '.join(columns)} FROM {table} WHERE id > %s AND id <= %s ORDER BY id",
+                      (after_id, upto_id if upto_id is not None else 2 ** 62))
+            while True:
+                rows = c.fetchmany(batch)
+                if not rows:
+                    return
+                yield rows
+
+
+def _sqlite_batches(table: str, columns: Sequence[str], after_id: int, batch: int,
+                    upto_id: Optional[int] = None) -> Iterator[List[Tuple[Any, ...]]]:
+    conn = db._sqlite_conn()
+    sql = f"SELECT {', '.join(columns)} FROM {table} WHERE id > ? AND id <= ? ORDER BY id LIMIT ?"
+    upto = upto_id if upto_id is not None else 2 ** 62
+    while True:
+        rows = conn.execute(sql, (after_id, upto, batch)).fetchall()
+        if not rows:
+            return
+        yield rows
+        after_id = rows[-1][0]
+
+
+# ============== Kirjoitus ==============
+def _frame(table: str, columns: Sequence[str], date_col: str, rows: List[Tuple[Any, ...]]):
+    import pandas as pd
+
+    df = pd.DataFrame.from_records(rows, columns=list(columns))
+    if "content_z" in df.columns:
+        df["content"] = [prompt_store.unpack(t, z) for t, z in zip(df["content"], df["content_z"])]
+        df = df.drop(columns=["content_z"])
+    for col in ("started_at", "ended_at", "ts"):
+        if col in df.columns:
+            df[col] = pd.to_datetime(df[col], errors="coerce", format="ISO8601")
+    df["date"] = df[date_col].dt.strftime("%Y-%m-%d").fillna("unknown")
+    return df
+
+
+def _write_batch(out_dir: str, table: str, df) -> int:
+    files = 0
+    for date, part in df.groupby("date", sort=True):
+        target = os.path.join(out_dir, table, f"date={date}")
+        os.makedirs(target, exist_ok=True)
+        name = f"part-{int(part['id'].iloc[0]):012d}-{int(part['id'].iloc[-1]):012d}.parquet"
+        tmp = os.path.join(target, "." + name + ".tmp")
+        part.drop(columns=["date"]).to_parquet(tmp, index=False)
+        os.replace(tmp, os.path.join(target, name))
+        files += 1
+    return files
+
+
+def _missing(lo: int, hi: int, ids: Sequence[int], seen: float) -> List[List[Any]]:
+    # Välin [lo, hi] id:t, joita ei ole listassa ids (nouseva), aukkoina
+    out: List[List[Any]] = []
+    nxt = lo
+    for i in ids:
+        if i > nxt:
+            out.append([nxt, i - 1, seen])
+        nxt = i + 1
+    if nxt <= hi:
+        out.append([nxt, hi, seen])
+    return out
+
+
+def export_table(out_dir: str, table: str, backend: str, batch: int = 5000,
+                 marks: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    columns, date_col = TABLES[table]
+    marks = load_watermark(out_dir) if marks is None else marks
+    start = marks.get(table, 0)
+    reader = _pg_batches if backend == "pg" else _sqlite_batches
+    gaps_by_table = marks.setdefault(GAPS_KEY, {})
+    stats = {"table": table, "from_id": start, "rows": 0, "batches": 0, "files": 0, "late_rows": 0}
+    now = time.time()
+    ttl = float_setting("EXPORT_GAP_TTL_S", 3600.0)
+
+    def write(rows: List[Tuple[Any, ...]]) -> None:
+        stats["files"] += _write_batch(out_dir, table, _frame(table, columns, date_col, rows))
+        stats["rows"] += len(rows)
+        stats["batches"] += 1
+
+    # 1) Aiemmin havaitut aukot: myöhässä committoidut rivit viedään nyt, vanhentuneet aukot unohdetaan
+    still: List[List[Any]] = []
+    for lo, hi, seen in gaps_by_table.get(table, []):
+        found: List[int] = []
+        for rows in reader(table, columns, lo - 1, batch, hi):
+            write(rows)
+            stats["late_rows"] += len(rows)
+            found.extend(int(r[0]) for r in rows)
+        still.extend(g for g in _missing(lo, hi, found, seen) if now - g[2] < ttl)
+    gaps_by_table[table] = still
+    save_watermark(out_dir, marks)
+
+    # 2) Uudet rivit vesirajan yli; Postgresissa väliin jäävät id:t kirjataan aukoiksi
+    last = start
+    for rows in reader(table, columns, start, batch):
+        write(rows)
+        ids = [int(r[0]) for r in rows]
+        if backend == "pg":
+            still.extend(_missing(last + 1 if last else ids[0], ids[-1], ids, now))
+        last = marks[table] = ids[-1]
+        if len(still) > MAX_GAPS:
+            log.warning("vienti: %s-taulussa yli %d aukkoa; vanhimmat ohitetaan", table, MAX_GAPS)
+            del still[:len(still) - MAX_GAPS]
+        save_watermark(out_dir, marks)
+    stats["to_id"] = marks.get(table, start)
+    stats["gaps"] = len(still)
+    return stats
+
+
+def export(out_dir: str, tables: Sequence[str] = tuple(TABLES), backend: str = "auto", batch: int = 5000,
+           full: bool = False) -> List[Dict[str, Any]]:
+    os.makedirs(out_dir, exist_ok=True)
+    if backend == "auto":
+        backend = db._shared_backend()
+    marks: Dict[str, Any] = {} if full else load_watermark(out_dir)
+    return [dict(export_table(out_dir, t, backend, batch, marks), backend=backend) for t in tables]
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    ap = argparse.ArgumentParser(description="Chat-lokin inkrementaalinen Parquet-vienti")
+    ap.add_argument("--out", required=True, help="kohdehakemisto (osiot + _watermark.json)")
+    ap.add_argument("--tables", nargs="+", default=list(TABLES), choices=list(TABLES))
+    ap.add_argument("--backend", default="auto", choices=["auto", "pg", "sqlite"])
+    ap.add_argument("--batch", type=int, default=5000, help="rivejä per erä (muistin yläraja)")
+    ap.add_argument("--full", action="store_true", help="ohita vesiraja ja vie kaikki rivit")
+    args = ap.parse_args(argv)
+    for s in export(args.out, args.tables, args.backend, max(1, args.batch), args.full):
+        print(f"{s['table']}: {s['rows']} riviä ({s['late_rows']} myöhässä), {s['batches']} erää, "
+              f"{s['files']} tiedostoa (id {s['from_id']} → {s['to_id']}, {s['gaps']} avointa aukkoa, {s['backend']})")
+
+
+if __name__ == "__main__":
+    main()
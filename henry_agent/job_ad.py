@@ -0,0 +1,304 @@
+"""
+Työpaikkailmoitukset (PDF): taustaparsinta ja vertailu Henryn osaamiseen.
+
+    key = submit(data, "ilmoitus.pdf")      # sisällön sha256; sama tiedosto uudelleen → heti valmis
+    job = status(key)                        # {"state": queued|parsing|done|error, "pages_done", "pages", ...}
+    agent.attach_job_ad(state, token, job["ad"])   # lyhyt vertailutiivistelmä promptiin
+
+PDF luetaan pypdf:llä sivu kerrallaan taustasäikeessä (JOB_AD_WORKERS), ja
+vaatimusrivit poimitaan sivu kerrallaan, joten koko tekstiä ei pidetä muistissa.
+Tulos tallennetaan sisältöhashilla prosessin LRU:hun ja levylle
+(<RETRIEVAL_INDEX_DIR>/job_ads/<sha>.json): uudelleenlataus ei parsi uudelleen.
+
+Vertailu: SKILLS-avainfraasit upotetaan kerran matriisiksi [P, D]; ilmoituksen
+vaatimusrivit [R, D] verrataan yhdellä matriisitulolla ja osaamisalueen paras
+fraasi valitaan np.maximum.reduceat-operaatiolla. Promptiin menee vain tiivistelmä
+(vahvat osumat, osittaiset, aukot), ei ilmoituksen tekstiä.
+"""
+
+import hashlib
+import io
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Mapping, Optional, Sequence
+
+import numpy as np
+
+from . import metrics
+from .embeddings import HashingEmbedder
+from .persona import SKILLS
+from .settings import float_setting, int_setting, setting
+
+log = logging.getLogger(__name__)
+
+MAX_BYTES = int_setting("JOB_AD_MAX_MB", 10) * 1024 * 1024
+MAX_PAGES = int_setting("JOB_AD_MAX_PAGES", 20)
+MAX_REQUIREMENTS = 60
+STRONG = float_setting("JOB_AD_STRONG", 0.35)     # kosinisamankaltaisuus: selvä vastine
+PARTIAL = float_setting("JOB_AD_PARTIAL", 0.25)   # sivuava vastine
+PARSER_VERSION = 1                                # kasvata, jos poiminta muuttuu (vanha levyvälimuisti ohitetaan)
+
+_BULLET = re.compile(r"^\s*(?:[-–•*▪●◦·]|\d{1,2}[.)])\s+")
+_SENTENCE = re.compile(r"(?<=[.!?])\s+(?=[A-ZÅÄÖ])")
+_CUES = re.compile(
+    r"kokemus|osaami|tuntemus|taito|hallitse|ymmärr|edellyt|vaadi|toivo|odota|eduksi|plussaa|tutkinto|"
+    r"experience|knowledge|skill|familiar|proficien|ability|degree|you have|you are|required|preferred",
+    re.I,
+)
+
+
+# ============== Vaatimusrivien poiminta ==============
+def requirement_lines(text: str) -> List[str]:
+    """Luettelorivit ja vaatimuksilta näyttävät virkkeet (3–40 sanaa)."""
+    out: List[str] = []
+    for raw in (text or "").splitlines():
+        line = raw.strip()
+        if not line:
+            continue
+        bullet = bool(_BULLET.match(line))
+        for sentence in ([_BULLET.sub("", line)] if bullet else _SENTENCE.split(line)):
+            sentence = sentence.strip(" ;,")
+            words = len(sentence.split())
+            if 3 <= words <= 40 and (bullet or _CUES.search(sentence)):
+                out.append(sentence)
+    return out
+
+
+def _title(text: str) -> str:
+    for line in (text or "").splitlines():
+        line = line.strip()
+        if line:
+            return line[:120]
+    return ""
+
+
+# ============== Osaamisindeksi ==============
+class SkillIndex:
+    """Osaamisalueiden avainfraasit valmiiksi upotettuna; match() = yksi matriisitulo."""
+
+    def __init__(self, skills: Mapping[str, Sequence[str]], embedder: Optional[HashingEmbedder] = None):
+        self.embedder = embedder or HashingEmbedder()
+        self.names = list(skills)
+        phrases: List[str] = []
+        starts: List[int] = []
+        for name in self.names:
+            starts.append(len(phrases))
+            phrases.extend(skills[name])
+        self._starts = np.asarray(starts, dtype=np.intp)   # fraasit ryhmiteltynä alueittain
+        self._vecs = self.embedder.embed(phrases)            # [P, D], L2-normalisoitu
+
+    def scores(self, lines: Sequence[str]) -> np.ndarray:
+        """[R, S]: kunkin vaatimusrivin paras kosinisamankaltaisuus kunkin alueen fraaseihin."""
+        if not lines:
+            return np.zeros((0, len(self.names)), dtype=np.float32)
+        sims = self.embedder.embed(lines) @ self._vecs.T      # [R, P]
+        return np.maximum.reduceat(sims, self._starts, axis=1)
+
+    def match(self, lines: Sequence[str]) -> Dict[str, Any]:
+        scores = self.scores(lines)
+        if not scores.size:
+            return {"strong": [], "partial": [], "gaps": []}
+        best = scores.argmax(axis=1)
+        top = scores[np.arange(len(lines)), best]
+        strong: Dict[str, str] = {}
+        partial: Dict[str, str] = {}
+        # Vahvimmat ensin, jotta kunkin alueen esimerkkirivi on sen paras osuma
+        for i in np.argsort(-top):
+            name = self.names[best[i]]
+            if top[i] >= STRONG:
+                strong.setdefault(name, lines[i])
+            elif top[i] >= PARTIAL:
+                partial.setdefault(name, lines[i])
+        gaps = [lines[i] for i in np.flatnonzero(top < PARTIAL)]
+        return {
+            "strong": list(strong.items()),
+            "partial": list(partial.items()),
+            "gaps": gaps,
+        }
+
+
+_INDEX: Optional[SkillIndex] = None
+_INDEX_LOCK = threading.Lock()
+
+
+def skill_index() -> SkillIndex:
+    global _INDEX
+    if _INDEX is None:
+        with _INDEX_LOCK:
+            if _INDEX is None:
+                _INDEX = SkillIndex(SKILLS)
+    return _INDEX
+
+
+def _clip(text: str, n: int = 90) -> str:
+    return text if len(text) <= n else text[:n].rsplit(" ", 1)[0] + " …"
+
+
+def summarize(ad: Mapping[str, Any], max_gaps: int = 4) -> str:
+    """Promptiin menevä tiivistelmä: rooli, vahvat ja osittaiset osumat sekä aukot."""
+    with metrics.span("job_ad_match"):
+        m = skill_index().match(ad["requirements"])
+    lines = [f'LADATTU TYÖPAIKKAILMOITUS ("{_clip(ad["name"], 60)}", {ad["pages"]} s.) – vertailu Henryn osaamiseen. '
+             "Sovita vastaukset tähän rooliin; älä keksi osaamista aukkoihin, "
+             "vaan kerro miten Henry ne kuroisi umpeen."]
+    if ad.get("title"):
+        lines.append(f"Rooli: {_clip(ad['title'])}")
+    if m["strong"]:
+        lines.append("Vahvat osumat: " + "; ".join(f'{n} ← "{_clip(r, 70)}"' for n, r in m["strong"]))
+    if m["partial"]:
+        lines.append("Osittaiset: " + "; ".join(f'{n} ← "{_clip(r, 70)}"' for n, r in m["partial"]))
+    if m["gaps"]:
+        more = len(m["gaps"]) - max_gaps
+        lines.append("Aukot: " + "; ".join(f'"{_clip(r, 70)}"' for r in m["gaps"][:max_gaps])
+                     + (f" (+{more} muuta)" if more > 0 else ""))
+    if not ad["requirements"]:
+        lines.append("Ilmoituksesta ei löytynyt vaatimusrivejä (skannattu PDF?).")
+    return "\n".join(lines)
+
+
+# ============== Parsinta taustalla + välimuisti ==============
+class JobAdParser:
+    def __init__(self, cache_dir: str, workers: int = 2, memory_entries: int = 64):
+        self.cache_dir = cache_dir
+        self.memory_entries = memory_entries
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="job-ad")
+        self._lock = threading.Lock()
+        self._done: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+
+    # ---------- välimuisti ----------
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _remember(self, key: str, ad: Dict[str, Any]) -> None:
+        with self._lock:
+            self._done[key] = ad
+            self._done.move_to_end(key)
+            while len(self._done) > self.memory_entries:
+                self._done.popitem(last=False)
+
+    def cached(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            ad = self._done.get(key)
+            if ad is not None:
+                self._done.move_to_end(key)
+                return ad
+        try:
+            with open(self._path(key), encoding="utf-8") as f:
+                ad = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if ad.get("parser") != PARSER_VERSION:
+            return None
+        self._remember(key, ad)
+        return ad
+
+    def _store(self, key: str, ad: Dict[str, Any]) -> None:
+        self._remember(key, ad)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp = self._path(key) + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(ad, f, ensure_ascii=False)
+            os.replace(tmp, self._path(key))
+        except OSError as e:
+            log.warning("ilmoituksen %s välimuistiin kirjoitus epäonnistui: %s", key[:12], e)
+
+    # ---------- työt ----------
+    def submit(self, data: bytes, name: str = "ilmoitus.pdf") -> str:
+        key = hashlib.sha256(data).hexdigest()
+        if self.cached(key) is not None:
+            metrics.inc("henry_job_ads_total", result="cache_hit")
+            return key
+        with self._lock:
+            job = self._jobs.get(key)
+            if job is not None and job["state"] != "error":
+                return key     # sama tiedosto jo työn alla
+            self._jobs[key] = {"state": "queued", "name": name, "pages_done": 0, "pages": None, "error": ""}
+        if len(data) > MAX_BYTES:
+            self._fail(key, f"tiedosto on yli {MAX_BYTES // (1024 * 1024)} Mt")
+        else:
+            self._pool.submit(self._parse, key, data, name)
+        return key
+
+    def _fail(self, key: str, error: str) -> None:
+        with self._lock:
+            self._jobs[key].update(state="error", error=error)
+        metrics.inc("henry_job_ads_total", result="error")
+
+    def _parse(self, key: str, data: bytes, name: str) -> None:
+        job = self._jobs[key]
+        t0 = time.perf_counter()
+        try:
+            from pypdf import PdfReader
+            reader = PdfReader(io.BytesIO(data))
+            if reader.is_encrypted and not reader.decrypt(""):
+                raise ValueError("salattu PDF")
+            total = len(reader.pages)
+            job.update(state="parsing", pages=min(total, MAX_PAGES))
+            requirements: List[str] = []
+            seen = set()
+            title = ""
+            for i, page in enumerate(reader.pages):
+                if i >= MAX_PAGES:
+                    break
+                text = page.extract_text() or ""
+                title = title or _title(text)
+                for line in requirement_lines(text):
+                    norm = line.lower()
+                    if norm not in seen and len(requirements) < MAX_REQUIREMENTS:
+                        seen.add(norm)
+                        requirements.append(line)
+                job["pages_done"] = i + 1
+        except Exception as e:
+            log.info("ilmoituksen %s parsinta epäonnistui: %s", name, e)
+            self._fail(key, f"PDF:n luku epäonnistui ({e.__class__.__name__}: {e})"[:200])
+            return
+        ad = {
+            "sha": key, "name": name, "title": title, "pages": job["pages_done"], "truncated": total > MAX_PAGES,
+            "requirements": requirements, "parser": PARSER_VERSION,
+        }
+        self._store(key, ad)
+        with self._lock:
+            self._jobs.pop(key, None)
+        metrics.observe("job_ad_parse", time.perf_counter() - t0)
+        metrics.inc("henry_job_ads_total", result="parsed")
+
+    def status(self, key: str) -> Dict[str, Any]:
+        ad = self.cached(key)
+        if ad is not None:
+            return {"state": "done", "pages_done": ad["pages"], "pages": ad["pages"], "error": "", "ad": ad}
+        with self._lock:
+            job = self._jobs.get(key)
+            return dict(job) if job is not None else {"state": "unknown", "error": "tuntematon tiedosto"}
+
+
+_PARSER: Optional[JobAdParser] = None
+
+
+def parser() -> JobAdParser:
+    global _PARSER
+    if _PARSER is None:
+        with _INDEX_LOCK:
+            if _PARSER is None:
+                from .retrieval import _default_index_dir
+                base = setting("RETRIEVAL_INDEX_DIR", "") or _default_index_dir()
+                _PARSER = JobAdParser(
+                    cache_dir=setting("JOB_AD_CACHE_DIR", "") or os.path.join(base, "job_ads"),
+                    workers=int_setting("JOB_AD_WORKERS", 2),
+                )
+    return _PARSER
+
+
+def submit(data: bytes, name: str = "ilmoitus.pdf") -> str:
+    return parser().submit(data, name)
+
+
+def status(key: str) -> Dict[str, Any]:
+    return parser().status(key)
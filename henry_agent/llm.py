@@ -0,0 +1,558 @@
+"""
+OpenAI-kutsut.
+
+openai-kirjasto tuodaan vasta ensimmäisellä tarpeella, ja asiakas luodaan
+kerran per prosessi yhteisen HTTP-poolin päälle (keep-alive, HTTP/2 jos h2 on
+asennettu, erilliset yhteys- ja lukuaikakatkaisut). bootstrap lämmittää poolin
+taustalla (warm), ja sivupalkin tila luetaan välimuistista (health).
+Kaikki chat-kutsut kulkevat henry_agent.admission-kerroksen läpi (jono, rate limit,
+backoff, identtisten pyyntöjen yhdistäminen); siksi asiakkaan omat uusinnat ovat pois.
+"""
+
+import hashlib
+import json
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from . import metrics
+from .admission import admission
+from .context import TOKENS_PER_MESSAGE, count_tokens
+from .settings import bool_setting, float_setting, int_setting, setting
+
+DEFAULT_MODEL = "gpt-4o-mini"   # nopea ja edullinen
+TEMPERATURE = 0.3
+
+_CLIENT: Any = None
+_CLIENT_KEY = ""
+_CLIENT_LOCK = threading.Lock()
+
+# ============== HTTP-yhteydet: yksi yhteyspooli per prosessi ==============
+# Aikakatkaisut erikseen: yhteyden avaus epäonnistuu nopeasti, striimin lukuaika
+# (tauko tavujen välillä) saa olla pidempi. Reitin budjetti korvaa vain lukuajan.
+CONNECT_TIMEOUT_S = float_setting("OPENAI_CONNECT_TIMEOUT_S", 5.0)
+READ_TIMEOUT_S = float_setting("OPENAI_READ_TIMEOUT_S", 30.0)
+WRITE_TIMEOUT_S = float_setting("OPENAI_WRITE_TIMEOUT_S", 10.0)
+POOL_SIZE = int_setting("OPENAI_POOL_SIZE", 20)
+KEEPALIVE_S = float_setting("OPENAI_KEEPALIVE_S", 120.0)
+HTTP2 = bool_setting("OPENAI_HTTP2", True)
+HEALTH_TTL_S = float_setting("OPENAI_HEALTH_TTL_S", 60.0)
+
+_HTTP: Any = None
+
+
+def _httpx() -> Any:
+    # openai-kirjaston oma HTTP-kirjasto (uudemmissa httpx2, vanhemmissa httpx)
+    try:
+        import httpx2 as httpx
+    except ImportError:
+        import httpx
+    return httpx
+
+
+def _h2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class ConnStats:
+    """
+    Yhteyksien uudelleenkäyttö httpcore-tracen perusteella: pyyntö, jonka aikana
+    avattiin TCP-yhteys, on "new", muut kulkivat valmiiksi auki olleessa yhteydessä.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.new = 0
+        self.connect_s = 0.0
+        self.tls_s = 0.0
+        self.http2 = False
+
+    def on_request(self, request: Any) -> None:
+        started: Dict[str, float] = {}
+
+        def trace(name: str, info: Dict[str, Any]) -> None:
+            if name.endswith(".started"):
+                started[name[:-8]] = time.perf_counter()
+                if name.endswith("send_request_headers.started") and "counted" not in started:
+                    started["counted"] = 1.0
+                    self._count(name.startswith("http2"), "connection.connect_tcp" in started)
+            elif name.endswith(".complete") and name[:-9] in started:
+                elapsed = time.perf_counter() - started[name[:-9]]
+                if name == "connection.connect_tcp.complete":
+                    self._add("connect_s", elapsed)
+                    metrics.observe("llm_connect", elapsed)
+                elif name == "connection.start_tls.complete":
+                    self._add("tls_s", elapsed)
+                    metrics.observe("llm_tls", elapsed)
+
+        request.extensions = {**request.extensions, "trace": trace}
+
+    def _count(self, http2: bool, new: bool) -> None:
+        with self._lock:
+            self.requests += 1
+            self.new += int(new)
+            self.http2 = self.http2 or http2
+        metrics.inc("henry_llm_connections_total", kind="new" if new else "reused")
+
+    def _add(self, field: str, seconds: float) -> None:
+        with self._lock:
+            setattr(self, field, getattr(self, field) + seconds)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            reused = self.requests - self.new
+            return {
+                "requests": self.requests,
+                "new": self.new,
+                "reused": reused,
+                "reuse_ratio": round(reused / self.requests, 3) if self.requests else None,
+                "connect_ms_avg": round(self.connect_s / self.new * 1000, 1) if self.new else None,
+                "tls_ms_avg": round(self.tls_s / self.new * 1000, 1) if self.new else None,
+                "http2": self.http2,
+            }
+
+
+CONN_STATS = ConnStats()
+
+
+DONE_LINES = (b"data: [DONE]", b"data:[DONE]")
+DRAIN_MAX_BYTES = 64 * 1024
+
+
+def _transport(httpx: Any) -> Any:
+    """
+    HTTPTransport, joka palauttaa striimin yhteyden pooliin. SDK lopettaa lukemisen
+    [DONE]-tapahtumaan ja sulkee vastauksen ennen chunked-päätepalaa, jolloin
+    HTTP/1.1-yhteys suljettaisiin joka vuoron jälkeen. Jos `data: [DONE]` -rivi on jo
+    nähty, loppu (muutama tavu) luetaan ennen sulkemista; kesken suljettu striimi
+    (esim. hävinnyt varapyyntö) suljetaan kuten ennenkin.
+    """
+
+    class DrainingStream(httpx.SyncByteStream):
+        def __init__(self, stream: Any) -> None:
+            self._stream = stream
+            self._it: Optional[Iterator[bytes]] = None
+            self._line: Optional[bytes] = b""   # kesken oleva rivi; None = liian pitkä ollakseen [DONE]
+            self.done = False
+
+        def _scan(self, chunk: bytes) -> None:
+            # SSE-rivit: [DONE] tunnistetaan kokonaisena data-rivinä, ei tavuvirran lopusta
+            *lines, rest = chunk.split(b"\n")
+            for i, line in enumerate(lines):
+                if i == 0:
+                    if self._line is None:
+                        continue
+                    line = self._line + line
+                if line.rstrip(b"\r") in DONE_LINES:
+                    self.done = True
+            head = self._line if not lines else b""
+            self._line = None if head is None or len(head) + len(rest) > 64 else head + rest
+
+        def __iter__(self) -> Iterator[bytes]:
+            self._it = iter(self._stream)
+            for chunk in self._it:
+                self._scan(chunk)
+                yield chunk
+
+        def close(self) -> None:
+            try:
+                if self._it is not None and self.done:
+                    # Loppu on chunked-päätepala; yläraja varmuuden vuoksi
+                    left = DRAIN_MAX_BYTES
+                    for chunk in self._it:
+                        left -= len(chunk)
+                        if left < 0:
+                            break
+            except Exception:
+                pass
+            finally:
+                self._stream.close()
+
+    class KeepAliveTransport(httpx.BaseTransport):
+        def __init__(self, inner: Any) -> None:
+            self._inner = inner
+
+        def handle_request(self, request: Any) -> Any:
+            response = self._inner.handle_request(request)
+            if response.headers.get("content-type", "").startswith("text/event-stream"):
+                response.stream = DrainingStream(response.stream)
+            return response
+
+        def close(self) -> None:
+            self._inner.close()
+
+    return KeepAliveTransport(httpx.HTTPTransport(
+        http2=HTTP2 and _h2_available(),
+        limits=httpx.Limits(max_connections=POOL_SIZE, max_keepalive_connections=POOL_SIZE,
+                            keepalive_expiry=KEEPALIVE_S),
+    ))
+
+
+def timeout(read_s: Optional[float] = None) -> Any:
+    return _httpx().Timeout(read_s or READ_TIMEOUT_S, connect=CONNECT_TIMEOUT_S,
+                            write=WRITE_TIMEOUT_S, pool=CONNECT_TIMEOUT_S)
+
+
+def http_client() -> Any:
+    # Yhteinen pooli säilyy myös API-avaimen vaihtuessa; keep-alive pitää TLS-yhteydet auki
+    global _HTTP
+    if _HTTP is None:
+        with _CLIENT_LOCK:
+            if _HTTP is None:
+                httpx = _httpx()
+                _HTTP = httpx.Client(
+                    transport=_transport(httpx),
+                    timeout=timeout(),
+                    event_hooks={"request": [CONN_STATS.on_request]},
+                )
+    return _HTTP
+
+
+def get_api_key() -> str:
+    return setting("OPENAI_API_KEY", "") or ""
+
+
+def get_client() -> Optional[Any]:
+    global _CLIENT, _CLIENT_KEY
+    key = get_api_key()
+    if not key:
+        return None
+    if _CLIENT is not None and _CLIENT_KEY == key:
+        return _CLIENT
+    try:
+        http = http_client()
+    except Exception:
+        return None
+    with _CLIENT_LOCK:
+        if _CLIENT is None or _CLIENT_KEY != key:
+            try:
+                from openai import OpenAI
+                _CLIENT, _CLIENT_KEY = OpenAI(api_key=key, http_client=http, timeout=timeout(), max_retries=0), key
+            except Exception:
+                return None
+    return _CLIENT
+
+
+# ============== Terveystarkistus: välimuistissa, ei koskaan UI:n polulla ==============
+_HEALTH: Dict[str, Any] = {}
+_HEALTH_LOCK = threading.Lock()
+_HEALTH_RUNNING = threading.Event()
+
+
+def check_health() -> Dict[str, Any]:
+    # Kevyt GET /models; avaa samalla poolin yhteyden, jota seuraava vuoro käyttää
+    result: Dict[str, Any] = {"ok": False, "error": "", "latency_ms": None, "checked_at": time.time()}
+    client = get_client()
+    if client is None:
+        result["error"] = "OPENAI_API_KEY puuttuu"
+    else:
+        t0 = time.perf_counter()
+        try:
+            client.with_options(timeout=timeout(CONNECT_TIMEOUT_S)).models.list()
+            result["ok"] = True
+        except Exception as e:
+            result["error"] = f"{e.__class__.__name__}: {e}"[:200]
+        result["latency_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+    with _HEALTH_LOCK:
+        _HEALTH.clear()
+        _HEALTH.update(result)
+    return result
+
+
+def _refresh_health() -> None:
+    try:
+        check_health()
+    finally:
+        _HEALTH_RUNNING.clear()
+
+
+def health(max_age_s: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Viimeisin terveystulos heti; vanhentunut tulos päivitetään taustasäikeessä.
+    Ennen ensimmäistä tarkistusta ok=None (avain on asetettu, vastausta ei vielä ole).
+    """
+    max_age = HEALTH_TTL_S if max_age_s is None else max_age_s
+    with _HEALTH_LOCK:
+        result = dict(_HEALTH)
+    if not get_api_key():
+        return {"ok": False, "error": "OPENAI_API_KEY puuttuu", "latency_ms": None, "checked_at": None}
+    stale = not result or time.time() - result["checked_at"] > max_age
+    if stale and not _HEALTH_RUNNING.is_set():
+        _HEALTH_RUNNING.set()
+        threading.Thread(target=_refresh_health, name="openai-health", daemon=True).start()
+    return result or {"ok": None, "error": "", "latency_ms": None, "checked_at": None}
+
+
+def warm() -> None:
+    # Käynnistyksessä taustalla: asiakas, pooli ja ensimmäinen TLS-yhteys valmiiksi
+    health()
+
+
+def record_usage(usage: Any, timings: Optional[Dict[str, float]] = None, count: bool = True) -> None:
+    # API:n usage-kenttä → token-laskurit (ja vuoron timings-sanakirjaan);
+    # count=False yhdistetylle pyynnölle, jonka tokenit laskettiin jo kerran
+    if usage is None:
+        return
+    tokens_in = getattr(usage, "prompt_tokens", 0) or 0
+    tokens_out = getattr(usage, "completion_tokens", 0) or 0
+    # Prompt-välimuistista luetut tokenit (OpenAI: yhteinen etuosa ≥ 1024 tokenia)
+    cached = getattr(getattr(usage, "prompt_tokens_details", None), "cached_tokens", 0) or 0
+    if count:
+        metrics.inc("henry_llm_tokens_total", tokens_in, kind="prompt")
+        metrics.inc("henry_llm_tokens_total", tokens_out, kind="completion")
+        metrics.inc("henry_llm_tokens_total", cached, kind="cached")
+    if timings is not None:
+        timings["tokens_in"] = float(tokens_in)
+        timings["tokens_out"] = float(tokens_out)
+        timings["tokens_cached"] = float(cached)
+
+
+def _estimate_tokens(messages: List[Dict[str, str]], model: str) -> int:
+    # Token bucketin varaus: prompt + vastauksen arvioitu yläraja
+    prompt = sum(count_tokens(str(m.get("content", "")), model) + TOKENS_PER_MESSAGE for m in messages)
+    return prompt + int_setting("OPENAI_EST_COMPLETION_TOKENS", 500)
+
+
+def _request_key(model: str, messages: List[Dict[str, str]], stream: bool) -> str:
+    raw = json.dumps([model, TEMPERATURE, stream, messages], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class LatencyBudgetExceeded(TimeoutError):
+    """Kutsu ei valmistunut reitin latenssibudjetissa."""
+
+
+def _with_timeout(client: Any, timeout_s: Optional[float]) -> Any:
+    # Reitin budjetti korvaa lukuajan tälle kutsulle; yhteyden avauksen raja pysyy
+    if not timeout_s or not hasattr(client, "with_options"):
+        return client
+    return client.with_options(timeout=timeout(timeout_s))
+
+
+# ============== Hedged requests: varapyyntö, jos ensimmäinen viipyy ==============
+_END = object()
+
+
+def _has_content(chunk: Any) -> bool:
+    return bool(getattr(chunk, "choices", None) and chunk.choices[0].delta.content)
+
+
+class HedgedStream:
+    """
+    Striimi, johon lähtee varapyyntö, jos ensimmäistä sisältöpalaa ei ole tullut
+    hedge_after_s:ssä. Ensimmäisenä sisältöä tuottanut voittaa, toinen suljetaan.
+    Varapyyntö ei yhdisty ensisijaiseen (avain None). Budjetti on deadline ensimmäiselle
+    sisältöpalalle; kun voittaja on selvillä, striimiä rajaa vain HTTP-lukuaika (READ_TIMEOUT_S).
+    """
+
+    def __init__(self, open_fn: Callable[[Optional[str]], Any], key: Optional[str],
+                 hedge_after_s: Optional[float], budget_s: Optional[float]):
+        self._open = open_fn
+        self._q: "queue.Queue[Tuple[str, Any, Optional[BaseException]]]" = queue.Queue()
+        self._subs: Dict[str, Any] = {}
+        self._stop: set = set()
+        self._t0 = time.perf_counter()
+        self._hedge_after_s = hedge_after_s
+        self._deadline = self._t0 + budget_s if budget_s else None
+        self.hedged = False
+        self.winner: Optional[str] = None
+        self._launch("primary", key)
+
+    @property
+    def coalesced(self) -> bool:
+        sub = self._subs.get(self.winner or "primary")
+        return bool(getattr(sub, "coalesced", False))
+
+    def _launch(self, tag: str, key: Optional[str]) -> None:
+        sub = self._subs[tag] = self._open(key)
+        threading.Thread(target=self._drain, args=(tag, sub), name=f"llm-{tag}", daemon=True).start()
+
+    def _drain(self, tag: str, sub: Any) -> None:
+        error: Optional[BaseException] = None
+        try:
+            for chunk in sub:
+                self._q.put((tag, chunk, None))
+                if tag in self._stop:
+                    break
+        except Exception as e:
+            error = e
+        finally:
+            sub.close()
+            self._q.put((tag, _END, error))
+
+    def _timeout(self) -> Optional[float]:
+        now = time.perf_counter()
+        waits = []
+        if self._deadline is not None and self.winner is None:
+            waits.append(self._deadline - now)
+        if self.winner is None and not self.hedged and self._hedge_after_s is not None:
+            waits.append(self._t0 + self._hedge_after_s - now)
+        return max(0.0, min(waits)) if waits else None
+
+    def __iter__(self) -> Iterator[Any]:
+        pending = {"primary"}
+        buffered: Dict[str, List[Any]] = {"primary": []}
+        error: Optional[BaseException] = None
+        try:
+            while pending:
+                try:
+                    tag, chunk, err = self._q.get(timeout=self._timeout())
+                except queue.Empty:
+                    if self.winner is None and self._deadline is not None and time.perf_counter() >= self._deadline:
+                        raise LatencyBudgetExceeded(f"latenssibudjetti ylittyi ({self._deadline - self._t0:.1f} s)")
+                    self.hedged = True
+                    metrics.inc("henry_llm_hedges_total")
+                    buffered["hedge"] = []
+                    pending.add("hedge")
+                    self._launch("hedge", None)
+                    continue
+                if self.winner is not None and tag != self.winner:
+                    continue
+                if chunk is _END:
+                    pending.discard(tag)
+                    error = err or error
+                    if err is None and self.winner is None:
+                        self.winner = tag   # valmis ilman sisältöä (tyhjä vastaus)
+                        yield from buffered[tag]
+                    if self.winner == tag:
+                        if err is not None:
+                            raise err
+                        return
+                    continue
+                if self.winner is None:
+                    if not _has_content(chunk):
+                        buffered[tag].append(chunk)
+                        continue
+                    self.winner = tag
+                    self._stop.update(t for t in self._subs if t != tag)
+                    yield from buffered[tag]
+                yield chunk
+            if error is not None:
+                raise error
+        finally:
+            self._stop.update(self._subs)
+
+    def close(self) -> None:
+        self._stop.update(self._subs)
+
+
+def call_chat(client: Any, messages: List[Dict[str, str]], model: str = DEFAULT_MODEL,
+              timeout_s: Optional[float] = None, hedge_after_s: Optional[float] = None,
+              timings: Optional[Dict[str, float]] = None) -> str:
+    metrics.inc("henry_llm_requests_total", mode="sync")
+    c = _with_timeout(client, timeout_s)
+    tokens = _estimate_tokens(messages, model)
+
+    def attempt(key: Optional[str]) -> Any:
+        return admission().call(
+            key, tokens, lambda: c.chat.completions.create(model=model, messages=messages, temperature=TEMPERATURE))
+
+    t0 = time.perf_counter()
+    try:
+        with metrics.span("llm"):
+            resp = _race_call(attempt, _request_key(model, messages, False), hedge_after_s, timeout_s, timings)
+    except Exception as e:
+        metrics.inc("henry_llm_errors_total", error=e.__class__.__name__)
+        raise
+    record_usage(getattr(resp, "usage", None), timings)
+    if timings is not None:
+        timings["total_s"] = time.perf_counter() - t0
+    return resp.choices[0].message.content
+
+
+def _race_call(attempt: Callable[[Optional[str]], Any], key: str, hedge_after_s: Optional[float],
+               budget_s: Optional[float], timings: Optional[Dict[str, float]]) -> Any:
+    if hedge_after_s is None:
+        return attempt(key)
+    results: "queue.Queue[Tuple[Any, Optional[BaseException]]]" = queue.Queue()
+
+    def run(k: Optional[str]) -> None:
+        try:
+            results.put((attempt(k), None))
+        except Exception as e:
+            results.put((None, e))
+
+    deadline = time.perf_counter() + budget_s if budget_s else None
+    threading.Thread(target=run, args=(key,), name="llm-primary", daemon=True).start()
+    pending, hedged, error = 1, False, None
+    while pending:
+        timeout = None if deadline is None else max(0.0, deadline - time.perf_counter())
+        if not hedged:
+            timeout = hedge_after_s if timeout is None else min(timeout, hedge_after_s)
+        try:
+            resp, err = results.get(timeout=timeout)
+        except queue.Empty:
+            if hedged or (deadline is not None and time.perf_counter() >= deadline):
+                raise LatencyBudgetExceeded(f"latenssibudjetti ylittyi ({budget_s:.1f} s)")
+            hedged, pending = True, pending + 1
+            metrics.inc("henry_llm_hedges_total")
+            if timings is not None:
+                timings["hedged"] = 1.0
+            threading.Thread(target=run, args=(None,), name="llm-hedge", daemon=True).start()
+            continue
+        pending -= 1
+        if err is None:
+            return resp
+        error = err
+    raise error  # type: ignore[misc]
+
+
+def stream_chat(client: Any, messages: List[Dict[str, str]], timings: Optional[Dict[str, float]] = None,
+                model: str = DEFAULT_MODEL, timeout_s: Optional[float] = None,
+                hedge_after_s: Optional[float] = None) -> Iterator[str]:
+    # Palauttaa vastauksen tokenipaloina sitä mukaa kun niitä tulee.
+    # timings-sanakirjaan kirjataan ttft_s (ensimmäinen token, sisältää jonotuksen) ja total_s.
+    # timeout_s = reitin latenssibudjetti ensimmäiselle tokenille, hedge_after_s = varapyynnön viive.
+    # Pitkä vastaus saa jatkua budjetin yli: lukuaikana pysyy asiakkaan oletus (READ_TIMEOUT_S).
+    t0 = time.perf_counter()
+    metrics.inc("henry_llm_requests_total", mode="stream")
+    c = client
+    tokens = _estimate_tokens(messages, model)
+    stream = HedgedStream(
+        lambda key: admission().stream(key, tokens, lambda: c.chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=TEMPERATURE,
+            stream=True,
+            stream_options={"include_usage": True},   # viimeinen pala kertoo tokenit
+        )),
+        _request_key(model, messages, True), hedge_after_s, timeout_s,
+    )
+    ttft = None
+    usage: Dict[str, float] = {}
+    try:
+        for chunk in stream:
+            if getattr(chunk, "usage", None) is not None:
+                record_usage(chunk.usage, usage, count=not stream.coalesced)
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if not delta:
+                continue
+            if ttft is None:
+                ttft = time.perf_counter() - t0
+                metrics.observe("llm_ttft", ttft)
+                if timings is not None:
+                    timings["ttft_s"] = ttft
+            yield delta
+    except Exception as e:
+        metrics.inc("henry_llm_errors_total", error=e.__class__.__name__)
+        raise
+    finally:
+        stream.close()
+        total = time.perf_counter() - t0
+        metrics.observe("llm", total)
+        if ttft is not None and usage:
+            # TTFT erikseen välimuistiosumille, jotta etuosan hyöty näkyy suoraan
+            metrics.observe("llm_ttft_prefix_hit" if usage["tokens_cached"] else "llm_ttft_prefix_miss", ttft)
+        if timings is not None:
+            timings.update(usage)
+            timings["total_s"] = total
+            timings["coalesced"] = float(stream.coalesced)
+            timings["hedged"] = float(stream.hedged)
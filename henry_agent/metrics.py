@@ -0,0 +1,291 @@
+"""
+Kevyt instrumentointi: vuoron vaiheiden ajastukset (span) ja laskurit.
+
+Kaikki kootaan prosessin sisäiseen rekisteriin ja julkaistaan Prometheus-
+tekstimuodossa:
+  - METRICS_PORT=9108 → http://<METRICS_HOST>:9108/metrics taustasäikeessä
+  - METRICS_FILE=/polku/henry.prom → tiedosto päivitetään METRICS_FILE_INTERVAL_S välein
+    (node_exporterin textfile-collector)
+
+METRICS=0 poistaa kaiken käytöstä: span() palauttaa yhteisen no-op-olion,
+inc()/observe() palaavat heti ja @timed palauttaa funktion sellaisenaan.
+"""
+
+import bisect
+import logging
+import os
+import threading
+import time
+from functools import wraps
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .settings import bool_setting, float_setting, int_setting, setting
+
+log = logging.getLogger(__name__)
+
+ENABLED = bool_setting("METRICS", True)
+
+# Sekunteja; viimeinen ämpäri on +Inf
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+STAGE_METRIC = "henry_stage_duration_seconds"
+
+HELP = {
+    STAGE_METRIC: "Chat-vuoron vaiheiden kesto",
+    "henry_llm_requests_total": "OpenAI-kutsut",
+    "henry_llm_errors_total": "Epäonnistuneet OpenAI-kutsut virhetyypeittäin",
+    "henry_llm_tokens_total": "Tokenit API:n usage-kentästä",
+    "henry_llm_connections_total": "OpenAI-pyynnöt uuden (new) ja uudelleenkäytetyn (reused) yhteyden yli",
+    "henry_db_fallbacks_total": "PG → spooli/paikallinen näkymä -siirtymät operaatioittain",
+    "henry_breaker_transitions_total": "Katkaisimen tilasiirtymät",
+    "henry_spool_rows_total": "PG-katkoksen aikana spooliin kirjoitetut rivit",
+    "henry_spool_backfill_total": "Spoolista Postgresiin viedyt (ok) ja viemättä jääneet (dead) rivit",
+    "henry_retention_archived_total": "Kylmäarkistoon siirretyt ja kannasta poistetut rivit",
+    "henry_maintenance_runs_total": "Valmiit ylläpitokierrokset",
+    "henry_search_queries_total": "Kokotekstihaut backendeittäin",
+    "henry_job_ads_total": "Ladatut työpaikkailmoitukset: parsittu, välimuistista (cache_hit) tai virhe",
+    "henry_search_indexed_total": "Taustalla hakuindeksiin viedyt viestit (pakatut ja vanhat rivit)",
+}
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Dict[str, Any]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _fmt_labels(key: LabelKey, extra: str = "") -> str:
+    parts = [f'{k}="{v}"' for k, v in key] + ([extra] if extra else [])
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Histogram:
+    __slots__ = ("counts", "total", "n")
+
+    def __init__(self) -> None:
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.n = 0
+
+    def quantile(self, q: float) -> float:
+        # Arvio ämpäreistä (ämpärin yläraja), riittää sivupalkkiin
+        if not self.n:
+            return 0.0
+        rank, acc = q * self.n, 0
+        for i, c in enumerate(self.counts):
+            acc += c
+            if acc >= rank:
+                return BUCKETS[i] if i < len(BUCKETS) else BUCKETS[-1]
+        return BUCKETS[-1]
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.counters: Dict[Tuple[str, LabelKey], float] = {}
+        self.histograms: Dict[Tuple[str, LabelKey], _Histogram] = {}
+        self.gauges: Dict[str, Callable[[], float]] = {}
+
+    def inc(self, name: str, value: float = 1.0, **labels: Any) -> None:
+        key = (name, _labels(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0.0) + value
+
+    def observe(self, name: str, seconds: float, **labels: Any) -> None:
+        key = (name, _labels(labels))
+        i = bisect.bisect_left(BUCKETS, seconds)
+        with self._lock:
+            h = self.histograms.get(key)
+            if h is None:
+                h = self.histograms[key] = _Histogram()
+            h.counts[i] += 1
+            h.total += seconds
+            h.n += 1
+
+    def gauge(self, name: str, fn: Callable[[], float]) -> None:
+        self.gauges[name] = fn
+
+    def render(self) -> str:
+        with self._lock:
+            counters = dict(self.counters)
+            hists = {k: (list(h.counts), h.total, h.n) for k, h in self.histograms.items()}
+        lines: List[str] = []
+        seen = set()
+
+        def header(name: str, kind: str) -> None:
+            if name not in seen:
+                seen.add(name)
+                if name in HELP:
+                    lines.append(f"# HELP {name} {HELP[name]}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, key), (counts, total, n) in sorted(hists.items()):
+            header(name, "histogram")
+            acc = 0
+            for le, c in zip([*map(str, BUCKETS), "+Inf"], counts):
+                acc += c
+                le_label = 'le="%s"' % le
+                lines.append(f"{name}_bucket{_fmt_labels(key, le_label)} {acc}")
+            lines.append(f"{name}_sum{_fmt_labels(key)} {total:.6f}")
+            lines.append(f"{name}_count{_fmt_labels(key)} {n}")
+        for (name, key), v in sorted(counters.items()):
+            header(name, "counter")
+            lines.append(f"{name}{_fmt_labels(key)} {v:g}")
+        for name, fn in sorted(self.gauges.items()):
+            try:
+                v = float(fn())
+            except Exception:
+                continue
+            header(name, "gauge")
+            lines.append(f"{name} {v:g}")
+        return "\n".join(lines) + "\n"
+
+    def stage_rows(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            items = [(dict(key).get("stage", name), h.n, h.total, h.quantile(0.95))
+                     for (name, key), h in self.histograms.items() if name == STAGE_METRIC]
+        return [{"vaihe": s, "n": n, "ka_ms": round(t / n * 1000, 1) if n else 0.0, "p95_ms": round(p * 1000, 1)}
+                for s, n, t, p in sorted(items)]
+
+    def counter_rows(self) -> List[Tuple[str, float]]:
+        with self._lock:
+            return [(name + _fmt_labels(key), v) for (name, key), v in sorted(self.counters.items())]
+
+
+REGISTRY = Registry()
+
+
+# ============== Rajapinta instrumentoinnille ==============
+class _Span:
+    __slots__ = ("stage", "t0")
+
+    def __init__(self, stage: str):
+        self.stage = stage
+
+    def __enter__(self) -> "_Span":
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        REGISTRY.observe(STAGE_METRIC, time.perf_counter() - self.t0, stage=self.stage)
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        return None
+
+
+_NOOP = _NoopSpan()
+
+
+def span(stage: str):
+    return _Span(stage) if ENABLED else _NOOP
+
+
+def observe(stage: str, seconds: float) -> None:
+    if ENABLED:
+        REGISTRY.observe(STAGE_METRIC, seconds, stage=stage)
+
+
+def inc(name: str, value: float = 1.0, **labels: Any) -> None:
+    if ENABLED:
+        REGISTRY.inc(name, value, **labels)
+
+
+def gauge(name: str, fn: Callable[[], float]) -> None:
+    if ENABLED:
+        REGISTRY.gauge(name, fn)
+
+
+def timed(stage: str) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+    def deco(fn: Callable[..., Any]) -> Callable[..., Any]:
+        if not ENABLED:
+            return fn
+
+        @wraps(fn)
+        def wrapper(*a: Any, **kw: Any) -> Any:
+            t0 = time.perf_counter()
+            try:
+                return fn(*a, **kw)
+            finally:
+                REGISTRY.observe(STAGE_METRIC, time.perf_counter() - t0, stage=stage)
+        return wrapper
+    return deco
+
+
+def render() -> str:
+    return REGISTRY.render()
+
+
+# ============== Julkaisu: HTTP-endpoint ja/tai tiedosto ==============
+_STARTED = False
+_START_LOCK = threading.Lock()
+
+
+def _write_file(path: str) -> None:
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(render())
+    os.replace(tmp, path)
+
+
+def _file_loop(path: str, interval_s: float) -> None:
+    while True:
+        try:
+            _write_file(path)
+        except OSError as e:
+            log.warning("metriikkatiedoston kirjoitus epäonnistui: %s", e)
+        time.sleep(interval_s)
+
+
+def _serve(host: str, port: int) -> Any:
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args: Any) -> None:
+            pass
+
+        def do_GET(self) -> None:
+            if self.path.split("?")[0] not in ("/metrics", "/"):
+                self.send_error(404)
+                return
+            body = render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
+
+
+def start_exporters() -> Optional[Dict[str, Any]]:
+    """Käynnistää METRICS_PORT/METRICS_FILE-julkaisun kerran per prosessi."""
+    global _STARTED
+    if not ENABLED or _STARTED:
+        return None
+    with _START_LOCK:
+        if _STARTED:
+            return None
+        _STARTED = True
+        out: Dict[str, Any] = {}
+        port = int_setting("METRICS_PORT", 0)
+        if port:
+            try:
+                out["http"] = _serve(setting("METRICS_HOST", "127.0.0.1") or "127.0.0.1", port)
+            except OSError as e:
+                # Toinen prosessi (tai aiempi ajo) pitää porttia → jatketaan ilman endpointia
+                log.warning("metriikka-endpointia ei voitu avata portissa %s: %s", port, e)
+        path = setting("METRICS_FILE", "")
+        if path:
+            threading.Thread(target=_file_loop, args=(path, float_setting("METRICS_FILE_INTERVAL_S", 15.0)),
+                             name="metrics-file", daemon=True).start()
+            out["file"] = path
+        return out
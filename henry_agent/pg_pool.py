@@ -0,0 +1,129 @@
+"""
+Prosessinlaajuinen Postgres-yhteyspooli.
+
+psycopg2:n ThreadedConnectionPool + odottava checkout (semafori), kevyt
+terveystarkistus lainattaessa ja rikkinäisten yhteyksien kierrätys.
+Yksi pooli per prosessi: kaikki Streamlit-sessiot lainaavat samasta.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+
+from .settings import float_setting, int_setting, setting
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class PgPool:
+    def __init__(
+        self,
+        dsn: str,
+        minconn: int = 1,
+        maxconn: int = 5,
+        checkout_timeout: float = 5.0,
+        ping_after_s: float = 30.0,
+        connect_timeout: int = 6,
+        sslmode: Optional[str] = "require",
+    ):
+        from psycopg2.pool import ThreadedConnectionPool  # psycopg2-binary riippuvuus
+
+        kwargs: Dict[str, object] = {"connect_timeout": connect_timeout}
+        if sslmode and "sslmode" not in dsn:
+            kwargs["sslmode"] = sslmode
+        self.minconn = max(0, minconn)
+        self.maxconn = max(1, maxconn, self.minconn)
+        self.checkout_timeout = checkout_timeout
+        self.ping_after_s = ping_after_s
+        # Luonti avaa minconn yhteyttä → toimii samalla backendin koettimena
+        self._pool = ThreadedConnectionPool(self.minconn, self.maxconn, dsn, **kwargs)
+        self._slots = threading.BoundedSemaphore(self.maxconn)
+        self._last_used: Dict[int, float] = {}
+        self._lock = threading.Lock()
+        self.stats = {"checkouts": 0, "recycled": 0, "pings": 0, "timeouts": 0}
+
+    @classmethod
+    def from_settings(cls, dsn: str) -> "PgPool":
+        return cls(
+            dsn,
+            minconn=int_setting("PG_POOL_MIN", 1),
+            maxconn=int_setting("PG_POOL_MAX", 5),
+            checkout_timeout=float_setting("PG_POOL_TIMEOUT", 5.0),
+            ping_after_s=float_setting("PG_POOL_PING_AFTER_S", 30.0),
+            connect_timeout=int_setting("PG_CONNECT_TIMEOUT", 3),
+            sslmode=setting("PG_SSLMODE", "require"),
+        )
+
+    def _healthy(self, conn) -> bool:
+        if conn.closed:
+            return False
+        last = self._last_used.get(id(conn), 0.0)
+        if time.monotonic() - last < self.ping_after_s:
+            return True
+        # Pitkään jouten ollut yhteys voi olla poolerin tai verkon katkaisema → ping
+        self.stats["pings"] += 1
+        try:
+            with conn.cursor() as c:
+                c.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def _discard(self, conn) -> None:
+        with self._lock:
+            self._last_used.pop(id(conn), None)
+            self.stats["recycled"] += 1
+        try:
+            self._pool.putconn(conn, close=True)
+        except Exception:
+            pass
+
+    def _checkout(self):
+        if not self._slots.acquire(timeout=self.checkout_timeout):
+            self.stats["timeouts"] += 1
+            raise PoolTimeout(f"ei vapaata PG-yhteyttä {self.checkout_timeout:.1f} s:ssa")
+        try:
+            for _ in range(self.maxconn + 1):
+                conn = self._pool.getconn()
+                if self._healthy(conn):
+                    self.stats["checkouts"] += 1
+                    return conn
+                self._discard(conn)
+            raise PoolTimeout("terveitä PG-yhteyksiä ei saatu")
+        except BaseException:
+            self._slots.release()
+            raise
+
+    @contextmanager
+    def connection(self) -> Iterator:
+        """Lainaa yhteyden; commit onnistuessa, rollback + tarvittaessa kierrätys virheessä."""
+        conn = self._checkout()
+        broken = False
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            try:
+                conn.rollback()
+            except Exception:
+                broken = True
+            broken = broken or bool(conn.closed)
+            raise
+        finally:
+            if broken:
+                self._discard(conn)
+            else:
+                with self._lock:
+                    self._last_used[id(conn)] = time.monotonic()
+                self._pool.putconn(conn)
+            self._slots.release()
+
+    def close(self) -> None:
+        try:
+            self._pool.closeall()
+        except Exception:
+            pass
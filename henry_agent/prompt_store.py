@@ -0,0 +1,56 @@
+"""
+Sisältöosoitteinen prompt-varasto ja viestirunkojen pakkaus.
+
+- prompt_hash(): promptin tunniste = sha256(teksti); sama prompt tallentuu
+  prompts-tauluun vain kerran, keskustelut viittaavat siihen prompt_id:llä
+- pack()/unpack(): isot rungot zlib-pakattuna content_z-sarakkeeseen
+  (content jää silloin NULLiksi); pienet tekstinä sellaisenaan
+
+Pakkaus on oletuksena pois (MESSAGE_COMPRESS_MIN_BYTES=0): rungot ovat yleensä
+lyhyitä, ja tekstinä ne pysyvät suoraan luettavina SQL:llä ja hakuindeksille.
+Otetaan käyttöön asettamalla kynnys tavuina, esim. 2048.
+"""
+
+import hashlib
+import threading
+import zlib
+from typing import Optional, Set, Tuple
+
+from .settings import int_setting
+
+COMPRESS_MIN_BYTES = int_setting("MESSAGE_COMPRESS_MIN_BYTES", 0)
+
+_known: Set[str] = set()
+_known_lock = threading.Lock()
+
+
+def prompt_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def pack(text: str, min_bytes: Optional[int] = None) -> Tuple[Optional[str], Optional[bytes]]:
+    raw = (text or "").encode("utf-8")
+    limit = COMPRESS_MIN_BYTES if min_bytes is None else min_bytes
+    if limit <= 0 or len(raw) < limit:
+        return text, None
+    z = zlib.compress(raw, 6)
+    # Pakataan vain, jos siitä oikeasti säästyy
+    if len(z) >= len(raw) * 0.9:
+        return text, None
+    return None, z
+
+
+def unpack(content: Optional[str], content_z: Optional[bytes]) -> str:
+    if content_z is not None:
+        return zlib.decompress(bytes(content_z)).decode("utf-8")
+    return content or ""
+
+
+def is_known(backend: str, pid: str) -> bool:
+    # Prosessin muisti jo tallennetuista prompteista → ei turhaa upsertia joka keskustelulle
+    return f"{backend}:{pid}" in _known
+
+
+def mark_known(backend: str, pid: str) -> None:
+    with _known_lock:
+        _known.add(f"{backend}:{pid}")
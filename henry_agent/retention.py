@@ -0,0 +1,505 @@
+"""
+Säilytys ja ylläpito: vanhat keskustelut kylmäarkistoon, Postgresin messages-taulun
+aikaosiointi ja SQLiten VACUUM/ANALYZE.
+
+    python -m henry_agent.retention run --days 180       # yksi ylläpitokierros
+    python -m henry_agent.retention partition            # PG: messages → kuukausiosiot (kerran)
+    python -m henry_agent.retention vacuum               # SQLite: vanha kanta INCREMENTAL-tilaan (kerran)
+    python -m henry_agent.retention status
+
+Ajastus: bootstrap() käynnistää taustasäikeen, joka ajaa kierroksen
+MAINTENANCE_INTERVAL_S välein (0 = pois). Samalla koneella vain yksi prosessi ajaa
+kerrallaan (tiedostolukko), Postgresissa lisäksi advisory lock.
+
+Kierros:
+  1. RETENTION_DAYS > 0: keskustelut, joiden alku ja viimeisin viesti ovat rajaa
+     vanhempia, kirjoitetaan gzip-JSONL:ksi hakemistoon ARCHIVE_DIR
+     (conversations-<eka id>-<vika id>.jsonl.gz, mukana viestit ja käytetyt promptit)
+     ja poistetaan kannasta. Tiedosto kirjoitetaan ja fsyncataan ennen poistoa, ja
+     nimi määräytyy id:istä → keskeytynyt kierros kirjoittaa saman tiedoston uudelleen.
+     Samalla rajaa vanhemmat session_state-rivit poistetaan (ei arkistoida).
+  2. PG: osioidulle messages-taululle luodaan tulevat kuukausiosiot ja pudotetaan
+     rajaa vanhemmat tyhjiksi jääneet osiot.
+  3. SQLite: ANALYZE (analysis_limit) ja vapaiden sivujen palautus paloittain
+     (incremental_vacuum), kun niitä on yli SQLITE_VACUUM_FREE_RATIO. Uudet kannat
+     luodaan auto_vacuum=INCREMENTAL-tilassa; ennen sitä luotu kanta muutetaan kerran
+     `vacuum`-komennolla (täysi VACUUM lukitsee kannan koko ajaksi, joten ei ajastettuna).
+
+Live-kirjoituksia ei pysäytetä: poistot tehdään RETENTION_BATCH keskustelun
+lyhyinä transaktioina tauoin, ja chat-viestit kulkevat write-behind-jonon kautta,
+joten hetkellinen lukko näkyy vain taustakirjoittajan viiveenä. Prompts-taulua ei
+siivota: prosessit muistavat tunnetut prompt-id:t (prompt_store), eikä rivien määrä kasva.
+"""
+
+import argparse
+import gzip
+import json
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from . import db, metrics, prompt_store
+from .settings import float_setting, int_setting, setting
+
+log = logging.getLogger(__name__)
+
+CONV_COLUMNS = ("id", "user_id", "started_at", "ended_at", "consent", "user_agent", "prompt_id")
+PARTITION_PREFIX = "messages_y"
+PG_LOCK_KEY = 0x68656E7279   # "henry"
+
+
+def archive_dir() -> str:
+    return setting("ARCHIVE_DIR", "") or os.path.join(db.DB_DIR, "archive")
+
+
+def _cutoff(days: int) -> datetime:
+    return datetime.utcnow() - timedelta(days=days)
+
+
+def _iso(v: Any) -> Any:
+    return v.isoformat() if hasattr(v, "isoformat") else v
+
+
+# ============== Lukot: yksi ylläpitäjä kerrallaan ==============
+@contextmanager
+def _file_lock(path: str) -> Iterator[bool]:
+    try:
+        import fcntl
+    except ImportError:   # ei POSIX-lukkoja → luotetaan PG-lukkoon / yhteen prosessiin
+        yield True
+        return
+    with open(path, "a") as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+@contextmanager
+def _pg_lock() -> Iterator[bool]:
+    # Oma yhteys poolin ohi: lukko pidetään koko kierroksen ajan viemättä poolipaikkaa
+    import psycopg2
+
+    conn = psycopg2.connect(db.DATABASE_URL, sslmode=setting("PG_SSLMODE", "require"),
+                            connect_timeout=int_setting("PG_CONNECT_TIMEOUT", 3))
+    try:
+        conn.autocommit = True
+        with conn.cursor() as c:
+            c.execute("SELECT pg_try_advisory_lock(%s)", (PG_LOCK_KEY,))
+            yield bool(c.fetchone()[0])
+    finally:
+        conn.close()
+
+
+# ============== Arkistointi kylmävarastoon ==============
+def _candidates(backend: str, cutoff: datetime, after_id: int, limit: int) -> List[Tuple[Any, ...]]:
+    # Alku ja viimeisin viesti rajaa vanhempia → jatkettu (?c=) keskustelu ei päädy arkistoon
+    sql = f"""
+    SELECT {', '.join(CONV_COLUMNS)} FROM conversations cv
+    WHERE cv.started_at < {{p}} AND cv.id > {{p}}
+      AND NOT EXISTS (SELECT 1 FROM messages m WHERE m.conversation_id = cv.id AND m.ts >= {{p}})
+    ORDER BY cv.id LIMIT {{p}}
+    """
+    if backend == "pg":
+        with db._pg_conn() as conn:
+            with conn.cursor() as c:
+                c.execute(sql.format(p="%s"), (cutoff, after_id, cutoff, limit))
+                return c.fetchall()
+    iso = cutoff.isoformat()
+    return db._sqlite_conn().execute(sql.format(p="?"), (iso, after_id, iso, limit)).fetchall()
+
+
+def _marks(values: Sequence[Any]) -> str:
+    return "(" + ",".join("?" * len(values)) + ")"
+
+
+def _children(backend: str, ids: Sequence[int], prompt_ids: Sequence[str]):
+    # IN {}: psycopg2 laajentaa tuplen "(a, b)":ksi, SQLitelle paikkamerkit itse
+    msg_sql = ("SELECT id, conversation_id, role, content, content_z, ts FROM messages "
+               "WHERE conversation_id IN {} ORDER BY conversation_id, id")
+    prompt_sql = "SELECT id, content, content_z FROM prompts WHERE id IN {}"
+    if backend == "pg":
+        with db._pg_conn() as conn:
+            with conn.cursor() as c:
+                c.execute(msg_sql.format("%s"), (tuple(ids),))
+                messages = c.fetchall()
+                prompts: List[Tuple[Any, ...]] = []
+                if prompt_ids:
+                    c.execute(prompt_sql.format("%s"), (tuple(prompt_ids),))
+                    prompts = c.fetchall()
+        return messages, prompts
+    conn = db._sqlite_conn()
+    messages = conn.execute(msg_sql.format(_marks(ids)), list(ids)).fetchall()
+    prompts = conn.execute(prompt_sql.format(_marks(prompt_ids)), list(prompt_ids)).fetchall() if prompt_ids else []
+    return messages, prompts
+
+
+def _write_archive(out_dir: str, convs: List[Tuple[Any, ...]], messages, prompts) -> str:
+    by_conv: Dict[int, List[Dict[str, Any]]] = {}
+    for mid, cid, role, content, content_z, ts in messages:
+        by_conv.setdefault(cid, []).append(
+            {"id": mid, "role": role, "content": prompt_store.unpack(content, content_z), "ts": _iso(ts)})
+    os.makedirs(out_dir, exist_ok=True)
+    name = f"conversations-{convs[0][0]:012d}-{convs[-1][0]:012d}.jsonl.gz"
+    path = os.path.join(out_dir, name)
+    tmp = os.path.join(out_dir, "." + name + ".tmp")
+    with open(tmp, "wb") as raw:
+        with gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=9, mtime=0) as f:
+            for pid, content, content_z in prompts:
+                f.write(json.dumps({"kind": "prompt", "id": pid, "content": prompt_store.unpack(content, content_z)},
+                                   ensure_ascii=False).encode("utf-8") + b"\n")
+            for row in convs:
+                rec = {"kind": "conversation", **{k: _iso(v) for k, v in zip(CONV_COLUMNS, row)}}
+                rec["messages"] = by_conv.get(row[0], [])
+                f.write(json.dumps(rec, ensure_ascii=False).encode("utf-8") + b"\n")
+        raw.flush()
+        os.fsync(raw.fileno())
+    os.replace(tmp, path)
+    return path
+
+
+def _delete(backend: str, ids: Sequence[int]) -> None:
+    # Lyhyt transaktio per erä; viestit ensin (viiteavain conversations-tauluun)
+    if backend == "pg":
+        with db._pg_conn() as conn:
+            with conn.cursor() as c:
+                c.execute("DELETE FROM messages WHERE conversation_id IN %s", (tuple(ids),))
+                c.execute("DELETE FROM conversations WHERE id IN %s", (tuple(ids),))
+        return
+    with db._sqlite_write() as conn:
+        conn.execute(f"DELETE FROM messages WHERE conversation_id IN {_marks(ids)}", list(ids))
+        conn.execute(f"DELETE FROM conversations WHERE id IN {_marks(ids)}", list(ids))
+
+
+def archive_old(backend: str, days: int, out_dir: Optional[str] = None, batch: int = 100,
+                pause_s: float = 0.05, dry_run: bool = False) -> Dict[str, Any]:
+    out_dir = os.path.join(out_dir or archive_dir(), backend)
+    cutoff = _cutoff(days)
+    stats: Dict[str, Any] = {"cutoff": cutoff.isoformat(), "conversations": 0, "messages": 0, "files": []}
+    after_id = 0
+    while True:
+        convs = _candidates(backend, cutoff, after_id, batch)
+        if not convs:
+            break
+        after_id = convs[-1][0]
+        ids = [r[0] for r in convs]
+        if dry_run:
+            stats["conversations"] += len(ids)
+            continue
+        messages, prompts = _children(backend, ids, sorted({r[6] for r in convs if r[6]}))
+        stats["files"].append(_write_archive(out_dir, convs, messages, prompts))
+        _delete(backend, ids)
+        stats["conversations"] += len(ids)
+        stats["messages"] += len(messages)
+        metrics.inc("henry_retention_archived_total", len(ids), table="conversations")
+        metrics.inc("henry_retention_archived_total", len(messages), table="messages")
+        time.sleep(pause_s)   # väli live-kirjoituksille
+    if not dry_run:
+        stats["sessions"] = prune_sessions(backend, cutoff)
+    return stats
+
+
+def prune_sessions(backend: str, cutoff: datetime) -> int:
+    # Jaettu sessiotila (session_store) on johdettua dataa → vanhat rivit poistetaan suoraan
+    if backend == "pg":
+        with db._pg_conn() as conn:
+            with conn.cursor() as c:
+                c.execute("DELETE FROM session_state WHERE updated_at < %s", (cutoff,))
+                n = c.rowcount
+    else:
+        with db._sqlite_write() as conn:
+            n = conn.execute("DELETE FROM session_state WHERE updated_at < ?", (cutoff.isoformat(),)).rowcount
+    metrics.inc("henry_retention_archived_total", n, table="session_state")
+    return n
+
+
+def read_archive(path: str) -> Iterator[Dict[str, Any]]:
+    """Arkistotiedoston tietueet ({"kind": "prompt"|"conversation", ...}) järjestyksessä."""
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+# ============== Postgres: messages-taulun kuukausiosiot ==============
+def _month(d: date, add: int = 0) -> date:
+    m = d.year * 12 + d.month - 1 + add
+    return date(m // 12, m % 12 + 1, 1)
+
+
+def _partition_name(month: date) -> str:
+    return f"{PARTITION_PREFIX}{month.year}m{month.month:02d}"
+
+
+def _is_partitioned(c) -> bool:
+    c.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('messages')")
+    row = c.fetchone()
+    return bool(row and row[0] == "p")
+
+
+def _create_partition(c, month: date) -> bool:
+    c.execute("SELECT to_regclass(%s)", (_partition_name(month),))
+    if c.fetchone()[0] is not None:
+        return False
+    c.execute(f"CREATE TABLE {_partition_name(month)} PARTITION OF messages "
+              f"FOR VALUES FROM ('{month.isoformat()}') TO ('{_month(month, 1).isoformat()}')")
+    return True
+
+
+def partition_messages(months_ahead: int = 2, lock_timeout_s: float = 5.0) -> Dict[str, Any]:
+    """
+    Kertaluontoinen muunnos: messages → RANGE(ts)-osioitu taulu kuukausiosioin.
+
+    Rivit kopioidaan yhdessä transaktiossa taulu lukittuna, joten aja hiljaiseen
+    aikaan (write-behind-jono odottaa lukon yli). lock_timeout estää jäämästä
+    pitkän transaktion taakse jonoon blokkaamaan muita.
+    """
+    with db._pg_conn() as conn:
+        with conn.cursor() as c:
+            if _is_partitioned(c):
+                return {"converted": False, "reason": "already partitioned"}
+            c.execute(f"SET LOCAL lock_timeout = '{int(lock_timeout_s * 1000)}ms'")
+            c.execute("LOCK TABLE messages IN ACCESS EXCLUSIVE MODE")
+            c.execute("SELECT pg_get_serial_sequence('messages', 'id'), MIN(ts), COUNT(*) FROM messages")
+            seq, min_ts, rows = c.fetchone()
+            # Hakuvektorit (henry_agent.search) siirretään mukana; triggerin luo uudelleen hakuindeksoija
+            c.execute("SELECT EXISTS (SELECT 1 FROM pg_attribute WHERE attrelid = 'messages'::regclass "
+                      "AND attname = 'search_tsv' AND NOT attisdropped)")
+            tsv = ", search_tsv" if c.fetchone()[0] else ""
+            c.execute("ALTER TABLE messages RENAME TO messages_unpartitioned")
+            c.execute("ALTER INDEX IF EXISTS idx_messages_conv_id RENAME TO idx_messages_conv_id_unpartitioned")
+            c.execute("ALTER INDEX IF EXISTS messages_pkey RENAME TO messages_unpartitioned_pkey")
+            c.execute("ALTER INDEX IF EXISTS idx_messages_spool_key RENAME TO idx_messages_spool_key_unpartitioned")
+            # Osioavaimen on kuuluttava pääavaimeen; id jatkaa samasta sekvenssistä
+            c.execute(f"""
+            CREATE TABLE messages (
+                id INTEGER NOT NULL DEFAULT nextval('{seq}'),
+                conversation_id INTEGER REFERENCES conversations(id),
+                role TEXT,
+                content TEXT,
+                content_z BYTEA,
+                ts TIMESTAMP NOT NULL DEFAULT NOW(),
+                spool_key TEXT,
+                search_tsv tsvector,
+                PRIMARY KEY (id, ts)
+            ) PARTITION BY RANGE (ts);""")
+            # NULL-aikaleimat ja osioiden ulkopuoliset rivit → oletusosio
+            c.execute("CREATE TABLE messages_default PARTITION OF messages DEFAULT")
+            month, last = _month((min_ts or datetime.utcnow()).date()), _month(date.today(), months_ahead)
+            created = 0
+            while month <= last:
+                created += _create_partition(c, month)
+                month = _month(month, 1)
+            c.execute(f"""
+            INSERT INTO messages (id, conversation_id, role, content, content_z, ts, spool_key{tsv})
+            SELECT id, conversation_id, role, content, content_z, COALESCE(ts, TIMESTAMP 'epoch'), spool_key{tsv}
+            FROM messages_unpartitioned""")
+            c.execute(f"ALTER SEQUENCE {seq} OWNED BY messages.id")
+            c.execute("DROP TABLE messages_unpartitioned")
+            c.execute("CREATE INDEX IF NOT EXISTS idx_messages_conv_id ON messages (conversation_id, id)")
+            c.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_messages_spool_key ON messages (spool_key, ts) "
+                      "WHERE spool_key IS NOT NULL")
+            if tsv:
+                c.execute("CREATE INDEX IF NOT EXISTS idx_messages_search ON messages USING gin (search_tsv)")
+    return {"converted": True, "rows": rows, "partitions": created}
+
+
+def maintain_partitions(days: int, months_ahead: int = 2, lock_timeout_s: float = 2.0) -> Dict[str, Any]:
+    """Tulevat kuukausiosiot valmiiksi; rajaa vanhemmat tyhjät osiot pois (DROP on halpa, DELETE ei)."""
+    stats: Dict[str, Any] = {"partitioned": False, "created": 0, "dropped": []}
+    with db._pg_conn() as conn:
+        with conn.cursor() as c:
+            if not _is_partitioned(c):
+                return stats
+            stats["partitioned"] = True
+            c.execute(f"SET LOCAL lock_timeout = '{int(lock_timeout_s * 1000)}ms'")
+            this = _month(date.today())
+            for i in range(months_ahead + 1):
+                stats["created"] += _create_partition(c, _month(this, i))
+    if days <= 0:
+        return stats
+    cutoff = _cutoff(days).date()
+    with db._pg_conn() as conn:
+        with conn.cursor() as c:
+            c.execute("""
+            SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = 'messages'::regclass AND c.relname LIKE %s ORDER BY c.relname
+            """, (PARTITION_PREFIX + "%",))
+            names = [r[0] for r in c.fetchall()]
+    for name in names:
+        y, m = name[len(PARTITION_PREFIX):].split("m")
+        if _month(date(int(y), int(m), 1), 1) > cutoff:
+            continue
+        try:
+            # Oma transaktio per osio: epäonnistunut lukko ei kaada muita
+            with db._pg_conn() as conn:
+                with conn.cursor() as c:
+                    c.execute(f"SET LOCAL lock_timeout = '{int(lock_timeout_s * 1000)}ms'")
+                    c.execute(f"SELECT EXISTS (SELECT 1 FROM {name})")
+                    if c.fetchone()[0]:
+                        continue
+                    c.execute(f"DROP TABLE {name}")
+            stats["dropped"].append(name)
+        except Exception as e:
+            log.info("osiota %s ei pudotettu (%s); yritetään seuraavalla kierroksella", name, e)
+    return stats
+
+
+# ============== SQLite: ANALYZE + vapaiden sivujen palautus ==============
+def sqlite_maintenance(free_ratio: float = 0.2, step_pages: int = 500, pause_s: float = 0.05) -> Dict[str, Any]:
+    conn = db._sqlite_conn()
+    pages = conn.execute("PRAGMA page_count").fetchone()[0]
+    free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    mode = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+    stats: Dict[str, Any] = {"pages": pages, "free_pages": free, "vacuum": None}
+    # analysis_limit rajaa ANALYZEn otoksen → kirjoituslukko pysyy lyhyenä isossakin kannassa
+    conn.execute("PRAGMA analysis_limit=1000")
+    with db._sqlite_write() as w:
+        w.execute("ANALYZE")
+    if pages and free / pages >= free_ratio:
+        if mode == 2:
+            # INCREMENTAL: vapaat sivut palautetaan pieninä paloina, kirjoittajat mahtuvat väliin
+            while conn.execute("PRAGMA freelist_count").fetchone()[0] > 0:
+                with db._sqlite_write() as w:
+                    w.execute(f"PRAGMA incremental_vacuum({int(step_pages)})").fetchall()
+                time.sleep(pause_s)
+            stats["vacuum"] = "incremental"
+            stats["pages_after"] = conn.execute("PRAGMA page_count").fetchone()[0]
+        else:
+            # Täysi VACUUM pysäyttäisi live-kirjoitukset → vain erillisenä komentona (sqlite_vacuum)
+            stats["vacuum"] = "needs `retention vacuum`"
+            log.info("SQLite-kannassa %d/%d vapaata sivua; aja kerran `python -m henry_agent.retention vacuum`",
+                     free, pages)
+    conn.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchall()
+    return stats
+
+
+def sqlite_vacuum() -> Dict[str, Any]:
+    """Kertaluontoinen täysi VACUUM, joka vaihtaa kannan INCREMENTAL-tilaan. Lukitsee kannan
+    koko ajaksi: aja hiljaisena aikana, ei ajastettuna."""
+    conn = db._sqlite_conn()
+    before = conn.execute("PRAGMA page_count").fetchone()[0]
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    conn.execute("VACUUM")
+    return {"pages": before, "pages_after": conn.execute("PRAGMA page_count").fetchone()[0],
+            "auto_vacuum": conn.execute("PRAGMA auto_vacuum").fetchone()[0]}
+
+
+# ============== Kierros ja ajastus ==============
+def _backend() -> str:
+    return db._shared_backend()
+
+
+def run_once(days: Optional[int] = None, dry_run: bool = False) -> Dict[str, Any]:
+    days = int_setting("RETENTION_DAYS", 0) if days is None else days
+    backend = _backend()
+    out: Dict[str, Any] = {"backend": backend, "days": days}
+    db.flush_messages()
+    if backend == "pg" and not db.PG_BREAKER.closed:
+        # Katkoksen aikana ei ylläpitoa (eikä SQLite-varakannan arkistointia PG:n sijaan)
+        return dict(out, skipped="pg unavailable")
+    with _file_lock(db.DB_PATH + ".maintenance.lock") as got:
+        if not got:
+            return dict(out, skipped="locked")
+        pg_lock = _pg_lock() if backend == "pg" else nullcontext(True)
+        with pg_lock as got_pg, metrics.span("maintenance"):
+            if not got_pg:
+                return dict(out, skipped="locked")
+            if days > 0:
+                out["archive"] = archive_old(backend, days, batch=int_setting("RETENTION_BATCH", 100),
+                                             pause_s=float_setting("RETENTION_PAUSE_S", 0.05), dry_run=dry_run)
+            if dry_run:
+                return out
+            if backend == "pg":
+                out["partitions"] = maintain_partitions(days, int_setting("RETENTION_PARTITIONS_AHEAD", 2))
+            # SQLite on aina käytössä varalla (PG-vikatilanteet) → sekin pidetään kunnossa
+            out["sqlite"] = sqlite_maintenance(float_setting("SQLITE_VACUUM_FREE_RATIO", 0.2))
+    metrics.inc("henry_maintenance_runs_total", backend=backend)
+    return out
+
+
+def _loop(interval_s: float) -> None:
+    # Ensimmäinen kierros vasta välin jälkeen (ei hidasta käynnistystä); jitter hajauttaa prosessit
+    while True:
+        time.sleep(interval_s * random.uniform(0.9, 1.1))
+        try:
+            stats = run_once()
+            log.info("ylläpitokierros: %s", stats)
+        except Exception as e:
+            metrics.inc("henry_maintenance_errors_total")
+            log.warning("ylläpitokierros epäonnistui: %s", e)
+
+
+_STARTED = False
+_START_LOCK = threading.Lock()
+
+
+def start_scheduler() -> bool:
+    """Käynnistää ylläpitosäikeen kerran per prosessi (MAINTENANCE_INTERVAL_S, 0 = pois)."""
+    global _STARTED
+    interval = float_setting("MAINTENANCE_INTERVAL_S", 6 * 3600.0)
+    if interval <= 0 or _STARTED:
+        return False
+    with _START_LOCK:
+        if _STARTED:
+            return False
+        _STARTED = True
+        threading.Thread(target=_loop, args=(interval,), name="maintenance", daemon=True).start()
+    return True
+
+
+def status() -> Dict[str, Any]:
+    backend = _backend()
+    out: Dict[str, Any] = {"backend": backend, "archive_dir": archive_dir()}
+    if backend == "pg":
+        with db._pg_conn() as conn:
+            with conn.cursor() as c:
+                out["partitioned"] = _is_partitioned(c)
+                c.execute("""
+                SELECT c.relname, c.reltuples::BIGINT FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+                WHERE i.inhparent = 'messages'::regclass ORDER BY c.relname
+                """)
+                out["partitions"] = {name: max(0, int(n)) for name, n in c.fetchall()}
+    conn = db._sqlite_conn()
+    out["sqlite"] = {p: conn.execute(f"PRAGMA {p}").fetchone()[0]
+                     for p in ("page_count", "freelist_count", "auto_vacuum")}
+    return out
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    ap = argparse.ArgumentParser(description="Chat-lokin säilytys ja ylläpito")
+    ap.add_argument("command", choices=["run", "partition", "vacuum", "status"])
+    ap.add_argument("--days", type=int, default=None, help="arkistoi tätä vanhemmat (oletus RETENTION_DAYS)")
+    ap.add_argument("--dry-run", action="store_true", help="vain laske arkistoitavat keskustelut")
+    ap.add_argument("--months-ahead", type=int, default=2)
+    args = ap.parse_args(argv)
+    state: Dict[str, Any] = {}
+    db.init_db(state)
+    if args.command == "partition":
+        if db.get_pool() is None:
+            raise SystemExit("partition vaatii Postgresin (DATABASE_URL)")
+        result = partition_messages(args.months_ahead)
+    elif args.command == "run":
+        result = run_once(args.days, args.dry_run)
+    elif args.command == "vacuum":
+        with _file_lock(db.DB_PATH + ".maintenance.lock") as got:
+            if not got:
+                raise SystemExit("ylläpitokierros käynnissä; yritä myöhemmin uudelleen")
+            result = sqlite_vacuum()
+    else:
+        result = status()
+    print(json.dumps(result, indent=2, ensure_ascii=False, default=str))
+
+
+if __name__ == "__main__":
+    main()
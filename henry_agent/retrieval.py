@@ -0,0 +1,298 @@
+"""
+Paikallinen hakuindeksi Henryn taustamateriaaliin.
+
+Lähteet: knowledge/-kansion .md/.txt/.pdf -tiedostot (Henryn profiili on
+system-promptissa aina, ks. persona). Lähteet pilkotaan kappaleittain
+paloiksi, palat upotetaan vektoreiksi ja tallennetaan levylle:
+
+    <index_dir>/vectors.npy     float32 [N, D], ladataan muistikartoitettuna (mmap)
+    <index_dir>/chunks.json     palojen teksti ja lähde
+    <index_dir>/manifest.json   upotin, lähteiden allekirjoitukset ja rivialueet
+
+Uudelleenrakennus on inkrementaalinen: vain muuttuneet/uudet lähteet upotetaan,
+muiden vektorit kopioidaan vanhasta indeksistä. Haku on NumPy-pistetulo + top-k.
+
+Päivitys ajetaan taustasäikeessä (start_refresher, RETRIEVAL_REFRESH_S); vuoro
+vain lukee valmiin (palat, vektorit) -parin, joka vaihdetaan yhdellä sijoituksella.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .embeddings import make_embedder
+from .settings import bool_setting, float_setting, int_setting, setting
+
+log = logging.getLogger(__name__)
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DOC_EXTENSIONS = (".md", ".txt", ".pdf")
+
+RETRIEVAL_HEADER = "TAUSTATIETOA HENRYSTÄ (haettu tähän kysymykseen; käytä vain jos relevanttia):\n"
+
+
+@dataclass
+class Chunk:
+    source: str
+    text: str
+
+
+# ============== Lähteet & pilkkominen ==============
+def _read_source(path: str) -> str:
+    if path.lower().endswith(".pdf"):
+        from pypdf import PdfReader
+        reader = PdfReader(path)
+        return "\n\n".join((page.extract_text() or "") for page in reader.pages)
+    with open(path, encoding="utf-8", errors="replace") as f:
+        return f.read()
+
+
+def chunk_text(text: str, max_chars: int = 700, overlap_lines: int = 1) -> List[str]:
+    # Kappaleet (tyhjä rivi välissä) yhdistetään paloiksi max_chars asti; liian pitkät
+    # kappaleet pilkotaan riveittäin. Edellisen palan viimeinen rivi toistetaan seuraavan alussa.
+    paras = [p.strip() for p in re.split(r"\n\s*\n", text or "") if p.strip()]
+    lines: List[str] = []
+    for p in paras:
+        if len(p) <= max_chars:
+            lines.append(p)
+        else:
+            lines.extend(ln for ln in p.splitlines() if ln.strip())
+    chunks: List[str] = []
+    cur: List[str] = []
+    size = 0
+    for ln in lines:
+        if cur and size + len(ln) > max_chars:
+            chunks.append("\n".join(cur))
+            cur = cur[-overlap_lines:] if overlap_lines else []
+            size = sum(len(x) for x in cur)
+        if len(ln) > max_chars:
+            # yksittäinen ylipitkä rivi (esim. PDF ilman rivinvaihtoja) → kiinteät palat
+            for i in range(0, len(ln), max_chars):
+                chunks.append(ln[i:i + max_chars])
+            cur, size = [], 0
+            continue
+        cur.append(ln)
+        size += len(ln)
+    if cur:
+        chunks.append("\n".join(cur))
+    return chunks
+
+
+def _signature(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+# ============== Indeksi ==============
+class RetrievalIndex:
+    def __init__(self, doc_dir: str, index_dir: str, embedder_kind: str = "hashing", max_chars: int = 700):
+        self.doc_dir = doc_dir
+        self.index_dir = index_dir
+        self.embedder = make_embedder(embedder_kind)
+        self.max_chars = max_chars
+        self._lock = threading.Lock()
+        # (palat, vektorit) yhtenä oliona: haku näkee aina saman version molemmista
+        self._current: Tuple[List[Chunk], Optional[np.ndarray]] = ([], None)
+        self._manifest: Dict[str, Any] = {}
+        self._file_stats: Dict[str, Tuple[int, int]] = {}
+        self._thread: Optional[threading.Thread] = None
+        self.stats = {"rebuilds": 0, "embedded_chunks": 0, "reused_chunks": 0, "searches": 0}
+
+    @property
+    def version(self) -> str:
+        return self._manifest.get("version", "")
+
+    # ---------- lähteiden skannaus ----------
+    def _scan_files(self) -> Dict[str, Tuple[int, int]]:
+        out: Dict[str, Tuple[int, int]] = {}
+        if not os.path.isdir(self.doc_dir):
+            return out
+        for root, _dirs, files in os.walk(self.doc_dir):
+            for fn in files:
+                if fn.startswith(".") or fn.upper().startswith("README") or not fn.lower().endswith(DOC_EXTENSIONS):
+                    continue
+                path = os.path.join(root, fn)
+                st = os.stat(path)
+                out[os.path.relpath(path, self.doc_dir)] = (st.st_mtime_ns, st.st_size)
+        return out
+
+    def _load(self) -> bool:
+        try:
+            with open(os.path.join(self.index_dir, "manifest.json"), encoding="utf-8") as f:
+                manifest = json.load(f)
+            with open(os.path.join(self.index_dir, "chunks.json"), encoding="utf-8") as f:
+                chunks = [Chunk(**c) for c in json.load(f)]
+            vecs = np.load(os.path.join(self.index_dir, "vectors.npy"), mmap_mode="r")
+        except (OSError, ValueError, TypeError):
+            return False
+        if manifest.get("embedder") != self.embedder.name or len(chunks) != vecs.shape[0]:
+            return False
+        self._manifest, self._current = manifest, (chunks, vecs)
+        return True
+
+    def _write(self, manifest: Dict[str, Any], chunks: List[Chunk], vecs: np.ndarray) -> None:
+        os.makedirs(self.index_dir, exist_ok=True)
+        # Atominen vaihto: kirjoitetaan väliaikaistiedostoihin ja os.replace
+        tmp_vec = os.path.join(self.index_dir, "vectors.tmp.npy")
+        np.save(tmp_vec, vecs.astype(np.float32, copy=False))
+        for name, payload in (("chunks.json", [c.__dict__ for c in chunks]), ("manifest.json", manifest)):
+            tmp = os.path.join(self.index_dir, name + ".tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(payload, f, ensure_ascii=False)
+            os.replace(tmp, os.path.join(self.index_dir, name))
+        os.replace(tmp_vec, os.path.join(self.index_dir, "vectors.npy"))
+
+    def refresh(self, force: bool = False) -> bool:
+        """Tarkistaa lähteet ja rakentaa muuttuneet osat uudelleen. Palauttaa True jos indeksi muuttui."""
+        with self._lock:
+            if self._current[1] is None:
+                self._load()
+            cur_chunks, cur_vecs = self._current
+            file_stats = self._scan_files()
+            if not force and cur_vecs is not None and file_stats == self._file_stats:
+                return False
+
+            old_sources: Dict[str, Any] = self._manifest.get("sources", {})
+            texts: Dict[str, Optional[str]] = {}
+            sigs: Dict[str, str] = {}
+            for rel, (mtime, size) in file_stats.items():
+                old = old_sources.get(rel)
+                if old and old.get("mtime") == mtime and old.get("size") == size:
+                    sigs[rel], texts[rel] = old["sig"], None   # ennallaan: ei lueta uudelleen
+                    continue
+                try:
+                    texts[rel] = _read_source(os.path.join(self.doc_dir, rel))
+                except Exception as e:
+                    log.warning("lähteen %s luku epäonnistui: %s", rel, e)
+                    continue
+                sigs[rel] = _signature(texts[rel])
+
+            new_chunks: List[Chunk] = []
+            parts: List[np.ndarray] = []
+            sources: Dict[str, Any] = {}
+            to_embed: List[Tuple[int, List[str]]] = []
+            for name in sorted(sigs):
+                old = old_sources.get(name)
+                start = len(new_chunks)
+                if old and old.get("sig") == sigs[name] and cur_vecs is not None:
+                    a, b = old["rows"]
+                    new_chunks.extend(cur_chunks[a:b])
+                    parts.append(np.asarray(cur_vecs[a:b]))
+                    self.stats["reused_chunks"] += b - a
+                else:
+                    text = texts.get(name)
+                    if text is None:
+                        text = _read_source(os.path.join(self.doc_dir, name))
+                    pieces = chunk_text(text, self.max_chars)
+                    new_chunks.extend(Chunk(name, p) for p in pieces)
+                    parts.append(np.zeros((len(pieces), self.embedder.dim), dtype=np.float32))
+                    to_embed.append((len(parts) - 1, pieces))
+                sources[name] = {"sig": sigs[name], "rows": [start, len(new_chunks)]}
+                if name in file_stats:
+                    sources[name]["mtime"], sources[name]["size"] = file_stats[name]
+
+            for part_idx, pieces in to_embed:
+                if pieces:
+                    parts[part_idx] = self.embedder.embed(pieces)
+                    self.stats["embedded_chunks"] += len(pieces)
+
+            changed = bool(to_embed) or set(sources) != set(old_sources) or cur_vecs is None
+            if changed:
+                vecs = np.concatenate(parts) if parts else np.zeros((0, self.embedder.dim), dtype=np.float32)
+                manifest = {
+                    "embedder": self.embedder.name,
+                    "dim": self.embedder.dim,
+                    "version": _signature(json.dumps({k: v["sig"] for k, v in sources.items()}, sort_keys=True)),
+                    "sources": sources,
+                }
+                self._write(manifest, new_chunks, vecs)
+                self._load()
+                self.stats["rebuilds"] += 1
+            self._file_stats = file_stats
+            return changed
+
+    def start_refresher(self, every_s: float) -> None:
+        """Taustasäie: rakentaa indeksin heti ja tarkistaa lähteet every_s välein (0 → vain kerran)."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._refresh_loop, args=(every_s,),
+                                            name="retrieval-refresh", daemon=True)
+        self._thread.start()
+
+    def _refresh_loop(self, every_s: float) -> None:
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                log.warning("hakuindeksin päivitys epäonnistui: %s", e)
+            if every_s <= 0:
+                return
+            time.sleep(every_s)
+
+    # ---------- haku ----------
+    def search(self, query: str, k: int = 4, min_score: float = 0.1) -> List[Tuple[float, Chunk]]:
+        chunks, vecs = self._current
+        if vecs is None or vecs.shape[0] == 0 or not query.strip():
+            return []
+        self.stats["searches"] += 1
+        q = self.embedder.embed([query])[0]
+        scores = np.asarray(vecs @ q)
+        k = min(k, scores.shape[0])
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(float(scores[i]), chunks[i]) for i in top if scores[i] >= min_score]
+
+
+def format_context(hits: Sequence[Tuple[float, Chunk]], max_chars: int = 2400) -> str:
+    out: List[str] = []
+    used = 0
+    for _score, ch in hits:
+        block = f"[{ch.source}]\n{ch.text.strip()}"
+        if used + len(block) > max_chars and out:
+            break
+        out.append(block)
+        used += len(block)
+    return RETRIEVAL_HEADER + "\n\n".join(out) if out else ""
+
+
+# ============== Prosessin yhteinen indeksi ==============
+_INDEX: Optional[RetrievalIndex] = None
+_INDEX_LOCK = threading.Lock()
+
+
+def _default_index_dir() -> str:
+    base = "/mount/data" if os.path.exists("/mount/data") else REPO_DIR
+    return os.path.join(base, ".henry_index")
+
+
+def retrieval_index() -> RetrievalIndex:
+    """Prosessin indeksi; luonnissa ladataan levyllä oleva versio, päivitys on start_refresherin säikeessä."""
+    global _INDEX
+    if _INDEX is None:
+        with _INDEX_LOCK:
+            if _INDEX is None:
+                index = RetrievalIndex(
+                    doc_dir=setting("KNOWLEDGE_DIR", "") or os.path.join(REPO_DIR, "knowledge"),
+                    index_dir=setting("RETRIEVAL_INDEX_DIR", "") or _default_index_dir(),
+                    embedder_kind=setting("RETRIEVAL_EMBEDDER", "hashing") or "hashing",
+                    max_chars=int_setting("RETRIEVAL_CHUNK_CHARS", 700),
+                )
+                index._load()
+                _INDEX = index
+    return _INDEX
+
+
+def start_refresher() -> bool:
+    """Käynnistää indeksin taustapäivityksen kerran per prosessi (RETRIEVAL=0 → pois)."""
+    if not bool_setting("RETRIEVAL", True):
+        return False
+    retrieval_index().start_refresher(float_setting("RETRIEVAL_REFRESH_S", 30.0))
+    return True
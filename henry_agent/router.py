@@ -0,0 +1,202 @@
+"""
+Mallireititys: viestin piirteistä (pituus, intentit, CV-koukut, yleisö) valitaan
+mallitaso. Jokaisella tasolla on oma latenssibudjettinsa, ja jos ensimmäinen token
+viipyy yli reitin p95:n, lähtee varapyyntö (hedge) ja nopeampi vastaus voittaa.
+
+    fast      tervehdykset ja lyhyet taustakysymykset     ROUTER_FAST_MODEL (gpt-4.1-nano)
+    standard  tavallinen keskustelu                        ROUTER_STANDARD_MODEL (DEFAULT_MODEL)
+    deep      pitkät roolisovitus-, KPI- ja governance-kysymykset   ROUTER_DEEP_MODEL (gpt-4o)
+
+Reitti riippuu vain viestistä ja yleisöstä, joten sama kysymys osuu aina samaan
+tasoon (vastausvälimuisti pysyy johdonmukaisena). ROUTER=0 → kaikki standard-tasolle
+ilman varapyyntöjä.
+
+Reittikohtaiset latenssit ja kustannukset: STATS.rows() admin-paneeliin, metriikat
+henry_route_requests_total / henry_route_cost_usd_total ja vaiheet llm_route_<taso>.
+"""
+
+import threading
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple
+
+from . import metrics
+from .admission import admission
+from .context import count_tokens
+from .llm import DEFAULT_MODEL, call_chat, stream_chat
+from .rules import Match
+from .settings import bool_setting, float_setting, int_setting, setting
+
+ENABLED = bool_setting("ROUTER", True)
+
+# USD / 1M tokenia: (syöte, välimuistista luettu syöte, tuotos)
+PRICES: Dict[str, Tuple[float, float, float]] = {
+    "gpt-4.1-nano": (0.10, 0.025, 0.40),
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+    "gpt-4.1-mini": (0.40, 0.10, 1.60),
+    "gpt-4.1": (2.00, 0.50, 8.00),
+    "gpt-4o": (2.50, 1.25, 10.00),
+}
+
+# Roolisovitus: näiden yleisöjen pitkät viestit ovat tyypillisesti "sopisiko Henry meille" -kysymyksiä
+MATCHING_AUDIENCES = ("rekrytoija", "tiiminvetäjä")
+
+
+@dataclass(frozen=True)
+class Tier:
+    name: str
+    model: str
+    budget_s: float           # striimi: ensimmäisen tokenin budjetti; ei-striimattu: koko kutsun aikakatkaisu
+    hedge: bool = True
+
+
+TIERS: Dict[str, Tier] = {
+    "fast": Tier("fast", setting("ROUTER_FAST_MODEL", "gpt-4.1-nano") or "gpt-4.1-nano",
+                 float_setting("ROUTER_FAST_BUDGET_S", 10.0)),
+    "standard": Tier("standard", setting("ROUTER_STANDARD_MODEL", DEFAULT_MODEL) or DEFAULT_MODEL,
+                     float_setting("ROUTER_STANDARD_BUDGET_S", 25.0)),
+    "deep": Tier("deep", setting("ROUTER_DEEP_MODEL", "gpt-4o") or "gpt-4o",
+                 float_setting("ROUTER_DEEP_BUDGET_S", 45.0)),
+}
+
+FAST_MAX_TOKENS = int_setting("ROUTER_FAST_MAX_TOKENS", 24)
+DEEP_MIN_TOKENS = int_setting("ROUTER_DEEP_MIN_TOKENS", 120)
+MATCH_MIN_TOKENS = int_setting("ROUTER_MATCH_MIN_TOKENS", 60)
+
+
+@dataclass(frozen=True)
+class Route:
+    tier: Tier
+    reason: str
+    tokens: int
+
+    @property
+    def name(self) -> str:
+        return self.tier.name
+
+
+def choose(text: str, signals: Match, audience: Optional[str] = None) -> Route:
+    tokens = count_tokens(text or "")
+    if not ENABLED:
+        return Route(TIERS["standard"], "disabled", tokens)
+    audience = audience or signals.audience
+    if tokens >= DEEP_MIN_TOKENS:
+        return Route(TIERS["deep"], "long", tokens)
+    if signals.intents and tokens >= MATCH_MIN_TOKENS // 2:
+        return Route(TIERS["deep"], "intent:" + ",".join(sorted(signals.intents)), tokens)
+    if audience in MATCHING_AUDIENCES and tokens >= MATCH_MIN_TOKENS:
+        return Route(TIERS["deep"], "role_match", tokens)
+    if tokens <= FAST_MAX_TOKENS and not signals.intents and not signals.hooks:
+        return Route(TIERS["fast"], "short", tokens)
+    return Route(TIERS["standard"], "default", tokens)
+
+
+def cost_usd(model: str, tokens_in: float, tokens_out: float, tokens_cached: float = 0.0) -> float:
+    p_in, p_cached, p_out = PRICES.get(model, (0.0, 0.0, 0.0))
+    return ((tokens_in - tokens_cached) * p_in + tokens_cached * p_cached + tokens_out * p_out) / 1e6
+
+
+# ============== Reittikohtaiset tilastot ==============
+class RouteStats:
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        self.window = window
+        self.min_samples = min_samples
+        self._lock = threading.Lock()
+        self._ttft: Dict[str, Deque[float]] = {}
+        self._total: Dict[str, Deque[float]] = {}
+        self._counts: Dict[str, Dict[str, float]] = {}
+
+    def _row(self, route: str) -> Dict[str, float]:
+        return self._counts.setdefault(route, {"n": 0, "errors": 0, "hedged": 0, "cost_usd": 0.0})
+
+    def record(self, route: str, timings: Dict[str, float], cost: float, error: bool = False) -> None:
+        with self._lock:
+            row = self._row(route)
+            row["n"] += 1
+            row["errors"] += int(error)
+            row["hedged"] += int(bool(timings.get("hedged")))
+            row["cost_usd"] += cost
+            if not error:
+                # Synkronisessa kutsussa ensimmäinen token = koko vastaus
+                first = timings.get("ttft_s", timings.get("total_s"))
+                if first is not None:
+                    self._ttft.setdefault(route, deque(maxlen=self.window)).append(first)
+                if "total_s" in timings:
+                    self._total.setdefault(route, deque(maxlen=self.window)).append(timings["total_s"])
+
+    @staticmethod
+    def _q(values: List[float], q: float) -> float:
+        return values[min(len(values) - 1, int(len(values) * q))] if values else 0.0
+
+    def hedge_after(self, route: str) -> Optional[float]:
+        # Reitin TTFT:n p95; ennen riittävää otosta ei varapyyntöjä (kylmä käynnistys ei tuplaa kuormaa)
+        with self._lock:
+            values = sorted(self._ttft.get(route, ()))
+        return self._q(values, 0.95) if len(values) >= self.min_samples else None
+
+    def rows(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            out = []
+            for route, row in sorted(self._counts.items()):
+                ttft = sorted(self._ttft.get(route, ()))
+                total = sorted(self._total.get(route, ()))
+                out.append({
+                    "reitti": route, "n": int(row["n"]), "virheet": int(row["errors"]), "hedge": int(row["hedged"]),
+                    "ttft_p95_ms": round(self._q(ttft, 0.95) * 1000), "p50_ms": round(self._q(total, 0.5) * 1000),
+                    "p95_ms": round(self._q(total, 0.95) * 1000), "usd": round(row["cost_usd"], 5),
+                })
+            return out
+
+
+STATS = RouteStats(window=int_setting("ROUTER_WINDOW", 200), min_samples=int_setting("ROUTER_MIN_SAMPLES", 20))
+
+
+def _hedge_after(route: Route) -> Optional[float]:
+    if not (ENABLED and route.tier.hedge):
+        return None
+    # Jonossa odottavia → ruuhkaa; varapyyntö vain lisäisi sitä
+    if admission().stats()["queue_depth"] > 0:
+        return None
+    return STATS.hedge_after(route.name)
+
+
+def _record(route: Route, timings: Dict[str, float], error: bool) -> float:
+    cost = cost_usd(route.tier.model, timings.get("tokens_in", 0.0), timings.get("tokens_out", 0.0),
+                    timings.get("tokens_cached", 0.0))
+    if timings.get("coalesced"):
+        cost = 0.0   # toisen session kutsu maksoi jo
+    STATS.record(route.name, timings, cost, error)
+    metrics.inc("henry_route_requests_total", route=route.name, result="error" if error else "ok")
+    metrics.inc("henry_route_cost_usd_total", cost, route=route.name)
+    if not error and "total_s" in timings:
+        metrics.observe(f"llm_route_{route.name}", timings["total_s"])
+    timings["cost_usd"] = cost
+    return cost
+
+
+def stream(client: Any, messages: List[Dict[str, str]], route: Route,
+           timings: Optional[Dict[str, float]] = None) -> Iterator[str]:
+    timings = {} if timings is None else timings
+    error = True
+    try:
+        yield from stream_chat(client, messages, timings, model=route.tier.model,
+                               timeout_s=route.tier.budget_s, hedge_after_s=_hedge_after(route))
+        error = False
+    except GeneratorExit:
+        error = False   # kuluttaja lähti (rerun) → ei virhe
+        raise
+    finally:
+        _record(route, timings, error)
+
+
+def chat(client: Any, messages: List[Dict[str, str]], route: Route,
+         timings: Optional[Dict[str, float]] = None) -> str:
+    timings = {} if timings is None else timings
+    error = True
+    try:
+        reply = call_chat(client, messages, model=route.tier.model, timeout_s=route.tier.budget_s,
+                          hedge_after_s=_hedge_after(route), timings=timings)
+        error = False
+        return reply
+    finally:
+        _record(route, timings, error)
@@ -0,0 +1,189 @@
+"""
+Avainsanasäännöt: yleisö, intentit, CV-koukut ja yhteydenottosignaali yhdellä läpikäynnillä.
+
+Säännöt ovat deklaratiivinen taulukko (RULES). RuleEngine kääntää kaikkien
+sääntöjen avainsanat kerran yhdeksi trie-muotoiseksi regexiksi, jota ajetaan
+lookaheadina jokaisesta merkkikohdasta: jokaisesta kohdasta löytyy pisin
+avainsana, ja sen etuliitteinä olevat avainsanat lisätään valmiiksi lasketusta
+taulusta. Tulos vastaa vanhaa `any(k in t for k in ...)` -semantiikkaa
+(alimerkkijonot, päällekkäiset osumat), mutta viestiä ei skannata per lista.
+
+Pisteet ja prioriteetit:
+  - avainsanalla on paino (oletus 1.0); sääntö laukeaa kun painojen summa ≥ min_score
+  - yleisö: korkein prioriteetti voittaa, tasatilanteessa pisteet ja taulukon järjestys
+  - koukut: prioriteetti ja taulukon järjestys, enintään max_hooks kpl
+
+classify_profile / detect_intents / build_cv_hook / wants_connect ovat
+yhteensopivuuskääreitä vanhoille funktioille (samat tulokset).
+"""
+
+import re
+from dataclasses import dataclass, field
+from typing import Any, Dict, FrozenSet, List, Optional, Sequence, Tuple, Union
+
+Keyword = Union[str, Tuple[str, float]]
+
+DEFAULT_AUDIENCE = "muu"
+
+
+@dataclass(frozen=True)
+class Rule:
+    kind: str                      # "audience" | "intent" | "hook" | "connect"
+    label: str
+    keywords: Tuple[Keyword, ...]
+    priority: int = 0
+    min_score: float = 1.0
+    text: str = ""                 # koukun lause
+
+
+@dataclass
+class Match:
+    audience: str = DEFAULT_AUDIENCE
+    intents: FrozenSet[str] = frozenset()
+    hooks: Tuple[str, ...] = ()
+    connect: bool = False
+    scores: Dict[str, float] = field(default_factory=dict)   # "kind:label" → pisteet
+
+    @property
+    def hook(self) -> str:
+        return " ".join(self.hooks).strip()
+
+
+# ============== Sääntötaulukko ==============
+RULES: Tuple[Rule, ...] = (
+    # Yleisö (ensimmäisestä viestistä); prioriteetit säilyttävät vanhan if-ketjun järjestyksen
+    Rule("audience", "rekrytoija", ("rekry", "rekrytoija", "recruiter", "hiring"), priority=50),
+    Rule("audience", "tiiminvetäjä", ("lead", "vetäjä", "esihenkilö", "manager", "tiiminvetäjä", "team lead"), priority=40),
+    Rule("audience", "data engineer / analyst", ("data engineer", "analyyt", "analyst", "ml", "mlops", "pipeline"), priority=30),
+    Rule("audience", "media", ("toimittaja", "media", "lehti", "press"), priority=20),
+    Rule("audience", "kollega", ("kollega", "työkaveri", "internal", "sisäinen"), priority=10),
+
+    # Intentit → visualisoinnit
+    Rule("intent", "kpi", ("kpi", "mittari", "sla", "ttfr", "tavoite", "tavoitteet")),
+    Rule("intent", "gov", ("governance", "ai act", "risk", "selitettävyys", "audit", "valvonta")),
+
+    # CV-koukut vastauksen alkuun
+    Rule("hook", "crm", ("hubspot", "salesforce", "crm"),
+         text="Olen rakentanut ja ylläpitänyt HubSpot–Salesforce-integraatioita, joten CRM-prosessit ovat tuttua maastoa."),
+    Rule("hook", "rag", ("rag", "tietopohja", "tietohaku", "ohje", "dokumentaatio"),
+         text="Olen tehnyt sisäisiä RAG-konsepteja: kuratoidut ohje- ja prosessilähteet pitävät vastaukset faktoissa."),
+    Rule("hook", "fraud", ("fraud", "aml", "rahanpesu", "riskimalli"),
+         text="Sääntöpohjaisen ja ML-pohjaisen riskipisteytyksen yhdistäminen on tuttua – selitettävyys (SHAP) mukaan alusta asti."),
+    Rule("hook", "governance", ("governance", "ai act", "eettinen", "selitettävyys"),
+         text="Tuon AI governance -periaatteet käytäntöön: riskiluokitus, hyväksymiskriteerit ja audit trail sisäänrakennettuna."),
+    Rule("hook", "copilot", ("copilot", "asiakaspalvelu", "service", "sla"),
+         text="Asiakaspalvelun Copilotissa fokusoin TTFR-parannukseen ja sävy/fakta-laatuun – mittarit ja hyväksymiskriteerit ensin."),
+    Rule("hook", "event", ("tapahtuma", "event", "international", "messu"),
+         text="Airbus-tausta ja kansainvälinen tapahtumatuotanto auttavat viemään AI-pilotit myös kentälle esiteltäviksi."),
+
+    # Yhteydenottopyyntö → CTA
+    Rule("connect", "connect", (
+        "ota yhteys", "ota yhteyttä", "yhdistä", "voitko välittää", "soita", "mailaa",
+        "sähköposti", "sähköpostilla", "laita viesti", "laita sähköpostia", "varaa aika",
+        "kalenteriin", "tapaaminen", "tavata", "yhteydenotto", "otetaanko yhteyttä",
+        "contact", "reach out", "email", "e-mail", "mail", "book a time",
+        "calendar", "meeting", "schedule", "connect me", "connect with you",
+    )),
+)
+
+
+# ============== Kääntäminen ==============
+def _trie_pattern(words: Sequence[str]) -> str:
+    # Yhteiset etuliitteet faktoroidaan: (?:ma(?:il(?:aa)?|nager)|...) → regex haarautuu merkki kerrallaan
+    trie: Dict[Any, Any] = {}
+    for w in words:
+        node = trie
+        for ch in w:
+            node = node.setdefault(ch, {})
+        node[None] = True
+
+    def build(node: Dict[Any, Any]) -> str:
+        alts = [re.escape(ch) + build(child) for ch, child in sorted((k, v) for k, v in node.items() if k is not None)]
+        if not alts:
+            return ""
+        body = alts[0] if len(alts) == 1 else "(?:" + "|".join(alts) + ")"
+        # Päätesolmu: pidempi jatko ensin (ahne ?), muuten tämä sana
+        return f"(?:{body})?" if None in node else body
+
+    return build(trie)
+
+
+class RuleEngine:
+    def __init__(self, rules: Sequence[Rule] = RULES, max_hooks: int = 2):
+        self.rules = tuple(rules)
+        self.max_hooks = max_hooks
+        self._kw_rules: Dict[str, List[Tuple[int, float]]] = {}
+        for i, rule in enumerate(self.rules):
+            for kw in rule.keywords:
+                word, weight = (kw, 1.0) if isinstance(kw, str) else kw
+                self._kw_rules.setdefault(word.lower(), []).append((i, float(weight)))
+        words = sorted(self._kw_rules)
+        # Pisin osuma kohdassa i → kaikki samasta kohdasta alkavat avainsanat (sen etuliitteet)
+        self._implied: Dict[str, Tuple[str, ...]] = {
+            w: tuple(w[:n] for n in range(1, len(w) + 1) if w[:n] in self._kw_rules) for w in words
+        }
+        self._pattern = re.compile("(?=(" + _trie_pattern(words) + "))") if words else None
+
+    def keywords(self, text: str) -> FrozenSet[str]:
+        if self._pattern is None or not text:
+            return frozenset()
+        found: set = set()
+        for m in self._pattern.finditer(text.lower()):
+            found.update(self._implied[m.group(1)])
+        return frozenset(found)
+
+    def match(self, text: Any) -> Match:
+        if not isinstance(text, str):
+            try:
+                text = str(text)
+            except Exception:
+                text = ""
+        scores: Dict[int, float] = {}
+        for kw in self.keywords(text):
+            for i, weight in self._kw_rules[kw]:
+                scores[i] = scores.get(i, 0.0) + weight
+
+        fired = sorted((i for i, s in scores.items() if s >= self.rules[i].min_score),
+                       key=lambda i: (-self.rules[i].priority, i))
+        out = Match(scores={f"{self.rules[i].kind}:{self.rules[i].label}": scores[i] for i in fired})
+        audiences = [i for i in fired if self.rules[i].kind == "audience"]
+        if audiences:
+            best = min(audiences, key=lambda i: (-self.rules[i].priority, -scores[i], i))
+            out.audience = self.rules[best].label
+        out.intents = frozenset(self.rules[i].label for i in fired if self.rules[i].kind == "intent")
+        out.hooks = tuple(self.rules[i].text for i in fired if self.rules[i].kind == "hook")[: self.max_hooks]
+        out.connect = any(self.rules[i].kind == "connect" for i in fired)
+        return out
+
+
+_ENGINE: Optional[RuleEngine] = None
+
+
+def engine() -> RuleEngine:
+    global _ENGINE
+    if _ENGINE is None:
+        _ENGINE = RuleEngine()
+    return _ENGINE
+
+
+def analyze(text: Any) -> Match:
+    return engine().match(text)
+
+
+# ============== Yhteensopivuus vanhoille funktioille ==============
+def classify_profile(text: str) -> str:
+    return analyze(text).audience
+
+
+def detect_intents(text: Any) -> set:
+    return set(analyze(text).intents)
+
+
+def build_cv_hook(user_query: Any) -> str:
+    return analyze(user_query).hook
+
+
+def wants_connect(text: Any) -> bool:
+    if not isinstance(text, str) or not text:
+        return False
+    return analyze(text).connect
@@ -0,0 +1,473 @@
+"""
+Chat-lokin kokotekstihaku natiivein indeksein (LIKE '%..%' -skannauksen tilalle).
+
+    SQLite    FTS5-taulu messages_fts (unicode61, diakriitit taitettu, 3 merkin prefiksi-indeksi);
+              triggerit indeksoivat uudet viestit samassa insertissä (migraatio 8)
+    Postgres  messages.search_tsv (tsvector, SEARCH_PG_CONFIGS = finnish,english) + GIN-indeksi;
+              BEFORE INSERT -triggeri laskee vektorin
+
+Pakatut rungot (content NULL, content_z) ja ennen indeksiä kirjoitetut rivit indeksoi
+taustasäie (SearchIndexer) lyhyinä erinä: triggeri merkitsee pakatut search_pending-
+tauluun, ja vanhat rivit käydään läpi id:n mukaan alaspäin (search_meta.backfill_upto).
+Postgresissa sarake lisätään ilman oletusarvoa (pelkkä metatieto), DDL ajetaan
+lock_timeoutilla ja GIN-indeksi rakennetaan CONCURRENTLY (osioidussa taulussa osio
+kerrallaan) omalla yhteydellä, joten live-insertit eivät jää odottamaan.
+
+Kysely: sanat AND-ehtoina, lainausmerkeissä fraasi. SQLitessa suomen ja englannin
+yleisimmät taivutuspäätteet katkaistaan ja sana haetaan prefiksinä
+("Salesforcesta" → salesforce*); Postgresissa sana stemmataan kummallakin
+konfiguraatiolla (OR). Tulokset relevanssijärjestyksessä (bm25 / ts_rank_cd) sivuittain.
+
+    python -m henry_agent.search "AI Act" --page 2 --role user
+    python -m henry_agent.search --status
+    python -m henry_agent.search --index           # indeksoi jonon ja vanhat rivit loppuun etualalla
+"""
+
+import argparse
+import logging
+import re
+import threading
+import time
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from . import db, metrics, prompt_store
+from .settings import bool_setting, float_setting, int_setting, setting
+
+log = logging.getLogger(__name__)
+
+PAGE_SIZE = max(1, int_setting("SEARCH_PAGE_SIZE", 20))
+# Konfiguraationimet menevät SQL:ään sellaisenaan → vain [a-z_]
+PG_CONFIGS = [c for c in (setting("SEARCH_PG_CONFIGS", "finnish,english") or "").replace(" ", "").split(",")
+              if re.fullmatch(r"[a-z_]+", c)] or ["simple"]
+
+
+# ============== Kysely ==============
+# Taivutuspäätteet pisimmästä lyhimpään; vartaloon jää vähintään MIN_STEM merkkiä
+_SUFFIXES = sorted({
+    # suomi: sijamuodot, monikko, omistusliitteet
+    "issa", "issä", "ista", "istä", "illa", "illä", "ilta", "iltä", "ille", "iksi", "ineen", "iden", "itten",
+    "ssa", "ssä", "sta", "stä", "lla", "llä", "lta", "ltä", "lle", "ksi", "hin", "seen", "nsa", "nsä",
+    "ita", "itä", "ja", "jä", "na", "nä", "ta", "tä", "en", "in", "a", "ä", "n", "t", "i",
+    # englanti
+    "ations", "ation", "ings", "ing", "ies", "ied", "ers", "er", "ed", "es", "ly", "s",
+}, key=len, reverse=True)
+MIN_STEM = 4
+
+_QUERY = re.compile(r'"([^"]+)"|(\w+)')
+
+
+class Term(NamedTuple):
+    text: str
+    prefix: bool    # haetaan vartalona: text*
+    phrase: bool
+
+
+def stem(word: str) -> str:
+    for suffix in _SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= MIN_STEM:
+            return word[:-len(suffix)]
+    return word
+
+
+def parse(query: str) -> List[Term]:
+    terms: List[Term] = []
+    for phrase, word in _QUERY.findall(query or ""):
+        if phrase:
+            words = re.findall(r"\w+", phrase.lower())
+            if words:
+                terms.append(Term(" ".join(words), False, True))
+        else:
+            w = word.lower()
+            s = stem(w)
+            terms.append(Term(s, len(s) >= MIN_STEM, False))
+    return terms
+
+
+def fts_query(terms: Sequence[Term]) -> str:
+    # Jokainen termi lainausmerkeissä → FTS5:n operaattorit ja erikoismerkit eivät tulkitu
+    return " ".join(f'"{t.text}"' + ("*" if t.prefix else "") for t in terms)
+
+
+def snippet(text: str, terms: Sequence[Term], width: int = 160) -> str:
+    """Ote ensimmäisen osuman ympäriltä, osumat lihavoituna (markdown)."""
+    flat = " ".join((text or "").split())
+    if not terms:
+        return flat[:width]
+    pattern = re.compile(r"(?i)\b(?:" + "|".join(re.escape(t.text) for t in terms) + r")\w*")
+    m = pattern.search(flat)
+    start = max(0, m.start() - width // 3) if m else 0
+    part = flat[start:start + width]
+    return ("…" if start else "") + pattern.sub(lambda x: f"**{x.group(0)}**", part) + \
+        ("…" if start + width < len(flat) else "")
+
+
+# ============== Haku ==============
+def _search_sqlite(terms: Sequence[Term], role: Optional[str], limit: int, offset: int) -> List[Tuple[Any, ...]]:
+    conn = db._sqlite_conn()
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'messages_fts'").fetchone() is None:
+        raise RuntimeError("SQLite ilman FTS5:tä: haku ei käytettävissä")
+    sql = ("SELECT m.id, m.conversation_id, m.role, m.ts, messages_fts.content, -bm25(messages_fts) "
+           "FROM messages_fts JOIN messages m ON m.id = messages_fts.rowid WHERE messages_fts MATCH ?"
+           + (" AND m.role = ?" if role else "") + " ORDER BY bm25(messages_fts), m.id DESC LIMIT ? OFFSET ?")
+    params: List[Any] = [fts_query(terms)] + ([role] if role else []) + [limit, offset]
+    return conn.execute(sql, params).fetchall()
+
+
+def _search_pg(query: str, role: Optional[str], limit: int, offset: int) -> List[Tuple[Any, ...]]:
+    tsquery = " || ".join(f"websearch_to_tsquery('{cfg}', %s)" for cfg in PG_CONFIGS)
+    sql = (f"SELECT m.id, m.conversation_id, m.role, m.ts, m.content, m.content_z, ts_rank_cd(m.search_tsv, q.q) "
+           f"FROM messages m, (SELECT {tsquery} AS q) q WHERE m.search_tsv @@ q.q"
+           + (" AND m.role = %s" if role else "") + " ORDER BY 7 DESC, m.id DESC LIMIT %s OFFSET %s")
+    params: List[Any] = [query] * len(PG_CONFIGS) + ([role] if role else []) + [limit, offset]
+    with db._pg_conn() as conn:
+        with conn.cursor() as c:
+            c.execute(sql, params)
+            rows = c.fetchall()
+    return [(i, cid, r, ts, prompt_store.unpack(content, bytes(z) if z is not None else None), rank)
+            for i, cid, r, ts, content, z, rank in rows]
+
+
+def search(query: str, page: int = 1, page_size: int = PAGE_SIZE, role: Optional[str] = None) -> Dict[str, Any]:
+    """Osumat relevanssijärjestyksessä; has_more kertoo, onko seuraavaa sivua (ei COUNT(*)-kyselyä)."""
+    page, page_size = max(1, page), max(1, page_size)
+    terms = parse(query)
+    backend = db._shared_backend()
+    out: Dict[str, Any] = {"query": query, "backend": backend, "page": page, "page_size": page_size,
+                           "has_more": False, "hits": []}
+    if not terms:
+        return out
+    offset = (page - 1) * page_size
+    with metrics.span("search"):
+        if backend == "pg":
+            rows = _search_pg(query, role, page_size + 1, offset)
+        else:
+            rows = _search_sqlite(terms, role, page_size + 1, offset)
+    out["has_more"] = len(rows) > page_size
+    out["hits"] = [
+        {"message_id": i, "conversation_id": cid, "role": r, "ts": ts.isoformat() if hasattr(ts, "isoformat") else ts,
+         "rank": round(float(rank), 4), "snippet": snippet(text, terms)}
+        for i, cid, r, ts, text, rank in rows[:page_size]
+    ]
+    metrics.inc("henry_search_queries_total", backend=backend)
+    return out
+
+
+# ============== Postgres: sarake, triggeri ja GIN-indeksi ==============
+def _pg_connect():
+    # Oma yhteys poolin ohi: CREATE INDEX CONCURRENTLY vaatii autocommitin eikä saa viedä poolipaikkaa
+    import psycopg2
+
+    conn = psycopg2.connect(db.DATABASE_URL, sslmode=setting("PG_SSLMODE", "require"),
+                            connect_timeout=int_setting("PG_CONNECT_TIMEOUT", 3))
+    conn.autocommit = True
+    return conn
+
+
+def _pg_install(c) -> None:
+    tsv = " || ".join(f"to_tsvector('{cfg}', COALESCE(t, ''))" for cfg in PG_CONFIGS)
+    c.execute("ALTER TABLE messages ADD COLUMN IF NOT EXISTS search_tsv tsvector")
+    c.execute("CREATE TABLE IF NOT EXISTS search_pending (id INTEGER PRIMARY KEY, ts TIMESTAMP)")
+    c.execute("CREATE TABLE IF NOT EXISTS search_meta (key TEXT PRIMARY KEY, value BIGINT)")
+    c.execute(f"CREATE OR REPLACE FUNCTION henry_search_tsv(t TEXT) RETURNS tsvector "
+              f"LANGUAGE sql IMMUTABLE AS $$ SELECT {tsv} $$")
+    c.execute("""
+    CREATE OR REPLACE FUNCTION henry_messages_search() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        IF NEW.content IS NOT NULL THEN
+            NEW.search_tsv := henry_search_tsv(NEW.content);
+        ELSIF NEW.content_z IS NOT NULL THEN
+            -- zlib-runkoa ei pureta SQL:ssä: taustasäie indeksoi
+            INSERT INTO search_pending (id, ts) VALUES (NEW.id, NEW.ts) ON CONFLICT DO NOTHING;
+        END IF;
+        RETURN NEW;
+    END $$""")
+    c.execute("CREATE TRIGGER trg_messages_search BEFORE INSERT ON messages "
+              "FOR EACH ROW EXECUTE FUNCTION henry_messages_search()")
+    # Triggeriä vanhemmat rivit (myös osiointimuunnoksen aikana kirjoitetut) taustaindeksointiin
+    c.execute("""
+    INSERT INTO search_meta (key, value) SELECT 'backfill_upto', COALESCE(MAX(id), 0) FROM messages
+    ON CONFLICT (key) DO UPDATE SET value = GREATEST(search_meta.value, EXCLUDED.value)""")
+
+
+def _concurrent_index(c, name: str, table: str) -> None:
+    c.execute("SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(%s)", (name,))
+    row = c.fetchone()
+    if row and row[0]:
+        return
+    if row:
+        # Keskeytynyt CONCURRENTLY-rakennus jättää INVALID-indeksin
+        c.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+    c.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} USING gin (search_tsv)")
+
+
+def ensure_pg(lock_timeout_s: float = 2.0) -> Dict[str, Any]:
+    """Sarake, triggeri ja GIN-indeksi, jos puuttuvat; kevyt katalogitarkistus, kun kaikki on valmiina."""
+    out: Dict[str, Any] = {"installed": False, "indexes": 0}
+    conn = _pg_connect()
+    try:
+        with conn.cursor() as c:
+            c.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('messages')")
+            row = c.fetchone()
+            if row is None:
+                return out
+            partitioned = row[0] == "p"
+            c.execute("""
+            SELECT EXISTS (SELECT 1 FROM pg_attribute WHERE attrelid = 'messages'::regclass
+                           AND attname = 'search_tsv' AND NOT attisdropped),
+                   EXISTS (SELECT 1 FROM pg_trigger WHERE tgrelid = 'messages'::regclass
+                           AND tgname = 'trg_messages_search')""")
+            has_column, has_trigger = c.fetchone()
+            if not (has_column and has_trigger):
+                # Lyhyt lukko: lock_timeout estää jäämästä pitkän transaktion taakse jonoon blokkaamaan insertit
+                conn.autocommit = False
+                try:
+                    c.execute(f"SET LOCAL lock_timeout = '{int(lock_timeout_s * 1000)}ms'")
+                    _pg_install(c)
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+                finally:
+                    conn.autocommit = True
+                out["installed"] = True
+            # CONCURRENTLY ei estä inserttejä; se odottaa vain käynnissä olevia transaktioita
+            if not partitioned:
+                _concurrent_index(c, "idx_messages_search", "messages")
+                out["indexes"] = 1
+                return out
+            c.execute("SELECT to_regclass('idx_messages_search')")
+            if c.fetchone()[0] is None:
+                # ON ONLY: pelkkä (aluksi INVALID) emoindeksi; osioiden indeksit liitetään alla
+                c.execute(f"SET lock_timeout = '{int(lock_timeout_s * 1000)}ms'")
+                c.execute("CREATE INDEX IF NOT EXISTS idx_messages_search ON ONLY messages USING gin (search_tsv)")
+                c.execute("SET lock_timeout = 0")
+            c.execute("""
+            SELECT p.relname, EXISTS (
+                SELECT 1 FROM pg_inherits ii JOIN pg_index x ON x.indexrelid = ii.inhrelid
+                WHERE ii.inhparent = 'idx_messages_search'::regclass AND x.indrelid = p.oid)
+            FROM pg_inherits i JOIN pg_class p ON p.oid = i.inhrelid
+            WHERE i.inhparent = 'messages'::regclass ORDER BY p.relname""")
+            for part, attached in c.fetchall():
+                out["indexes"] += 1
+                if attached:
+                    continue
+                _concurrent_index(c, f"{part}_search_idx", part)
+                c.execute(f"SET lock_timeout = '{int(lock_timeout_s * 1000)}ms'")
+                c.execute(f"ALTER INDEX idx_messages_search ATTACH PARTITION {part}_search_idx")
+                c.execute("SET lock_timeout = 0")
+    finally:
+        conn.close()
+    return out
+
+
+# ============== Taustaindeksointi ==============
+class SearchIndexer:
+    """
+    Indeksoi search_pending-jonon (pakatut rungot) ja triggeriä vanhemmat rivit
+    batch_size-kokoisina erinä, tauko erien välissä. SQLitessa erä on yksi lyhyt
+    BEGIN IMMEDIATE -transaktio, jolloin live-kirjoitukset mahtuvat väliin.
+    """
+
+    def __init__(self, batch_size: int = 500, interval_s: float = 30.0, pause_s: float = 0.05):
+        self.batch_size = max(1, batch_size)
+        self.interval_s = interval_s
+        self.pause_s = pause_s
+        self.stats: Dict[str, Any] = {"rounds": 0, "indexed": 0, "errors": 0, "last_error": ""}
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._run_lock = threading.Lock()
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="search-index", daemon=True)
+                self._thread.start()
+
+    def wake(self) -> None:
+        self.start()
+        self._wake.set()
+
+    def _run(self) -> None:
+        while True:
+            try:
+                self.run_once()
+            except Exception as e:
+                self.stats["errors"] += 1
+                self.stats["last_error"] = str(e).splitlines()[0][:200] if str(e) else type(e).__name__
+                log.warning("hakuindeksointi keskeytyi: %s", e)
+            self._wake.wait(self.interval_s)
+            self._wake.clear()
+
+    def run_once(self, max_batches: int = 0) -> int:
+        """Indeksoi, kunnes jono ja vanhat rivit on käyty (tai max_batches erää); palauttaa rivit."""
+        backend = db._shared_backend()
+        if backend == "pg":
+            if not db.PG_BREAKER.closed:
+                return 0
+            ensure_pg()
+        batch = self._pg_batch if backend == "pg" else self._sqlite_batch
+        indexed = batches = 0
+        with self._run_lock:
+            self.stats["rounds"] += 1
+            while True:
+                n = batch()
+                if not n:
+                    break
+                indexed += n
+                batches += 1
+                if max_batches and batches >= max_batches:
+                    break
+                time.sleep(self.pause_s)
+        if indexed:
+            self.stats["indexed"] += indexed
+            metrics.inc("henry_search_indexed_total", indexed, backend=backend)
+        return indexed
+
+    def _sqlite_batch(self) -> int:
+        conn = db._sqlite_conn()
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'messages_fts'").fetchone() is None:
+            return 0
+        with db._sqlite_write() as w:
+            ids = [r[0] for r in w.execute("SELECT id FROM search_pending ORDER BY id LIMIT ?", (self.batch_size,))]
+            if ids:
+                marks = ",".join("?" * len(ids))
+                rows = w.execute(f"SELECT id, content, content_z FROM messages WHERE id IN ({marks})", ids).fetchall()
+                w.execute(f"DELETE FROM search_pending WHERE id IN ({marks})", ids)
+                done = len(ids)
+            else:
+                upto = (w.execute("SELECT value FROM search_meta WHERE key = 'backfill_upto'").fetchone() or (0,))[0]
+                if upto <= 0:
+                    return 0
+                rows = w.execute("SELECT id, content, content_z FROM messages WHERE id <= ? ORDER BY id DESC LIMIT ?",
+                                 (upto, self.batch_size)).fetchall()
+                w.execute("UPDATE search_meta SET value = ? WHERE key = 'backfill_upto'",
+                          (rows[-1][0] - 1 if len(rows) == self.batch_size else 0,))
+                done = max(1, len(rows))
+            w.executemany("INSERT OR REPLACE INTO messages_fts (rowid, content) VALUES (?, ?)",
+                          [(i, prompt_store.unpack(t, z)) for i, t, z in rows if t is not None or z is not None])
+        return done
+
+    def _pg_batch(self) -> int:
+        from psycopg2.extras import execute_values
+
+        with db._pg_conn() as conn:
+            with conn.cursor() as c:
+                c.execute("""
+                DELETE FROM search_pending WHERE id IN (
+                    SELECT id FROM search_pending ORDER BY id LIMIT %s FOR UPDATE SKIP LOCKED) RETURNING id""",
+                          (self.batch_size,))
+                ids = [r[0] for r in c.fetchall()]
+                if ids:
+                    c.execute("SELECT id, content, content_z FROM messages WHERE id = ANY(%s)", (ids,))
+                    rows = c.fetchall()
+                    done = len(ids)
+                else:
+                    c.execute("SELECT value FROM search_meta WHERE key = 'backfill_upto'")
+                    upto = (c.fetchone() or (0,))[0]
+                    if upto <= 0:
+                        return 0
+                    c.execute("SELECT id, content, content_z FROM messages WHERE id <= %s AND search_tsv IS NULL "
+                              "ORDER BY id DESC LIMIT %s", (upto, self.batch_size))
+                    rows = c.fetchall()
+                    c.execute("UPDATE search_meta SET value = LEAST(value, %s) WHERE key = 'backfill_upto'",
+                              (rows[-1][0] - 1 if len(rows) == self.batch_size else 0,))
+                    done = max(1, len(rows))
+                if rows:
+                    execute_values(
+                        c, "UPDATE messages m SET search_tsv = henry_search_tsv(v.t) FROM (VALUES %s) AS v (id, t) "
+                           "WHERE m.id = v.id",
+                        [(i, prompt_store.unpack(t, bytes(z) if z is not None else None)) for i, t, z in rows],
+                    )
+        return done
+
+    def pending(self) -> Dict[str, int]:
+        sql = ("SELECT (SELECT COUNT(*) FROM search_pending), "
+               "(SELECT COALESCE(MAX(value), 0) FROM search_meta WHERE key = 'backfill_upto')")
+        if db._shared_backend() == "pg":
+            with db._pg_conn() as conn:
+                with conn.cursor() as c:
+                    c.execute("SELECT to_regclass('search_meta')")
+                    if c.fetchone()[0] is None:
+                        return {"pending": 0, "backfill_upto": -1}
+                    c.execute(sql)
+                    queued, upto = c.fetchone()
+        else:
+            conn = db._sqlite_conn()
+            if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'search_meta'").fetchone() is None:
+                return {"pending": 0, "backfill_upto": -1}
+            queued, upto = conn.execute(sql).fetchone()
+        return {"pending": int(queued), "backfill_upto": int(upto)}
+
+
+_INDEXER: Optional[SearchIndexer] = None
+_INDEXER_LOCK = threading.Lock()
+
+
+def indexer() -> SearchIndexer:
+    global _INDEXER
+    if _INDEXER is None:
+        with _INDEXER_LOCK:
+            if _INDEXER is None:
+                _INDEXER = SearchIndexer(
+                    batch_size=int_setting("SEARCH_INDEX_BATCH", 500),
+                    interval_s=float_setting("SEARCH_INDEX_INTERVAL_S", 30.0),
+                    pause_s=float_setting("SEARCH_INDEX_PAUSE_S", 0.05),
+                )
+    return _INDEXER
+
+
+def start_indexer() -> bool:
+    """Käynnistää taustaindeksoinnin kerran per prosessi (SEARCH_INDEX=0 → pois)."""
+    if not bool_setting("SEARCH_INDEX", True):
+        return False
+    indexer().start()
+    return True
+
+
+def status() -> Dict[str, Any]:
+    """Indeksin tila admin-näkymään: jonossa olevat ja vielä indeksoimattomien vanhojen rivien yläraja."""
+    ix = indexer()
+    out: Dict[str, Any] = {"backend": db._shared_backend(), **{k: ix.stats[k] for k in ("indexed", "errors")}}
+    try:
+        out.update(ix.pending())
+    except Exception as e:
+        out["error"] = str(e).splitlines()[0][:200] if str(e) else type(e).__name__
+    if ix.stats["last_error"]:
+        out["last_error"] = ix.stats["last_error"]
+    return out
+
+
+# ============== CLI ==============
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    ap = argparse.ArgumentParser(description="Chat-lokin kokotekstihaku")
+    ap.add_argument("query", nargs="?", default="")
+    ap.add_argument("--page", type=int, default=1)
+    ap.add_argument("--page-size", type=int, default=PAGE_SIZE)
+    ap.add_argument("--role", choices=["user", "assistant"])
+    ap.add_argument("--status", action="store_true", help="indeksin tila")
+    ap.add_argument("--index", action="store_true", help="indeksoi jono ja vanhat rivit loppuun")
+    args = ap.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    db.init_db({})
+    if args.index:
+        t0 = time.perf_counter()
+        n = indexer().run_once()
+        print(f"indeksoitu {n} riviä ({time.perf_counter() - t0:.1f} s)")
+    if args.status or not (args.query or args.index):
+        print(status())
+    if not args.query:
+        return
+    result = search(args.query, page=args.page, page_size=args.page_size, role=args.role)
+    print(f"{result['backend']}: \"{args.query}\" · sivu {result['page']}"
+          + (" (lisää tuloksia: --page %d)" % (result["page"] + 1) if result["has_more"] else ""))
+    for hit in result["hits"]:
+        print(f"  #{hit['conversation_id']:<6} {hit['role']:<9} {str(hit['ts'])[:19]}  {hit['rank']:>8.3f}  "
+              f"{hit['snippet']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,412 @@
+"""
+Kevyt asynkroninen HTTP/JSON-rajapinta agentin ytimelle (henry_agent.agent):
+Henry upotettavaksi muihin kanaviin ilman Streamlitin rerun-kustannusta.
+
+    python -m henry_agent.server --port 8080
+
+    POST /v1/conversations                   {"user_agent": ".."}  → 201 {"token", "messages"}
+    GET  /v1/conversations/<token>                                 → {"token", "messages", "has_older", ...}
+    POST /v1/conversations/<token>/messages  {"message": ".."}     → {"reply", "timings", ...}
+         Accept: text/event-stream (tai ?stream=1) → SSE: meta, delta…, notice…, done
+    GET  /healthz
+
+Toteutus on pelkkää stdlib-asynciota (ei uusia riippuvuuksia). Estävät osat
+(kanta, OpenAI-SDK) ajetaan säiepoolissa, ja striimin deltat siirtyvät säikeestä
+tapahtumasilmukkaan jonon kautta. Saman keskustelun pyynnöt sarjallistetaan
+(lukko per token); tila luetaan ja tallennetaan session_storen kautta, joten
+replikat voivat jakaa kuorman. API_MAX_TURNS samanaikaisen vuoron jälkeen
+vastataan 503 + Retry-After.
+
+API_TOKEN asetettuna → vaaditaan "Authorization: Bearer <API_TOKEN>" (paitsi /healthz).
+API_CORS_ORIGIN asetettuna → CORS-otsakkeet selainupotuksille.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import secrets
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Dict, List, NamedTuple, Optional, Sequence
+
+from . import agent, llm, metrics
+from .bootstrap import bootstrap
+from .settings import float_setting, int_setting, setting
+
+log = logging.getLogger(__name__)
+
+MAX_BODY = 64 * 1024
+MAX_HEADERS = 100
+MAX_MESSAGE_CHARS = int_setting("API_MAX_MESSAGE_CHARS", 4000)
+
+REASONS = {
+    200: "OK", 201: "Created", 204: "No Content", 400: "Bad Request", 401: "Unauthorized", 404: "Not Found",
+    405: "Method Not Allowed", 411: "Length Required", 413: "Payload Too Large", 500: "Internal Server Error",
+    503: "Service Unavailable",
+}
+
+
+class HttpError(Exception):
+    def __init__(self, status: int, message: str, headers: Optional[Dict[str, str]] = None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.headers = headers or {}
+
+
+class Request(NamedTuple):
+    method: str
+    path: str
+    query: Dict[str, str]
+    headers: Dict[str, str]
+    body: bytes
+
+    def json(self) -> Dict[str, Any]:
+        if not self.body:
+            return {}
+        try:
+            data = json.loads(self.body.decode("utf-8"))
+        except (UnicodeDecodeError, ValueError):
+            raise HttpError(400, "runko ei ole JSONia")
+        if not isinstance(data, dict):
+            raise HttpError(400, "rungon on oltava JSON-objekti")
+        return data
+
+
+class _ClientGone(Exception):
+    pass
+
+
+_END = object()
+
+
+# ============== HTTP/1.1: pyyntö sisään, vastaus ulos ==============
+async def read_request(reader: asyncio.StreamReader) -> Optional[Request]:
+    line = await reader.readline()
+    if not line:
+        return None
+    try:
+        method, target, _version = line.decode("latin-1").split()
+    except ValueError:
+        raise HttpError(400, "virheellinen pyyntörivi")
+    headers: Dict[str, str] = {}
+    while True:
+        raw = await reader.readline()
+        if raw in (b"\r\n", b"\n", b""):
+            break
+        if len(headers) >= MAX_HEADERS:
+            raise HttpError(400, "liikaa otsakkeita")
+        key, _, value = raw.decode("latin-1").partition(":")
+        headers[key.strip().lower()] = value.strip()
+    if "chunked" in headers.get("transfer-encoding", "").lower():
+        raise HttpError(411, "Content-Length vaaditaan")
+    try:
+        length = int(headers.get("content-length") or 0)
+    except ValueError:
+        raise HttpError(400, "virheellinen Content-Length")
+    if length > MAX_BODY:
+        raise HttpError(413, f"runko yli {MAX_BODY} tavua")
+    body = await reader.readexactly(length) if length else b""
+    path, _, query = target.partition("?")
+    params: Dict[str, str] = {}
+    for pair in filter(None, query.split("&")):
+        k, _, v = pair.partition("=")
+        params[k] = v
+    return Request(method.upper(), path, params, headers, body)
+
+
+def _head(status: int, headers: Dict[str, str]) -> bytes:
+    lines = [f"HTTP/1.1 {status} {REASONS.get(status, 'OK')}"] + [f"{k}: {v}" for k, v in headers.items()]
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+
+def _sse(event: str, data: Any) -> bytes:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8")
+
+
+def _visible(state: Dict[str, Any]) -> List[Dict[str, str]]:
+    return [{"role": m["role"], "content": m["content"]}
+            for m in state["older_messages"] + state["messages"] if m.get("role") != "system"]
+
+
+# ============== Palvelin ==============
+class ChatServer:
+    def __init__(self, workers: int = 16, max_turns: int = 64, api_token: str = "", cors_origin: str = "",
+                 idle_timeout_s: float = 15.0):
+        self.executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="api")
+        self.max_turns = max(1, max_turns)
+        self.api_token = api_token
+        self.cors_origin = cors_origin
+        self.idle_timeout_s = idle_timeout_s
+        self._locks: Dict[str, List[Any]] = {}     # token → [lukko, odottajat]
+        self._turns = 0
+        metrics.gauge("henry_api_turns_in_flight", lambda: float(self._turns))
+
+    @classmethod
+    def from_settings(cls) -> "ChatServer":
+        return cls(
+            workers=int_setting("API_WORKERS", 16),
+            max_turns=int_setting("API_MAX_TURNS", 64),
+            api_token=setting("API_TOKEN", "") or "",
+            cors_origin=setting("API_CORS_ORIGIN", "") or "",
+            idle_timeout_s=float_setting("API_IDLE_TIMEOUT_S", 15.0),
+        )
+
+    # ---------- yhteys ----------
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            keep_alive = True
+            while keep_alive:
+                try:
+                    req = await asyncio.wait_for(read_request(reader), self.idle_timeout_s)
+                except HttpError as e:
+                    await self._send_json(writer, e.status, {"error": e.message}, keep_alive=False)
+                    return
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                    return
+                if req is None:
+                    return
+                keep_alive = req.headers.get("connection", "").lower() != "close"
+                keep_alive = await self._dispatch(req, writer, keep_alive)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except Exception:
+                pass
+
+    async def _dispatch(self, req: Request, writer: asyncio.StreamWriter, keep_alive: bool) -> bool:
+        route, status = "unknown", 500
+        try:
+            parts = [p for p in req.path.split("/") if p]
+            if req.method == "OPTIONS":
+                route, status = "preflight", 204
+                await self._send(writer, 204, b"", "text/plain", keep_alive, {
+                    "Access-Control-Allow-Methods": "GET, POST, OPTIONS",
+                    "Access-Control-Allow-Headers": "Authorization, Content-Type, Accept",
+                })
+                return keep_alive
+            if parts == ["healthz"]:
+                route, status = "health", 200
+                # OpenAI-tila välimuistista; virheteksti ei kuulu autentikoimattomaan vastaukseen
+                api = llm.health()
+                await self._send_json(writer, 200, {
+                    "ok": True, "turns_in_flight": self._turns,
+                    "openai": {"ok": api["ok"], "latency_ms": api["latency_ms"]},
+                    "connections": llm.CONN_STATS.snapshot(),
+                }, keep_alive)
+                return keep_alive
+            self._authorize(req)
+            if parts[:2] != ["v1", "conversations"] or len(parts) > 4:
+                raise HttpError(404, "tuntematon polku")
+            if len(parts) == 2:
+                route = "create"
+                self._method(req, "POST")
+                user_agent = str(req.json().get("user_agent") or req.headers.get("user-agent", ""))[:200]
+                data = await self._call(self._create, user_agent)
+                status = 201
+            elif len(parts) == 3:
+                route = "get"
+                self._method(req, "GET")
+                async with self._lock(parts[2]):
+                    data = await self._call(self._get, parts[2])
+                status = 200
+            elif parts[3] == "messages":
+                route = "turn"
+                self._method(req, "POST")
+                status, keep_alive = await self._turn(req, writer, parts[2], keep_alive)
+                return keep_alive
+            else:
+                raise HttpError(404, "tuntematon polku")
+            await self._send_json(writer, status, data, keep_alive)
+            return keep_alive
+        except HttpError as e:
+            status = e.status
+            await self._send_json(writer, e.status, {"error": e.message}, keep_alive, e.headers)
+            return keep_alive
+        except ConnectionError:
+            raise
+        except Exception as e:
+            log.exception("API-pyyntö epäonnistui: %s %s", req.method, req.path)
+            await self._send_json(writer, 500, {"error": e.__class__.__name__}, keep_alive=False)
+            return False
+        finally:
+            metrics.inc("henry_api_requests_total", route=route, status=str(status))
+
+    def _authorize(self, req: Request) -> None:
+        if not self.api_token:
+            return
+        given = req.headers.get("authorization", "")
+        if not secrets.compare_digest(given.encode(), f"Bearer {self.api_token}".encode()):
+            raise HttpError(401, "virheellinen tai puuttuva API-token", {"WWW-Authenticate": "Bearer"})
+
+    @staticmethod
+    def _method(req: Request, allowed: str) -> None:
+        if req.method != allowed:
+            raise HttpError(405, f"vain {allowed}", {"Allow": allowed})
+
+    @asynccontextmanager
+    async def _lock(self, token: str) -> AsyncIterator[None]:
+        # Saman keskustelun vuorot peräkkäin; lukko poistetaan, kun kukaan ei odota
+        entry = self._locks.setdefault(token, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                self._locks.pop(token, None)
+
+    async def _call(self, fn: Callable[..., Any], *args: Any) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    # ---------- vastaukset ----------
+    def _base_headers(self, keep_alive: bool) -> Dict[str, str]:
+        headers = {"Connection": "keep-alive" if keep_alive else "close"}
+        if self.cors_origin:
+            headers["Access-Control-Allow-Origin"] = self.cors_origin
+        return headers
+
+    async def _send(self, writer: asyncio.StreamWriter, status: int, body: bytes, content_type: str,
+                    keep_alive: bool, extra: Optional[Dict[str, str]] = None) -> None:
+        headers = {"Content-Type": content_type, "Content-Length": str(len(body)),
+                   **self._base_headers(keep_alive), **(extra or {})}
+        writer.write(_head(status, headers) + body)
+        await writer.drain()
+
+    async def _send_json(self, writer: asyncio.StreamWriter, status: int, payload: Any, keep_alive: bool,
+                         extra: Optional[Dict[str, str]] = None) -> None:
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        await self._send(writer, status, body, "application/json; charset=utf-8", keep_alive, extra)
+
+    # ---------- päätepisteet (säiepoolissa) ----------
+    @staticmethod
+    def _create(user_agent: str) -> Dict[str, Any]:
+        state: Dict[str, Any] = {}
+        token = agent.open_conversation(state, "", user_agent=user_agent)
+        agent.greet(state, token)
+        return {"token": token, "messages": _visible(state)}
+
+    @staticmethod
+    def _get(token: str) -> Dict[str, Any]:
+        state: Dict[str, Any] = {}
+        if not agent.load_conversation(state, token):
+            raise HttpError(404, "tuntematon keskustelu")
+        return {"token": token, "messages": _visible(state), "has_older": bool(state["has_older"]),
+                "audience": state["audience"], "turns": len(state["turn_timings"])}
+
+    @staticmethod
+    def _run_turn(token: str, message: str, emit: Callable[[str, Any], None]) -> Dict[str, Any]:
+        state: Dict[str, Any] = {}
+        if not agent.load_conversation(state, token):
+            raise HttpError(404, "tuntematon keskustelu")
+        turn = agent.prepare_turn(state, message)
+        emit("meta", {"route": turn.route.name, "audience": turn.audience, "prefix": turn.prefix,
+                      "intents": sorted(turn.signals.intents)})
+        stream = agent.stream_reply(turn)
+        try:
+            for delta in stream:
+                emit("delta", {"text": delta})
+        except _ClientGone:
+            pass   # vastaus talletetaan siltä osin kuin se ehti syntyä
+        finally:
+            stream.close()
+        record = agent.finish_turn(state, turn, token)
+        return {
+            "reply": turn.reply, "route": record["route"], "timings": record, "visuals": turn.visuals,
+            "connect": turn.connect, "notices": [{"level": lv, "text": t} for lv, t in turn.notices],
+        }
+
+    async def _turn(self, req: Request, writer: asyncio.StreamWriter, token: str, keep_alive: bool):
+        message = str(req.json().get("message") or "").strip()
+        if not message:
+            raise HttpError(400, "message puuttuu")
+        if len(message) > MAX_MESSAGE_CHARS:
+            raise HttpError(413, f"viesti yli {MAX_MESSAGE_CHARS} merkkiä")
+        if self._turns >= self.max_turns:
+            raise HttpError(503, "palvelu ruuhkautunut", {"Retry-After": "2"})
+        stream = req.query.get("stream") in ("1", "true") or "text/event-stream" in req.headers.get("accept", "")
+        self._turns += 1
+        try:
+            async with self._lock(token):
+                if not stream:
+                    result = await self._call(self._run_turn, token, message, lambda event, data: None)
+                    await self._send_json(writer, 200, result, keep_alive)
+                    return 200, keep_alive
+                return await self._stream_turn(writer, token, message)
+        finally:
+            self._turns -= 1
+
+    async def _stream_turn(self, writer: asyncio.StreamWriter, token: str, message: str):
+        loop = asyncio.get_running_loop()
+        events: "asyncio.Queue[Any]" = asyncio.Queue()
+        gone = threading.Event()
+
+        def emit(event: str, data: Any) -> None:
+            if gone.is_set():
+                raise _ClientGone()
+            loop.call_soon_threadsafe(events.put_nowait, (event, data))
+
+        future = loop.run_in_executor(self.executor, self._run_turn, token, message, emit)
+        # Valmistumisen merkki tulee jonoon vasta säikeen kaikkien tapahtumien jälkeen
+        future.add_done_callback(lambda _: events.put_nowait(_END))
+        started = False
+        while True:
+            item = await events.get()
+            if item is _END:
+                break
+            if gone.is_set():
+                continue
+            try:
+                if not started:
+                    headers = {"Content-Type": "text/event-stream; charset=utf-8", "Cache-Control": "no-cache",
+                               "X-Accel-Buffering": "no", **self._base_headers(False)}
+                    writer.write(_head(200, headers))
+                    started = True
+                writer.write(_sse(*item))
+                await writer.drain()
+            except ConnectionError:
+                gone.set()
+        try:
+            result = future.result()
+        except HttpError:
+            if started:
+                raise ConnectionError("vuoro epäonnistui striimin aikana")
+            raise
+        if gone.is_set():
+            return 200, False
+        writer.write(_sse("done", result))
+        await writer.drain()
+        return 200, False
+
+
+async def serve(host: str, port: int, server: Optional[ChatServer] = None) -> None:
+    server = server or ChatServer.from_settings()
+    srv = await asyncio.start_server(server.handle, host, port, limit=MAX_BODY)
+    log.info("Henry-API kuuntelee %s", ", ".join(str(s.getsockname()) for s in srv.sockets))
+    async with srv:
+        await srv.serve_forever()
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    ap = argparse.ArgumentParser(description="Agentti-Henryn HTTP/JSON-rajapinta (SSE-striimaus)")
+    ap.add_argument("--host", default=setting("API_HOST", "127.0.0.1") or "127.0.0.1")
+    ap.add_argument("--port", type=int, default=int_setting("API_PORT", 8080))
+    args = ap.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    # Skeema, PG-koetus, metriikat ja ylläpito kerran per prosessi, kuten Streamlit-sivulla
+    boot = bootstrap()
+    log.info("backend %s, käynnistys %.0f ms", boot["backend"], boot["boot_ms"])
+    try:
+        asyncio.run(serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
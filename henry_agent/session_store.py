@@ -0,0 +1,306 @@
+"""
+Keskustelun tila prosessin ulkopuolelle: mikä tahansa replika voi jatkaa mitä
+tahansa keskustelua ilman sticky sessioneita, ja uudelleenkäynnistys ei hukkaa
+kesken olevia keskusteluja.
+
+Avain on URL:n jatkotoken (?c=). Backend valitaan SESSION_STORE-asetuksella:
+
+    db      (oletus) session_state-taulu olemassa olevassa PG/SQLite-kerroksessa
+    memory  prosessin sisäinen LRU (yksi replika; testit, kehitys)
+    off     ei tallennusta
+
+Sarjallistus: SESSION_KEYS → kompakti JSON → zlib. System-prompt tallennetaan
+pelkkänä prompt_id-viitteenä, kun se on jo prompts-taulussa (prompt_store), ja
+viesteistä vain viimeiset SESSION_SNAPSHOT_MESSAGES (sekä tiivistelmään vielä
+taittamattomat); vanhempi historia luetaan tarvittaessa messages-taulusta
+(agent.load_older). Tila on muutama kilotavu eikä kasva keskustelun pituuden mukana.
+
+Read-through-välimuisti: DbStore pitää pakatut tilat prosessin LRU:ssa ja tarkistaa
+kannasta vain versionumeron; koko rivi haetaan vasta, kun toinen replika on
+kirjoittanut uudemman version. Kirjoitus on versiotarkistettu (compare-and-set):
+vanhentunutta versiota ei kirjoiteta, vaan save() lukee uusimman tilan, lisää sen
+perään tämän replikan uudet viestit ja yrittää uudelleen (ks. _merge).
+"""
+
+import json
+import logging
+import threading
+import zlib
+from collections import OrderedDict
+from dataclasses import asdict, is_dataclass
+from typing import Any, Dict, List, Mapping, MutableMapping, Optional, Tuple
+
+from . import db, metrics, prompt_store
+from .breaker import CircuitOpen
+from .context import ContextState
+from .settings import int_setting, setting
+
+log = logging.getLogger(__name__)
+
+SESSION_KEYS = (
+    "conversation_id", "user_id", "messages", "audience", "audience_name", "audience_company", "profile_text",
+    "system_built", "greeted", "context_state", "turn_timings", "has_older", "oldest_id", "job_ad", "user_turns",
+)
+TIMINGS_KEEP = 20
+SNAPSHOT_MESSAGES = max(2, int_setting("SESSION_SNAPSHOT_MESSAGES", 20))
+VERSION_KEY = "_session_version"   # st.session_statessa: viimeksi luettu/kirjoitettu versio
+BASE_KEY = "_session_base"         # mitä tilassa oli viimeksi luettaessa/kirjoitettaessa (yhdistämistä varten)
+SAVE_RETRIES = 3
+# Asetusluonteiset avaimet: ristiriidassa paikallinen muutos voittaa, muuten uusin tallennettu arvo
+_OWN_KEYS = tuple(k for k in SESSION_KEYS if k not in (
+    "messages", "turn_timings", "context_state", "has_older", "oldest_id", "user_turns"))
+
+
+# ============== Sarjallistus ==============
+_PROMPTS: "OrderedDict[str, str]" = OrderedDict()
+_PROMPTS_LOCK = threading.Lock()
+
+
+def _remember_prompt(pid: str, text: str) -> None:
+    with _PROMPTS_LOCK:
+        _PROMPTS[pid] = text
+        _PROMPTS.move_to_end(pid)
+        while len(_PROMPTS) > 256:
+            _PROMPTS.popitem(last=False)
+
+
+def _prompt_text(pid: str) -> Optional[str]:
+    with _PROMPTS_LOCK:
+        text = _PROMPTS.get(pid)
+    if text is None:
+        text = db.load_prompt(pid)
+        if text is not None:
+            _remember_prompt(pid, text)
+    return text
+
+
+def snapshot(state: Mapping[str, Any]) -> Dict[str, Any]:
+    out: Dict[str, Any] = {k: state[k] for k in SESSION_KEYS if k in state}
+    cs = out.get("context_state")
+    cs = dict(asdict(cs) if is_dataclass(cs) else cs or {})
+    out["turn_timings"] = list(out.get("turn_timings") or [])[-TIMINGS_KEEP:]
+    backend = db._shared_backend()
+    messages: List[Dict[str, Any]] = []
+    history: List[Dict[str, Any]] = []
+    for m in out.get("messages") or []:
+        if m.get("role") != "system":
+            history.append(m)
+            continue
+        pid = prompt_store.prompt_hash(m["content"])
+        _remember_prompt(pid, m["content"])
+        messages.append({"role": "system", "prompt_id": pid} if prompt_store.is_known(backend, pid) else m)
+    # Viimeiset viestit, mutta ei yhtään tiivistelmään taittamatonta: konteksti säilyy ennallaan
+    folded = min(int(cs.get("folded", 0)), len(history))
+    start = min(folded, max(0, len(history) - SNAPSHOT_MESSAGES))
+    cs["folded"] = folded - start
+    out["context_state"] = cs
+    out["messages"] = messages + history[start:]
+    if start or state.get("older_messages"):
+        # Ikkunan ensimmäisen viestin id:tä ei tunneta (viestit kirjoitetaan kantaan jälkikäteen):
+        # vanhempi historia luetaan viestitaulun lopusta laskien, sen jälkeen keysetillä
+        out["oldest_id"], out["has_older"] = None, True
+    return out
+
+
+def restore(state: MutableMapping[str, Any], data: Mapping[str, Any]) -> None:
+    messages = []
+    for m in data.get("messages") or []:
+        if "prompt_id" in m:
+            text = _prompt_text(m["prompt_id"])
+            if text is None:
+                continue
+            m = {"role": "system", "content": text}
+        messages.append(m)
+    for k in SESSION_KEYS:
+        if k in data:
+            state[k] = data[k]
+    state["messages"] = messages
+    state["older_messages"] = []
+    state["context_state"] = ContextState(**(data.get("context_state") or {}))
+
+
+def encode(data: Mapping[str, Any]) -> bytes:
+    raw = json.dumps(data, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+    return zlib.compress(raw, 6)
+
+
+def decode(blob: bytes) -> Dict[str, Any]:
+    return json.loads(zlib.decompress(blob).decode("utf-8"))
+
+
+# ============== Backendit ==============
+class SessionStore:
+    name = "off"
+
+    def get(self, sid: str) -> Optional[Tuple[int, Dict[str, Any]]]:
+        return None
+
+    def put(self, sid: str, data: Dict[str, Any], expected: Optional[int]) -> Optional[int]:
+        """Uusi versio, tai None jos tallennettu versio ei ollut expected (mitään ei kirjoitettu)."""
+        return 0
+
+
+class MemoryStore(SessionStore):
+    """Prosessin sisäinen LRU; tallettaa sarjallistetut tavut → sama semantiikka kuin DbStorella."""
+    name = "memory"
+
+    def __init__(self, max_sessions: int = 1000):
+        self.max_sessions = max_sessions
+        self._items: "OrderedDict[str, Tuple[int, bytes]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, sid: str) -> Optional[Tuple[int, Dict[str, Any]]]:
+        with self._lock:
+            item = self._items.get(sid)
+            if item is not None:
+                self._items.move_to_end(sid)
+        return (item[0], decode(item[1])) if item else None
+
+    def put(self, sid: str, data: Dict[str, Any], expected: Optional[int]) -> Optional[int]:
+        blob = encode(data)
+        with self._lock:
+            current = self._items.get(sid, (0, b""))[0]
+            if current and current != expected:
+                metrics.inc("henry_session_store_total", op="put", result="conflict")
+                return None
+            self._items[sid] = (current + 1, blob)
+            self._items.move_to_end(sid)
+            while len(self._items) > self.max_sessions:
+                self._items.popitem(last=False)
+            return current + 1
+
+
+class DbStore(SessionStore):
+    """session_state-taulu + read-through-LRU; välimuistiosumalla kannasta luetaan vain versio."""
+    name = "db"
+
+    def __init__(self, cache_size: int = 500):
+        self.cache_size = cache_size
+        # Tavuina, ei purettuna: sessiot eivät jaa muuttuvia listoja keskenään
+        self._cache: "OrderedDict[str, Tuple[int, bytes]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _remember(self, sid: str, version: int, blob: bytes) -> None:
+        with self._lock:
+            self._cache[sid] = (version, blob)
+            self._cache.move_to_end(sid)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    @metrics.timed("session_load")
+    def get(self, sid: str) -> Optional[Tuple[int, Dict[str, Any]]]:
+        with self._lock:
+            cached = self._cache.get(sid)
+        if cached is not None and db.session_state_version(sid) == cached[0]:
+            metrics.inc("henry_session_store_total", op="get", result="cache")
+            return cached[0], decode(cached[1])
+        row = db.load_session_state(sid)
+        if row is None:
+            metrics.inc("henry_session_store_total", op="get", result="miss")
+            return None
+        metrics.inc("henry_session_store_total", op="get", result="db")
+        self._remember(sid, row[0], row[1])
+        return row[0], decode(row[1])
+
+    @metrics.timed("session_save")
+    def put(self, sid: str, data: Dict[str, Any], expected: Optional[int]) -> Optional[int]:
+        blob = encode(data)
+        version = db.save_session_state(sid, blob, expected)
+        metrics.inc("henry_session_store_total", op="put", result="ok" if version is not None else "conflict")
+        if version is not None:
+            self._remember(sid, version, blob)
+        return version
+
+
+_STORE: Optional[SessionStore] = None
+_STORE_LOCK = threading.Lock()
+
+
+def store() -> SessionStore:
+    global _STORE
+    if _STORE is None:
+        with _STORE_LOCK:
+            if _STORE is None:
+                kind = (setting("SESSION_STORE", "db") or "db").lower()
+                if kind == "memory":
+                    _STORE = MemoryStore(int_setting("SESSION_STORE_MAX", 1000))
+                elif kind == "db":
+                    _STORE = DbStore(int_setting("SESSION_CACHE_SIZE", 500))
+                else:
+                    _STORE = SessionStore()
+    return _STORE
+
+
+# ============== Sovelluksen rajapinta ==============
+def load(state: MutableMapping[str, Any], sid: str) -> bool:
+    """Palauttaa tallennetun tilan stateen; False jos tilaa ei ole (tai lukeminen epäonnistui)."""
+    if not sid:
+        return False
+    try:
+        item = store().get(sid)
+    except CircuitOpen:
+        # PG-katkos: kutsu hylättiin heti; sovellus rakentaa tilan spoolin näkymästä
+        metrics.inc("henry_session_store_total", op="get", result="unavailable")
+        return False
+    except Exception as e:
+        log.warning("sessiotilan luku epäonnistui: %s", e)
+        return False
+    if item is None:
+        return False
+    restore(state, item[1])
+    state[VERSION_KEY] = item[0]
+    _mark_base(state)
+    return True
+
+
+def _mark_base(state: MutableMapping[str, Any]) -> None:
+    state[BASE_KEY] = {
+        "messages": sum(1 for m in state.get("messages") or [] if m.get("role") != "system"),
+        "turn_timings": len(state.get("turn_timings") or []),
+        "user_turns": state.get("user_turns", 0),
+        "values": {k: state.get(k) for k in _OWN_KEYS},
+    }
+
+
+def _merge(state: MutableMapping[str, Any], version: int, latest: Mapping[str, Any]) -> None:
+    """Toinen replika ehti tallentaa välissä: uusin tila pohjaksi, perään tämän replikan
+    viimeisimmän luvun/kirjoituksen jälkeen lisäämät viestit ja mittaukset."""
+    base = state.get(BASE_KEY) or {"messages": 0, "turn_timings": 0, "user_turns": 0, "values": {}}
+    own = {k: state.get(k) for k in _OWN_KEYS if state.get(k) != base["values"].get(k, state.get(k))}
+    system = [m for m in state["messages"] if m.get("role") == "system"]
+    new_messages = [m for m in state["messages"] if m.get("role") != "system"][base["messages"]:]
+    new_timings = list(state.get("turn_timings") or [])[base["turn_timings"]:]
+    new_turns = state.get("user_turns", 0) - base.get("user_turns", 0)
+    restore(state, latest)
+    state[VERSION_KEY] = version
+    _mark_base(state)
+    state.update(own)
+    if any(m.get("role") == "system" for m in state["messages"]):
+        system = []
+    state["messages"] = system + state["messages"] + new_messages
+    state["turn_timings"] = list(state.get("turn_timings") or []) + new_timings
+    state["user_turns"] = state.get("user_turns", 0) + new_turns
+
+
+def save(state: MutableMapping[str, Any], sid: str) -> None:
+    if not sid or store().name == "off":
+        return
+    try:
+        for _ in range(SAVE_RETRIES):
+            version = store().put(sid, snapshot(state), state.get(VERSION_KEY))
+            if version is not None:
+                state[VERSION_KEY] = version
+                _mark_base(state)
+                return
+            item = store().get(sid)
+            if item is None:
+                # Rivi poistui välissä: seuraava yritys luo sen
+                state.pop(VERSION_KEY, None)
+                continue
+            _merge(state, item[0], item[1])
+        log.warning("sessiotilan tallennus: versioristiriita %d yrityksen jälkeen", SAVE_RETRIES)
+    except CircuitOpen:
+        metrics.inc("henry_session_store_total", op="put", result="unavailable")
+    except Exception as e:
+        # Tila on yhä sessiossa; seuraava vuoro yrittää uudelleen
+        log.warning("sessiotilan tallennus epäonnistui: %s", e)
@@ -0,0 +1,44 @@
+"""
+Asetusten luku yhdestä paikasta: Streamlit Secrets → ympäristömuuttuja → oletus.
+
+Streamlitiä ei tuoda täällä: jos sovellus on jo ladannut sen, käytetään
+sen secretsejä, muuten (CLI, benchmarkit) pelkkiä ympäristömuuttujia.
+"""
+
+import os
+import sys
+from typing import Any, Optional
+
+
+def setting(name: str, default: Optional[str] = None) -> Optional[str]:
+    st = sys.modules.get("streamlit")
+    if st is not None:
+        try:
+            v = st.secrets.get(name, "")
+            if v not in (None, ""):
+                return str(v)
+        except Exception:
+            pass
+    v = os.getenv(name, "")
+    return v if v != "" else default
+
+
+def int_setting(name: str, default: int) -> int:
+    try:
+        return int(setting(name, None) or default)
+    except (TypeError, ValueError):
+        return default
+
+
+def float_setting(name: str, default: float) -> float:
+    try:
+        return float(setting(name, None) or default)
+    except (TypeError, ValueError):
+        return default
+
+
+def bool_setting(name: str, default: bool) -> bool:
+    v: Any = setting(name, None)
+    if v is None:
+        return default
+    return str(v).strip().lower() in ("1", "true", "yes", "on", "kyllä")
@@ -0,0 +1,264 @@
+"""
+Paikallinen spooli Postgres-katkoksille: kirjoitukset SQLite-jonoon (pg_spool),
+taustasäie kirjoittaa ne Postgresiin, kun katkaisin on taas kiinni.
+
+- FIFO: rivit viedään id-järjestyksessä, ja niin kauan kuin spoolissa on rivejä,
+  uudetkin kirjoitukset menevät sen kautta → keskustelun viestijärjestys säilyy.
+- Katkoksen aikana aloitettu keskustelu saa väliaikaisen id:n -<spoolirivin id>.
+  Takaisinkirjoitus tallentaa vastaavuuden (pg_spool_ids), joten sessio voi
+  jatkaa samalla id:llä myös toipumisen jälkeen.
+- Idempotenssi: jokaisella rivillä on spool_key, joka kirjoitetaan Postgresiin
+  (ON CONFLICT DO NOTHING). Jos prosessi kaatuu PG-commitin ja spoolin
+  kuittauksen välissä, uusintakierros ei tuota kaksoiskappaleita.
+- Katkosvirhe pysäyttää kierroksen (rivit odottavat); muu virhe eristetään
+  rivikohtaisesti ja rivi jää max_attempts yrityksen jälkeen spooliin
+  tarkastettavaksi (dead letter) jonoa tukkimatta.
+"""
+
+import logging
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from . import metrics
+from .breaker import CircuitBreaker
+from .sqlite_backend import SqliteBackend
+
+log = logging.getLogger(__name__)
+
+
+class SpoolRow(NamedTuple):
+    id: int
+    kind: str                  # conversation | message | prompt
+    spool_key: str
+    conversation_id: int       # PG-id (> 0) tai väliaikainen (< 0)
+    user_id: Optional[str]
+    user_agent: Optional[str]
+    resume_token: Optional[str]
+    role: Optional[str]
+    content: Optional[str]
+    content_z: Optional[bytes]
+    prompt_id: Optional[str]
+    ts: str
+
+
+COLUMNS = ", ".join(SpoolRow._fields)
+
+
+def _key() -> str:
+    return uuid.uuid4().hex
+
+
+class Spool:
+    def __init__(self, sqlite: SqliteBackend, max_attempts: int = 5):
+        self.sqlite = sqlite
+        self.max_attempts = max(1, max_attempts)
+
+    def _write(self):
+        self.sqlite.migrate()
+        return self.sqlite.write()
+
+    def _conn(self):
+        self.sqlite.migrate()
+        return self.sqlite.connection()
+
+    # ---------- kirjoitus ----------
+    def append_conversation(self, user_id: str, user_agent: Optional[str], resume_token: Optional[str],
+                            ts: str) -> int:
+        with self._write() as conn:
+            c = conn.execute(
+                "INSERT INTO pg_spool (kind, spool_key, conversation_id, user_id, user_agent, resume_token, ts) "
+                "VALUES ('conversation', ?, 0, ?, ?, ?, ?)",
+                (_key(), user_id, user_agent, resume_token, ts),
+            )
+            local = -int(c.lastrowid)
+            conn.execute("UPDATE pg_spool SET conversation_id = ? WHERE id = ?", (local, -local))
+        metrics.inc("henry_spool_rows_total", kind="conversation")
+        return local
+
+    def append_messages(self, rows: Sequence[Tuple[int, str, Optional[str], Optional[bytes], str]]) -> None:
+        # rivit: (conversation_id, role, content, content_z, ts)
+        with self._write() as conn:
+            conn.executemany(
+                "INSERT INTO pg_spool (kind, spool_key, conversation_id, role, content, content_z, ts) "
+                "VALUES ('message', ?, ?, ?, ?, ?, ?)",
+                [(_key(), *r) for r in rows],
+            )
+        metrics.inc("henry_spool_rows_total", len(rows), kind="message")
+
+    def append_prompt(self, conversation_id: int, prompt_id: str, content: Optional[str],
+                      content_z: Optional[bytes], ts: str) -> None:
+        with self._write() as conn:
+            conn.execute(
+                "INSERT INTO pg_spool (kind, spool_key, conversation_id, prompt_id, content, content_z, ts) "
+                "VALUES ('prompt', ?, ?, ?, ?, ?, ?)",
+                (_key(), conversation_id, prompt_id, content, content_z, ts),
+            )
+        metrics.inc("henry_spool_rows_total", kind="prompt")
+
+    # ---------- jono ----------
+    def has_pending(self) -> bool:
+        return bool(self._conn().execute(
+            "SELECT EXISTS (SELECT 1 FROM pg_spool WHERE attempts < ?)", (self.max_attempts,)).fetchone()[0])
+
+    def depth(self) -> int:
+        return int(self._conn().execute(
+            "SELECT COUNT(*) FROM pg_spool WHERE attempts < ?", (self.max_attempts,)).fetchone()[0])
+
+    def dead(self) -> int:
+        return int(self._conn().execute(
+            "SELECT COUNT(*) FROM pg_spool WHERE attempts >= ?", (self.max_attempts,)).fetchone()[0])
+
+    def batch(self, limit: int) -> List[SpoolRow]:
+        rows = self._conn().execute(
+            f"SELECT {COLUMNS} FROM pg_spool WHERE attempts < ? ORDER BY id LIMIT ?", (self.max_attempts, limit),
+        ).fetchall()
+        return [SpoolRow(*r) for r in rows]
+
+    def ack(self, ids: Sequence[int], mapping: Dict[int, int]) -> None:
+        """Poistaa viedyt rivit ja tallentaa väliaikaisten id:iden vastaavuudet samassa transaktiossa."""
+        now = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime())
+        with self._write() as conn:
+            if mapping:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO pg_spool_ids (local_id, pg_id, mapped_at) VALUES (?, ?, ?)",
+                    [(local, pg, now) for local, pg in mapping.items()],
+                )
+            conn.executemany("DELETE FROM pg_spool WHERE id = ?", [(i,) for i in ids])
+
+    def fail(self, row_id: int, error: str) -> int:
+        with self._write() as conn:
+            conn.execute("UPDATE pg_spool SET attempts = attempts + 1, error = ? WHERE id = ?", (error[:500], row_id))
+            row = conn.execute("SELECT attempts FROM pg_spool WHERE id = ?", (row_id,)).fetchone()
+        return int(row[0]) if row else 0
+
+    def resolve(self, conversation_id: int) -> Optional[int]:
+        """PG-id keskustelulle; väliaikaiselle id:lle None, kunnes se on viety."""
+        if conversation_id > 0:
+            return conversation_id
+        row = self._conn().execute("SELECT pg_id FROM pg_spool_ids WHERE local_id = ?", (conversation_id,)).fetchone()
+        return int(row[0]) if row else None
+
+    # ---------- paikallinen näkymä (luku katkoksen aikana) ----------
+    def find_resume(self, token: str) -> Optional[int]:
+        row = self._conn().execute(
+            "SELECT conversation_id FROM pg_spool WHERE kind = 'conversation' AND resume_token = ? LIMIT 1", (token,),
+        ).fetchone()
+        return int(row[0]) if row else None
+
+    def prompt(self, conversation_id: int) -> Optional[Tuple[Optional[str], Optional[bytes], str]]:
+        row = self._conn().execute(
+            "SELECT content, content_z, ts FROM pg_spool WHERE kind = 'prompt' AND conversation_id = ? "
+            "ORDER BY id DESC LIMIT 1", (conversation_id,),
+        ).fetchone()
+        return (row[0], row[1], row[2]) if row else None
+
+    def messages(self, conversation_id: int, before_id: Optional[int] = None,
+                 limit: int = -1) -> List[Tuple[Any, ...]]:
+        # (id, role, content, content_z, ts) uusimmasta vanhimpaan; id:t ovat spoolin omia
+        return self._conn().execute(
+            "SELECT id, role, content, content_z, ts FROM pg_spool WHERE kind = 'message' AND conversation_id = ? "
+            "AND id < ? ORDER BY id DESC LIMIT ?",
+            (conversation_id, before_id if before_id is not None else 2 ** 62, limit),
+        ).fetchall()
+
+
+# ============== Takaisinkirjoitus ==============
+class Backfiller:
+    """
+    Taustasäie: herää wake()-kutsusta tai interval_s välein, ja kun katkaisin
+    päästää läpi, vie spoolin batch-kokoisina erinä sink()-funktiolle.
+    sink palauttaa väliaikaisten keskustelu-id:iden vastaavuudet {local: pg_id}.
+    """
+
+    def __init__(
+        self,
+        spool: Spool,
+        breaker: CircuitBreaker,
+        sink: Callable[[Sequence[SpoolRow]], Dict[int, int]],
+        is_outage: Callable[[BaseException], bool],
+        batch_size: int = 200,
+        interval_s: float = 5.0,
+        pause_s: float = 0.05,
+    ):
+        self.spool = spool
+        self.breaker = breaker
+        self.sink = sink
+        self.is_outage = is_outage
+        self.batch_size = max(1, batch_size)
+        self.interval_s = interval_s
+        self.pause_s = pause_s
+        self.stats: Dict[str, int] = {"rounds": 0, "written": 0, "failed": 0}
+        self._wake = threading.Event()
+        self._drain_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="pg-backfill", daemon=True)
+                self._thread.start()
+
+    def wake(self) -> None:
+        self.start()
+        self._wake.set()
+
+    def _run(self) -> None:
+        while True:
+            self._wake.wait(self.interval_s)
+            self._wake.clear()
+            try:
+                # allow() käynnistää myös erääntyneen koetuksen, vaikka UI:ssa ei olisi liikennettä
+                if self.spool.has_pending() and self.breaker.allow():
+                    self.drain()
+            except Exception as e:
+                log.warning("spoolin takaisinkirjoitus keskeytyi: %s", e)
+
+    def drain(self) -> int:
+        """Vie spoolia niin kauan kuin sitä riittää; palauttaa viedyt rivit."""
+        written = 0
+        with self._drain_lock:
+            self.stats["rounds"] += 1
+            while self.breaker.closed:
+                rows = self.spool.batch(self.batch_size)
+                if not rows:
+                    break
+                try:
+                    with metrics.span("spool_backfill"):
+                        mapping = self.sink(rows)
+                    self.spool.ack([r.id for r in rows], mapping)
+                    written += len(rows)
+                except Exception as e:
+                    if self.is_outage(e):
+                        log.info("Postgres katkesi takaisinkirjoituksen aikana: %s", e)
+                    else:
+                        # Virheellinen rivi yritetään uudelleen vasta seuraavalla kierroksella
+                        written += self._isolate(rows)
+                    break
+                time.sleep(self.pause_s)
+        if written:
+            self.stats["written"] += written
+            metrics.inc("henry_spool_backfill_total", written, result="ok")
+        return written
+
+    def _isolate(self, rows: Sequence[SpoolRow]) -> int:
+        # Rivikohtaisesti: vain virheellinen rivi jää spooliin, muut menevät läpi
+        written = 0
+        for row in rows:
+            try:
+                self.spool.ack([row.id], self.sink([row]))
+                written += 1
+            except Exception as e:
+                if self.is_outage(e):
+                    break
+                attempts = self.spool.fail(row.id, str(e))
+                if attempts >= self.spool.max_attempts:
+                    self.stats["failed"] += 1
+                    metrics.inc("henry_spool_backfill_total", result="dead")
+                    log.error("spoolin rivi %d (%s) jäi viemättä %d yrityksen jälkeen: %s",
+                              row.id, row.kind, attempts, e)
+        return written
@@ -0,0 +1,224 @@
+"""
+SQLite-backend chat-lokille.
+
+- WAL-tila ja viritetyt pragmat (lukijat eivät blokkaa kirjoittajaa eivätkä toisiaan)
+- yksi uudelleenkäytetty yhteys per säie (threading.local)
+- kirjoitukset BEGIN IMMEDIATE -transaktiossa + busy_timeout → useampi Streamlit-sessio
+  ja prosessi voivat kirjoittaa samaan /mount/data/chatlogs.db:hen turvallisesti
+- skeemamigraatiot PRAGMA user_version -numeroinnilla, ajetaan kerran per prosessi
+"""
+
+import logging
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterator, List, Union
+
+log = logging.getLogger(__name__)
+
+# Migraatiot järjestyksessä; indeksi+1 = user_version migraation jälkeen.
+# Jokainen askel on SQL-lista tai funktio(conn). Uudet askeleet lisätään aina loppuun.
+Migration = Union[List[str], Callable[[sqlite3.Connection], None]]
+
+
+def _search_index(conn: sqlite3.Connection) -> None:
+    # FTS5-hakuindeksi (henry_agent.search). Triggerit pitävät uudet rivit ajan tasalla;
+    # olemassa olevat (<= backfill_upto) ja pakatut rungot indeksoi taustasäie erissä,
+    # joten migraatio ei lue koko taulua kirjoituslukon alla.
+    try:
+        conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5("
+                     "content, tokenize = 'unicode61 remove_diacritics 2', prefix = '3')")
+    except sqlite3.OperationalError as e:
+        if "fts5" not in str(e).lower():
+            raise
+        log.warning("SQLite ilman FTS5:tä: viestihaku ei käytettävissä")
+        return
+    conn.execute("CREATE TABLE IF NOT EXISTS search_pending (id INTEGER PRIMARY KEY)")
+    conn.execute("CREATE TABLE IF NOT EXISTS search_meta (key TEXT PRIMARY KEY, value INTEGER)")
+    conn.execute("INSERT OR IGNORE INTO search_meta (key, value) "
+                 "SELECT 'backfill_upto', COALESCE(MAX(id), 0) FROM messages")
+    conn.execute("""
+    CREATE TRIGGER IF NOT EXISTS trg_messages_fts_insert AFTER INSERT ON messages BEGIN
+        INSERT INTO messages_fts (rowid, content) SELECT new.id, new.content WHERE new.content IS NOT NULL;
+        INSERT OR IGNORE INTO search_pending (id) SELECT new.id WHERE new.content IS NULL AND new.content_z IS NOT NULL;
+    END;""")
+    conn.execute("""
+    CREATE TRIGGER IF NOT EXISTS trg_messages_fts_delete AFTER DELETE ON messages BEGIN
+        DELETE FROM messages_fts WHERE rowid = old.id;
+        DELETE FROM search_pending WHERE id = old.id;
+    END;""")
+
+
+MIGRATIONS: List[Migration] = [
+    # 1: alkuperäinen skeema
+    [
+        """
+        CREATE TABLE IF NOT EXISTS conversations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT,
+            started_at TEXT,
+            ended_at TEXT,
+            consent INTEGER DEFAULT 1,
+            user_agent TEXT
+        );""",
+        """
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            conversation_id INTEGER,
+            role TEXT,
+            content TEXT,
+            ts TEXT,
+            FOREIGN KEY(conversation_id) REFERENCES conversations(id)
+        );""",
+    ],
+    # 2: fetch_messages hakee keskustelun viestit id-järjestyksessä ilman täyttä taulukeskausta
+    [
+        "CREATE INDEX IF NOT EXISTS idx_messages_conv_id ON messages (conversation_id, id);",
+    ],
+    # 3: sisältöosoitteinen prompt-varasto (keskustelu viittaa promptiin) + pakatut viestirungot
+    [
+        """
+        CREATE TABLE IF NOT EXISTS prompts (
+            id TEXT PRIMARY KEY,
+            content TEXT,
+            content_z BLOB,
+            created_at TEXT
+        );""",
+        "ALTER TABLE conversations ADD COLUMN prompt_id TEXT REFERENCES prompts(id);",
+        "ALTER TABLE messages ADD COLUMN content_z BLOB;",
+    ],
+    # 4: vastausvälimuisti (henry_agent.answer_cache)
+    [
+        """
+        CREATE TABLE IF NOT EXISTS answer_cache (
+            key TEXT PRIMARY KEY,
+            partition TEXT,
+            question TEXT,
+            answer TEXT,
+            created_at REAL
+        );""",
+        "CREATE INDEX IF NOT EXISTS idx_answer_cache_created ON answer_cache (created_at);",
+    ],
+    # 5: jatkettavat keskustelut (URL:n ?c=<token> → conversation_id)
+    [
+        "ALTER TABLE conversations ADD COLUMN resume_token TEXT;",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_conversations_resume_token ON conversations (resume_token);",
+    ],
+    # 6: jaettu sessiotila (henry_agent.session_store), versio optimistiseen lukitukseen
+    [
+        """
+        CREATE TABLE IF NOT EXISTS session_state (
+            sid TEXT PRIMARY KEY,
+            version INTEGER NOT NULL,
+            data BLOB,
+            updated_at TEXT
+        );""",
+    ],
+    # 7: Postgres-katkosten spooli (henry_agent.spool) + väliaikaisten keskustelu-id:iden vastaavuudet
+    [
+        """
+        CREATE TABLE IF NOT EXISTS pg_spool (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            spool_key TEXT NOT NULL,
+            conversation_id INTEGER NOT NULL,
+            user_id TEXT,
+            user_agent TEXT,
+            resume_token TEXT,
+            role TEXT,
+            content TEXT,
+            content_z BLOB,
+            prompt_id TEXT,
+            ts TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            error TEXT
+        );""",
+        "CREATE INDEX IF NOT EXISTS idx_pg_spool_conv ON pg_spool (conversation_id, id);",
+        """
+        CREATE TABLE IF NOT EXISTS pg_spool_ids (
+            local_id INTEGER PRIMARY KEY,
+            pg_id INTEGER NOT NULL,
+            mapped_at TEXT
+        );""",
+    ],
+    # 8: viestien kokotekstihaku (FTS5 + triggerit, ks. _search_index)
+    _search_index,
+]
+
+PRAGMAS = (
+    # Vain uudelle tiedostolle: SQLite hyväksyy tilan ennen WAL-tilaa ja ensimmäistä taulua
+    # (siksi ei migraationa). Vanhat kannat: kertaluontoinen `retention vacuum`.
+    "PRAGMA auto_vacuum=INCREMENTAL;",
+    "PRAGMA journal_mode=WAL;",
+    "PRAGMA synchronous=NORMAL;",     # WAL + NORMAL: kestävä sovelluskaatumisessa, ei fsynciä joka commitissa
+    "PRAGMA temp_store=MEMORY;",
+    "PRAGMA cache_size=-8000;",       # ~8 MB sivuvälimuisti per yhteys
+    "PRAGMA mmap_size=67108864;",     # 64 MB muistikartoitettua lukua
+)
+
+
+class SqliteBackend:
+    def __init__(self, path: str, busy_timeout_ms: int = 5000, write_retries: int = 5):
+        self.path = path
+        self.busy_timeout_ms = busy_timeout_ms
+        self.write_retries = write_retries
+        self._local = threading.local()
+        self._migrated = False
+        self._migrate_lock = threading.Lock()
+
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # isolation_level=None: transaktiot hallitaan itse (BEGIN IMMEDIATE kirjoituksille)
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout_ms / 1000, isolation_level=None)
+            conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)};")
+            for p in PRAGMAS:
+                conn.execute(p)
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def write(self) -> Iterator[sqlite3.Connection]:
+        """Kirjoitustransaktio: lukko otetaan heti alussa, lukittu kanta → uusi yritys backoffilla."""
+        conn = self.connection()
+        for attempt in range(self.write_retries + 1):
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                break
+            except sqlite3.OperationalError as e:
+                if attempt == self.write_retries or "locked" not in str(e).lower():
+                    raise
+                time.sleep(min(1.0, 0.05 * 2 ** attempt))
+        try:
+            yield conn
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def migrate(self) -> int:
+        # Kerran per prosessi; user_version luetaan lukon sisällä, joten rinnakkaiset
+        # prosessit eivät aja samaa askelta kahdesti.
+        if self._migrated:
+            return len(MIGRATIONS)
+        with self._migrate_lock:
+            if self._migrated:
+                return len(MIGRATIONS)
+            with self.write() as conn:
+                version = conn.execute("PRAGMA user_version").fetchone()[0]
+                for i, step in enumerate(MIGRATIONS[version:], start=version + 1):
+                    if callable(step):
+                        step(conn)
+                    else:
+                        for sql in step:
+                            conn.execute(sql)
+                    conn.execute(f"PRAGMA user_version={i}")
+            self._migrated = True
+        return len(MIGRATIONS)
+
+    def close(self) -> None:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
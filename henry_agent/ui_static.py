@@ -0,0 +1,67 @@
+"""
+UI:n staattiset palat, rakennettu kerran per prosessi.
+
+Streamlit ajaa skriptin uudelleen jokaisella interaktiolla; tänne siirretyt
+CSS, hero-HTML, governance-kaavio ja KPI-taulukko eivät rakennu joka kerta uudestaan.
+pandas tuodaan vasta, kun KPI-taulukkoa oikeasti tarvitaan.
+"""
+
+from functools import lru_cache
+
+TOOLBAR_CSS = "<style>header [data-testid='stToolbar']{display:none!important}</style>"
+
+# Kevyt CSS
+CSS = """
+<style>
+.hero {
+  display: flex; flex-direction: column; align-items: center; text-align: center;
+  gap: 14px; padding: 28px; margin: 6px 0 14px 0;
+  border-radius: 18px; border: 1px solid rgba(120,120,120,0.2);
+  background: linear-gradient(180deg, rgba(150,150,150,0.06), rgba(120,120,120,0.04));
+}
+.hero img { width: 120px; height: 120px; border-radius: 50%; box-shadow: 0 6px 24px rgba(0,0,0,0.15); object-fit: cover; }
+.hero h1 { font-size: 1.6rem; margin: 0; }
+.hero p { margin: 0; opacity: 0.85; }
+.footer-note { opacity:0.7; font-size: 0.9rem; margin-top: 8px;}
+</style>
+"""
+
+
+@lru_cache(maxsize=8)
+def hero_html(avatar_url: str) -> str:
+    return f"""
+<div class="hero">
+  <img src="{avatar_url}" alt="Henry avatar" />
+  <h1>Agentti-Henry</h1>
+  <p>Markkinointitaustainen data- ja AI-asiantuntija. Tutustu Henryyn täällä! ✨</p>
+  <div class="footer-note">CV, projektit tai harrastukset. Kysymällä selviää!</div>
+</div>
+"""
+
+
+GOVERNANCE_DOT = r"""
+digraph G {
+  rankdir=LR;
+  node [shape=box, style="rounded,filled", color="#444444", fillcolor="#f5f5f5"];
+  edge [color="#888888"];
+  A [label="Käyttötapaus & riskiluokitus\n(EU AI Act)"];
+  B [label="Data governance\n(omistajuus • laatu • DPIA)"];
+  C [label="Mallikehitys\n(MLOps/LLMOps)"];
+  D [label="Validoi & hyväksy\n(kriteerit, fairness, selitettävyys)"];
+  E [label="Pilotointi\n(SLA/KPI seuranta)"];
+  F [label="Tuotanto\n(drift, kustannus, audit trail)"];
+  A -> B -> C -> D -> E -> F;
+}"""
+
+KPI_COLUMNS = ["Alue", "Mittari", "Nykytila", "Tavoite", "Huomio"]
+KPI_ROWS = [
+    ("Asiakaspalvelu Copilot", "TTFR (time-to-first-response)", "90 s", "≤ 30 s", "LLM-luonnos + tietopohja"),
+    ("Asiakaspalvelu Copilot", "CSAT", "3.9 / 5", "≥ 4.3 / 5", "sävy & faktat kohdilleen"),
+    ("Sisäinen RAG-haku", "nDCG@5", "—", "≥ 0.85", "prosessidokit lähteiksi"),
+]
+
+
+@lru_cache(maxsize=1)
+def kpi_table():
+    import pandas as pd  # laiska tuonti: tarvitaan vain kpi-intentillä
+    return pd.DataFrame(KPI_ROWS, columns=KPI_COLUMNS)
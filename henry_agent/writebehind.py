@@ -0,0 +1,154 @@
+"""
+Write-behind-loggaus: viestit jonoon, taustasäie kirjoittaa ne erissä.
+
+- Flush koon (batch_size) tai ajan (flush_interval_s) mukaan, sekä sammuessa (atexit).
+- Yksi kirjoittajasäie ja FIFO-jono → saman keskustelun viestit kirjoitetaan
+  aina lähetysjärjestyksessä; epäonnistunutta erää yritetään uudelleen ennen seuraavaa.
+- Rajattu jono ja eksplisiittinen backpressure-politiikka:
+    * "block": kutsuja odottaa enintään block_timeout_s, sitten viesti pudotetaan (dropped-laskuri)
+    * "drop":  täydestä jonosta pudotetaan uusi viesti heti
+  Järjestys ei kummassakaan rikkoudu; pudotukset näkyvät statsissa ja lokissa.
+"""
+
+import atexit
+import logging
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+log = logging.getLogger(__name__)
+
+Row = Tuple[Any, ...]
+
+POLICIES = ("block", "drop")
+
+
+class _Flush:
+    __slots__ = ("done",)
+
+    def __init__(self):
+        self.done = threading.Event()
+
+
+_STOP = object()
+
+
+class WriteBehindLogger:
+    def __init__(
+        self,
+        sink: Callable[[Sequence[Row]], None],
+        batch_size: int = 50,
+        flush_interval_s: float = 0.25,
+        max_queue: int = 2000,
+        policy: str = "block",
+        block_timeout_s: float = 2.0,
+        retries: int = 3,
+    ):
+        if policy not in POLICIES:
+            raise ValueError(f"tuntematon backpressure-politiikka: {policy!r} (sallitut: {', '.join(POLICIES)})")
+        self.sink = sink
+        self.batch_size = max(1, batch_size)
+        self.flush_interval_s = flush_interval_s
+        self.policy = policy
+        self.block_timeout_s = block_timeout_s
+        self.retries = retries
+        self._q: "queue.Queue[Any]" = queue.Queue(maxsize=max(1, max_queue))
+        self._closed = False
+        self.stats: Dict[str, float] = {
+            "submitted": 0, "written": 0, "batches": 0, "dropped": 0,
+            "failed_batches": 0, "max_depth": 0, "last_batch_ms": 0.0, "write_ms_total": 0.0,
+        }
+        self._thread = threading.Thread(target=self._run, name="chatlog-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    # ---------- tuottajapuoli ----------
+    def submit(self, row: Row) -> bool:
+        if self._closed:
+            self.sink([row])
+            return True
+        try:
+            if self.policy == "block":
+                self._q.put(row, timeout=self.block_timeout_s)
+            else:
+                self._q.put_nowait(row)
+        except queue.Full:
+            self.stats["dropped"] += 1
+            log.warning("chat-lokin jono täynnä (%d); viesti pudotettiin", self._q.maxsize)
+            return False
+        self.stats["submitted"] += 1
+        depth = self._q.qsize()
+        if depth > self.stats["max_depth"]:
+            self.stats["max_depth"] = depth
+        return True
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """Odottaa, että kaikki tähän mennessä jonotetut rivit on kirjoitettu."""
+        if self._closed or not self._thread.is_alive():
+            return True
+        marker = _Flush()
+        try:
+            self._q.put(marker, timeout=timeout)
+        except queue.Full:
+            return False
+        return marker.done.wait(timeout)
+
+    def depth(self) -> int:
+        return self._q.qsize()
+
+    def close(self, timeout: float = 10.0) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self._q.put(_STOP, timeout=timeout)
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+
+    # ---------- kirjoittajasäie ----------
+    def _write(self, batch: List[Row]) -> None:
+        t0 = time.perf_counter()
+        for attempt in range(self.retries + 1):
+            try:
+                self.sink(batch)
+                self.stats["written"] += len(batch)
+                self.stats["batches"] += 1
+                self.stats["last_batch_ms"] = round((time.perf_counter() - t0) * 1000, 2)
+                self.stats["write_ms_total"] += self.stats["last_batch_ms"]
+                return
+            except Exception as e:
+                if attempt == self.retries:
+                    self.stats["failed_batches"] += 1
+                    self.stats["dropped"] += len(batch)
+                    log.error("chat-lokin erä (%d riviä) epäonnistui lopullisesti: %s", len(batch), e)
+                    return
+                time.sleep(min(2.0, 0.1 * 2 ** attempt))
+
+    def _run(self) -> None:
+        batch: List[Row] = []
+        deadline: Optional[float] = None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = self._q.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if item is None or isinstance(item, _Flush) or item is _STOP:
+                if batch:
+                    self._write(batch)
+                    batch, deadline = [], None
+                if isinstance(item, _Flush):
+                    item.done.set()
+                elif item is _STOP:
+                    return
+                continue
+
+            batch.append(item)
+            if deadline is None:
+                deadline = time.monotonic() + self.flush_interval_s
+            if len(batch) >= self.batch_size:
+                self._write(batch)
+                batch, deadline = [], None
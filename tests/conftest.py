@@ -0,0 +1,29 @@
+"""
+Testit ajetaan erillisessä hakemistossa pelkällä SQLitellä: moduulitason asetukset
+(CHATLOG_DB_PATH, DATABASE_URL, ...) luetaan tuonnissa, joten ne asetetaan ennen
+henry_agentin tuontia.
+"""
+
+import os
+import sys
+import tempfile
+
+import pytest
+
+_TMP = tempfile.mkdtemp(prefix="henry-tests-")
+os.environ.update(
+    CHATLOG_DB_PATH=os.path.join(_TMP, "chatlogs.db"),
+    DATABASE_URL="",
+    RETRIEVAL_INDEX_DIR=os.path.join(_TMP, "index"),
+    ANSWER_CACHE="0",
+    SEARCH_INDEX="0",
+    MAINTENANCE_INTERVAL_S="0",
+)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope="session", autouse=True)
+def _schema():
+    from henry_agent import db
+
+    db.init_db({})
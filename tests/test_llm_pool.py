@@ -0,0 +1,29 @@
+"""llm: striimatut kutsut palauttavat yhteyden pooliin (benchmarks.openai_stub)."""
+
+import pytest
+
+from benchmarks import openai_stub
+from henry_agent import llm
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    server, _cfg = openai_stub.serve(0, ttft_ms=5, token_ms=1, tokens=20)
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    monkeypatch.setenv("OPENAI_BASE_URL", f"http://127.0.0.1:{server.server_port}/v1")
+    monkeypatch.setattr(llm, "CONN_STATS", llm.ConnStats())
+    monkeypatch.setattr(llm, "_HTTP", None)
+    monkeypatch.setattr(llm, "_CLIENT", None)
+    yield server
+    if llm._HTTP is not None:
+        llm._HTTP.close()
+    server.shutdown()
+
+
+def test_streamed_calls_reuse_pooled_connection(stub):
+    client = llm.get_client()
+    for _ in range(2):
+        assert "".join(llm.stream_chat(client, [{"role": "user", "content": "hei"}]))
+    stats = llm.CONN_STATS.snapshot()
+    assert stats["requests"] == 2
+    assert stats["reuse_ratio"] > 0
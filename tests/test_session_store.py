@@ -0,0 +1,95 @@
+"""session_store: versiotarkistettu tallennus, replikoiden yhdistäminen ja tilan ikkunointi."""
+
+import secrets
+
+import pytest
+
+from henry_agent import agent, db, session_store
+
+
+@pytest.fixture(params=["memory", "db"])
+def store(request, monkeypatch):
+    s = session_store.MemoryStore() if request.param == "memory" else session_store.DbStore()
+    monkeypatch.setattr(session_store, "_STORE", s)
+    return s
+
+
+def _state(conversation_id: int = 1) -> dict:
+    state: dict = {}
+    agent.init_state(state)
+    state["conversation_id"] = conversation_id
+    state["user_turns"] = 0
+    return state
+
+
+def _turn(state: dict, text: str) -> None:
+    state["messages"] += [{"role": "user", "content": text}, {"role": "assistant", "content": text.lower()}]
+    state["user_turns"] += 1
+    state["turn_timings"].append({"turn": state["user_turns"]})
+
+
+def _contents(state: dict) -> list:
+    return [m["content"] for m in state["older_messages"] + state["messages"] if m["role"] != "system"]
+
+
+def test_stale_write_is_rejected(store):
+    sid = secrets.token_hex(6)
+    assert store.put(sid, {"n": 1}, None) == 1
+    assert store.put(sid, {"n": 2}, None) is None     # rivi on jo olemassa
+    assert store.put(sid, {"n": 2}, 1) == 2
+    assert store.put(sid, {"n": 3}, 1) is None        # vanhentunut versio: ei kirjoiteta
+    assert store.get(sid) == (2, {"n": 2})
+
+
+def test_concurrent_replicas_append_their_turns(store):
+    sid = secrets.token_hex(6)
+    a = _state()
+    a["messages"] += [{"role": "system", "content": "SYS"}, {"role": "assistant", "content": "hei"}]
+    session_store.save(a, sid)
+    b = _state()
+    assert session_store.load(b, sid)
+
+    _turn(a, "A1")
+    _turn(b, "B1")
+    b["job_ad"] = {"sha": "x"}
+    session_store.save(a, sid)
+    session_store.save(b, sid)        # ristiriita → luetaan a:n tila ja lisätään B1 perään
+    _turn(a, "A2")
+    session_store.save(a, sid)        # ristiriita → luetaan b:n tila ja lisätään A2 perään
+
+    c = _state()
+    assert session_store.load(c, sid)
+    assert [m["content"] for m in c["messages"]] == ["SYS", "hei", "A1", "a1", "B1", "b1", "A2", "a2"]
+    assert c["user_turns"] == 3
+    assert [t["turn"] for t in c["turn_timings"]] == [1, 1, 2]
+    assert c["job_ad"] == {"sha": "x"}
+    assert c[session_store.VERSION_KEY] == 4
+
+
+def test_snapshot_keeps_recent_window_and_older_history_pages_from_the_end(store, monkeypatch):
+    monkeypatch.setattr(agent, "HISTORY_PAGE", 7)
+    sid = secrets.token_hex(6)
+    a = _state(db.start_conversation({}, "user-test", "pytest", resume_token=sid))
+    for i in range(30):
+        for role in ("user", "assistant"):
+            a["messages"].append({"role": role, "content": f"{role}-{i}"})
+            db.enqueue_message(a, a["conversation_id"], role, f"{role}-{i}")
+    a["context_state"].folded = 56
+    full = _contents(a)
+
+    snap = session_store.snapshot(a)
+    assert len(snap["messages"]) == session_store.SNAPSHOT_MESSAGES
+    assert snap["context_state"]["folded"] == 56 - (60 - session_store.SNAPSHOT_MESSAGES)
+    assert snap["oldest_id"] is None and snap["has_older"] is True
+    session_store.save(a, sid)
+
+    b = _state()
+    assert session_store.load(b, sid)
+    assert _contents(b) == full[-session_store.SNAPSHOT_MESSAGES:]
+    pages = 0
+    while b["has_older"]:
+        assert agent.load_older(b)
+        pages += 1
+    assert _contents(b) == full
+    assert pages == 6                 # 40 vanhempaa viestiä 7 viestin sivuina
+    assert b["oldest_id"] is not None